@@ -1,4 +1,5 @@
 # door_tracker/apps.py
+import os
 import threading
 
 from django.apps import AppConfig
@@ -10,10 +11,15 @@ class DoorTrackerConfig(AppConfig):
     name = 'door_tracker'
 
     def ready(self):
+        from django.conf import settings
+
         from .backup_scheduler import start
 
-        # Start scheduler in background thread
-        threading.Thread(target=start, daemon=True).start()
+        # Only in the process that serves requests under runserver, not in
+        # its autoreloader or other management commands; asgi.py starts it
+        # under daphne
+        if settings.SCHEDULER and os.environ.get('RUN_MAIN') == 'true':
+            threading.Thread(target=start, daemon=True).start()
 
 
 class DoorTrackerAdminConfig(AdminConfig):
@@ -13,4 +13,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'door_tracker.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after setup, since it needs the app registry
+from django.conf import settings
+from midas import directory, presence, sockets
+
+from door_tracker.backup_scheduler import start
+
+# scanners can also connect over a WebSocket, see midas/sockets.py
+application = sockets.route(django_application)
+
+directory.warm_up()
+presence.warm_up()
+
+if settings.SCHEDULER:
+    start()
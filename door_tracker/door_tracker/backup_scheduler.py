@@ -1,17 +1,76 @@
 # door_tracker/backup_scheduler.py
+"""Scheduled jobs.
+
+Every server process starts a scheduler, paused. They compete for a lease
+in the database (see `midas.leases`), and only the holder resumes its
+scheduler, so jobs run once no matter how many workers there are. The
+holder renews the lease every HEARTBEAT seconds; when it stops doing so,
+another process takes over within LEASE_TTL seconds.
+"""
+
+import atexit
 import logging
-import os
+import threading
 
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
+from django.conf import settings
 from django.core.management import call_command
+from django.db import DatabaseError, close_old_connections, connection
+from django_apscheduler import util
 from django_apscheduler.jobstores import DjangoJobStore
+from midas import changes, leases, liveness
 
 logger = logging.getLogger(__name__)
 
+LEASE_NAME = 'scheduler'
+LEASE_TTL = 60  # seconds
+HEARTBEAT = LEASE_TTL / 4
+# heavy jobs run one at a time, away from the light ones
+HEAVY_JOB_WORKERS = 1
+
+_scheduler = None
 
+
+@util.close_old_connections
 def backup_website_job():
     logger.info('Running backup_website command...')
-    call_command('backup_website')
+    call_command('backup_website', incremental=settings.BACKUP_INCREMENTAL)
+
+
+@util.close_old_connections
+def sqlite_maintenance_job(checkpoint='PASSIVE'):
+    """Checkpoint the WAL and let SQLite refresh its planner statistics.
+
+    PASSIVE never makes scans wait; TRUNCATE also shrinks the WAL file, but
+    blocks writers while it runs, so it only runs at night.
+    """
+    if checkpoint not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+        raise ValueError(f'Unknown checkpoint mode: {checkpoint}')
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA wal_checkpoint({checkpoint})')
+        busy, log_pages, checkpointed = cursor.fetchone()
+        cursor.execute('PRAGMA optimize')
+    logger.info(
+        'SQLite %s checkpoint: %s of %s WAL pages written back%s',
+        checkpoint,
+        checkpointed,
+        log_pages,
+        ' (busy)' if busy else '',
+    )
+
+
+@util.close_old_connections
+def scanner_sweep_job():
+    liveness.sweep()
+
+
+@util.close_old_connections
+def prune_changes_job():
+    pruned = changes.prune()
+    logger.info('Pruned %s session changes', pruned)
 
 
 # def update_statistics_job():
@@ -19,12 +78,63 @@ def backup_website_job():
 #     call_command('update_statistics')
 
 
+class LeaderScheduler:
+    """Runs `scheduler` while this process holds the scheduler lease."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.holder = leases.new_holder()
+        self.leader = False
+        self.stopped = threading.Event()
+
+    def heartbeat(self):
+        try:
+            leader = leases.acquire(LEASE_NAME, self.holder, LEASE_TTL)
+        except DatabaseError:
+            logger.exception('Could not renew the scheduler lease')
+            close_old_connections()
+            leader = False
+
+        if leader and not self.leader:
+            logger.info('Elected to run scheduled jobs as %s', self.holder)
+            self.scheduler.resume()
+        elif not leader and self.leader:
+            logger.warning('Lost the scheduler lease, pausing scheduled jobs')
+            self.scheduler.pause()
+        self.leader = leader
+
+    def run(self):
+        self.heartbeat()
+        while not self.stopped.wait(HEARTBEAT):
+            self.heartbeat()
+
+    def stop(self):
+        self.stopped.set()
+        if self.leader:
+            try:
+                leases.release(LEASE_NAME, self.holder)
+            except DatabaseError:
+                pass  # it expires by itself
+        self.scheduler.shutdown(wait=False)
+
+
 def start():
-    # Only start in the main process (avoid autoreloader double-start)
-    if os.environ.get('RUN_MAIN') != 'true':
+    global _scheduler
+    if _scheduler is not None:
         return
 
-    scheduler = BackgroundScheduler()
+    scheduler = BackgroundScheduler(
+        executors={
+            'default': ThreadPoolExecutor(4),
+            'heavy': ThreadPoolExecutor(HEAVY_JOB_WORKERS),
+        },
+        job_defaults={
+            'coalesce': True,
+            'max_instances': 1,
+            # still run a job that came due just before a change of leader
+            'misfire_grace_time': 60 * 60,
+        },
+    )
     scheduler.add_jobstore(DjangoJobStore(), 'default')
 
     scheduler.add_job(
@@ -33,6 +143,42 @@ def start():
         hour='23',
         minute='59',
         id='backup_website_job',
+        executor='heavy',
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        sqlite_maintenance_job,
+        trigger='interval',
+        minutes=15,
+        id='sqlite_maintenance_job',
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        sqlite_maintenance_job,
+        trigger='cron',
+        hour='4',
+        minute='0',
+        kwargs={'checkpoint': 'TRUNCATE'},
+        id='sqlite_truncate_job',
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        scanner_sweep_job,
+        trigger='interval',
+        minutes=1,
+        id='scanner_sweep_job',
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        prune_changes_job,
+        trigger='cron',
+        hour='3',
+        minute='30',
+        id='prune_changes_job',
+        executor='heavy',
         replace_existing=True,
     )
 
@@ -44,5 +190,8 @@ def start():
     #     replace_existing=True,
     # )
 
-    scheduler.start()
+    scheduler.start(paused=True)
+    _scheduler = LeaderScheduler(scheduler)
+    threading.Thread(target=_scheduler.run, daemon=True, name='scheduler').start()
+    atexit.register(_scheduler.stop)
     logger.info('Scheduler started!')
@@ -0,0 +1,283 @@
+"""Places to upload backups to.
+
+A backend receives an upload as a sequence of chunks, and can tell how much
+of it it has received so far, so an interrupted upload is resumed where it
+stopped instead of starting over. See `door_tracker.backup_upload`.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import httplib2
+from django.conf import settings
+from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+
+
+class TransientUploadError(Exception):
+    """A chunk did not arrive, but sending it again may work."""
+
+
+class BackupStorage:
+    """Interface of storage backends.
+
+    Files are identified by name; uploads by the string start() returns.
+    """
+
+    def list(self, prefix=''):
+        """Return the names of the files starting with `prefix`."""
+        raise NotImplementedError
+
+    def read(self, name):
+        """Return the contents of a file."""
+        raise NotImplementedError
+
+    def delete(self, name):
+        """Remove a file."""
+        raise NotImplementedError
+
+    def start(self, name, content_type):
+        """Begin uploading a file called `name` and return the upload."""
+        raise NotImplementedError
+
+    def received(self, upload):
+        """Return how many bytes of the upload have arrived."""
+        raise NotImplementedError
+
+    def write(self, upload, offset, data, total=None):
+        """Store `data` at `offset`. `total` is given with the last chunk.
+
+        Returns where the finished file can be found after the last chunk.
+        """
+        raise NotImplementedError
+
+
+class LocalStorage(BackupStorage):
+    """Stores backups in a directory, for tests and air-gapped deployments.
+
+    Files are written as `<name>.part` and renamed once complete.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def list(self, prefix=''):
+        if not self.directory.is_dir():
+            return []
+        return sorted(
+            path.name
+            for path in self.directory.glob(f'{prefix}*')
+            if path.suffix != '.part'
+        )
+
+    def read(self, name):
+        return (self.directory / name).read_bytes()
+
+    def delete(self, name):
+        (self.directory / name).unlink()
+
+    def start(self, name, content_type):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        part = self.directory / f'{name}.part'
+        part.touch()
+        return str(part)
+
+    def received(self, upload):
+        return Path(upload).stat().st_size
+
+    def write(self, upload, offset, data, total=None):
+        part = Path(upload)
+        with part.open('r+b') as file:
+            file.truncate(offset)
+            file.seek(offset)
+            file.write(data)
+        if total is not None:
+            path = part.with_suffix('')
+            part.rename(path)
+            return str(path)
+
+
+class DriveStorage(BackupStorage):
+    """Stores backups in a folder on a Google Shared Drive.
+
+    Uses the resumable upload protocol of the Drive API directly, since the
+    client library needs to know the size of a file before uploading it.
+    """
+
+    UPLOAD_URL = (
+        'https://www.googleapis.com/upload/drive/v3/files'
+        '?uploadType=resumable&supportsAllDrives=true&fields=id'
+    )
+
+    def __init__(self, credentials_file, shared_drive_id, folder_name, log=print):
+        self.credentials = service_account.Credentials.from_service_account_file(
+            credentials_file, scopes=['https://www.googleapis.com/auth/drive']
+        )
+        self.shared_drive_id = shared_drive_id
+        self.folder_name = folder_name
+        self.log = log
+        self.http = AuthorizedHttp(self.credentials)
+        self.service = build('drive', 'v3', credentials=self.credentials)
+        self.folder_id = None
+        # {name: file ID} of every file listed so far
+        self.file_ids = {}
+
+    def _folder_id(self):
+        if self.folder_id is None:
+            self.folder_id = self._find_folder()
+        return self.folder_id
+
+    def _find_folder(self):
+        service = self.service
+        results = (
+            service.files()
+            .list(
+                q=f"name='{self.folder_name}' and mimeType='application/vnd.google-apps.folder'",
+                corpora='drive',
+                driveId=self.shared_drive_id,
+                includeItemsFromAllDrives=True,
+                supportsAllDrives=True,
+                fields='files(id, name)',
+            )
+            .execute()
+        )
+        folders = results.get('files', [])
+        if folders:
+            folder_id = folders[0]['id']
+            self.log(f"Found folder '{self.folder_name}' with ID {folder_id}")
+            return folder_id
+
+        self.log(f"Folder '{self.folder_name}' not found. Creating it...")
+        folder = (
+            service.files()
+            .create(
+                body={
+                    'name': self.folder_name,
+                    'mimeType': 'application/vnd.google-apps.folder',
+                    'parents': [self.shared_drive_id],
+                },
+                supportsAllDrives=True,
+                fields='id, name',
+            )
+            .execute()
+        )
+        self.log(f"Created folder '{self.folder_name}' with ID {folder['id']}")
+        return folder['id']
+
+    def _files(self, prefix):
+        """{name: file ID} of the files in the folder starting with `prefix`."""
+        files = {}
+        page_token = None
+        while True:
+            results = (
+                self.service.files()
+                .list(
+                    q=f"'{self._folder_id()}' in parents and name contains '{prefix}'"
+                    ' and trashed=false',
+                    corpora='drive',
+                    driveId=self.shared_drive_id,
+                    includeItemsFromAllDrives=True,
+                    supportsAllDrives=True,
+                    fields='nextPageToken, files(id, name)',
+                    pageSize=1000,
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+            for file in results.get('files', []):
+                # "contains" also matches in the middle of words
+                if file['name'].startswith(prefix):
+                    files[file['name']] = file['id']
+            page_token = results.get('nextPageToken')
+            if page_token is None:
+                self.file_ids.update(files)
+                return files
+
+    def _file_id(self, name):
+        # a restore or prune touches many files: list the folder once for
+        # all of them, rather than once per file
+        if name not in self.file_ids:
+            self._files('')
+        return self.file_ids[name]
+
+    def list(self, prefix=''):
+        return sorted(self._files(prefix))
+
+    def read(self, name):
+        file_id = self._file_id(name)
+        return self.service.files().get_media(fileId=file_id).execute()
+
+    def delete(self, name):
+        file_id = self._file_id(name)
+        self.service.files().delete(fileId=file_id, supportsAllDrives=True).execute()
+        del self.file_ids[name]
+
+    def _request(self, uri, method, body=b'', headers=None):
+        try:
+            response, content = self.http.request(
+                uri, method, body=body, headers=headers or {}
+            )
+        except (OSError, httplib2.HttpLib2Error) as e:
+            raise TransientUploadError(str(e)) from e
+        if response.status == 429 or response.status >= 500:
+            raise TransientUploadError(f'Drive returned {response.status}')
+        if response.status not in (200, 201, 308):
+            raise RuntimeError(f'Drive returned {response.status}: {content!r}')
+        return response, content
+
+    def start(self, name, content_type):
+        response, _ = self._request(
+            self.UPLOAD_URL,
+            'POST',
+            body=json.dumps({'name': name, 'parents': [self._folder_id()]}),
+            headers={
+                'Content-Type': 'application/json; charset=UTF-8',
+                'X-Upload-Content-Type': content_type,
+            },
+        )
+        return response['location']
+
+    def received(self, upload):
+        response, _ = self._request(
+            upload, 'PUT', headers={'Content-Range': 'bytes */*'}
+        )
+        if response.status != 308 or 'range' not in response:
+            return 0
+        # e.g. "bytes=0-1048575"
+        return int(response['range'].rpartition('-')[2]) + 1
+
+    def write(self, upload, offset, data, total=None):
+        end = offset + len(data) - 1
+        size = '*' if total is None else total
+        content_range = f'bytes {offset}-{end}/{size}' if data else f'bytes */{size}'
+        _, content = self._request(
+            upload, 'PUT', body=bytes(data), headers={'Content-Range': content_range}
+        )
+        if total is not None:
+            file_id = json.loads(content)['id']
+            return f'https://drive.google.com/file/d/{file_id}/view?usp=drivesdk'
+
+
+def get_storage(storage=None, log=print):
+    """Return the storage named `storage`, by default BACKUP_STORAGE.
+
+    'drive' is the Shared Drive from the settings; anything else is taken to
+    be a local directory.
+    """
+    if storage is None:
+        storage = settings.BACKUP_STORAGE
+    if storage != 'drive':
+        return LocalStorage(storage)
+
+    SERVICE_ACCOUNT_FILE = os.getenv(
+        'DJANGO_BACKUP_CREDENTIALS_FILE',
+        (Path() / 'credentials' / 'service-account.json').absolute(),
+    )
+    return DriveStorage(
+        SERVICE_ACCOUNT_FILE,
+        settings.BACKUP_SHARED_DRIVE_ID,
+        settings.BACKUP_FOLDER_NAME,
+        log=log,
+    )
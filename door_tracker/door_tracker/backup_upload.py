@@ -0,0 +1,131 @@
+"""Compressed, chunked and resumable uploads of backups.
+
+The snapshot is compressed as it is read and sent on in fixed-size chunks,
+so nothing is written to disk first. When a chunk fails to arrive, the
+storage is asked how much it received and the rest is sent again, after
+waiting longer each time.
+"""
+
+import time
+import zlib
+
+from .backup_storage import TransientUploadError
+
+try:
+    from compression import zstd
+except ImportError:  # pragma: no cover, before Python 3.14
+    zstd = None
+
+# Google Drive wants chunks in multiples of 256 KiB
+CHUNK_SIZE = 8 * 256 * 1024
+RETRIES = 5
+BACKOFF = 1.0  # seconds, doubled after every failed attempt
+
+COMPRESSIONS = {
+    'zstd': ('.zst', 'application/zstd'),
+    'gzip': ('.gz', 'application/gzip'),
+}
+DEFAULT_COMPRESSION = 'zstd' if zstd is not None else 'gzip'
+
+
+def compress(chunks, method=DEFAULT_COMPRESSION):
+    """Compress a stream of bytes with zstd or gzip, lazily."""
+    if method == 'zstd':
+        if zstd is None:
+            raise ValueError('zstd compression needs Python 3.14 or later')
+        compressor = zstd.ZstdCompressor()
+        flush = compressor.flush
+    elif method == 'gzip':
+        compressor = zlib.compressobj(wbits=31)  # 31: with a gzip header
+        flush = compressor.flush
+    else:
+        raise ValueError(f'Unknown compression: {method}')
+
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield flush()
+
+
+def decompress(data, method):
+    """Undo compress() on a whole file."""
+    if method == 'zstd':
+        if zstd is None:
+            raise ValueError('zstd compression needs Python 3.14 or later')
+        return zstd.decompress(data)
+    if method == 'gzip':
+        return zlib.decompress(data, wbits=31)
+    raise ValueError(f'Unknown compression: {method}')
+
+
+def rechunk(chunks, size):
+    """Regroup a stream of bytes into chunks of exactly `size` bytes.
+
+    Only the last chunk can be shorter.
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def upload(
+    storage,
+    name,
+    content_type,
+    chunks,
+    chunk_size=CHUNK_SIZE,
+    retries=RETRIES,
+    backoff=BACKOFF,
+    progress=None,
+    sleep=time.sleep,
+):
+    """Upload a stream of bytes to `storage` and return where it ended up.
+
+    Every chunk gets `retries` more attempts; each time only the part the
+    storage did not receive is sent again. `progress(bytes_sent)` is called
+    after every chunk.
+    """
+    upload_id = storage.start(name, content_type)
+    offset = 0
+
+    chunks = rechunk(chunks, chunk_size)
+    chunk = next(chunks, b'')
+    while True:
+        # look ahead, to know which chunk is the last one
+        following = next(chunks, None)
+        total = offset + len(chunk) if following is None else None
+
+        sent = 0
+        for attempt in range(retries + 1):
+            try:
+                location = storage.write(upload_id, offset + sent, chunk[sent:], total)
+                break
+            except TransientUploadError:
+                if attempt == retries:
+                    raise
+                sleep(backoff * 2**attempt)
+                sent = _resume_point(storage, upload_id, offset, len(chunk))
+
+        offset += len(chunk)
+        if progress is not None:
+            progress(offset)
+        if following is None:
+            return location
+        chunk = following
+
+
+def _resume_point(storage, upload_id, offset, length):
+    """How much of the chunk at `offset` the storage already has."""
+    try:
+        received = storage.received(upload_id)
+    except TransientUploadError:
+        return 0
+    if received < offset:
+        raise RuntimeError('The storage lost part of the upload')
+    return min(received - offset, length)
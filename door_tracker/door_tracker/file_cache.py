@@ -0,0 +1,117 @@
+"""File-based cache, shared by all worker processes on one host.
+
+Django's FileBasedCache with three changes:
+
+- incr() and decr() are atomic across processes and keep the expiry of the
+  entry, since the generation counters of the directory and the statistics
+  cache are bumped from several workers and must never expire;
+- eviction removes the least recently used entries instead of random ones;
+  a hit marks an entry as used by touching its file, at most once a minute;
+- a process checks whether the cache is full at most once every
+  CULL_INTERVAL seconds, instead of listing the directory on every set().
+
+Needs no service besides the filesystem, and reading an entry does not
+touch the database, so it is safe to use from async code.
+"""
+
+import os
+import pickle
+import tempfile
+import time
+import zlib
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+from django.core.files.move import file_move_safe
+
+
+class FileCache(FileBasedCache):
+    CULL_INTERVAL = 10  # seconds
+    # how recent the last use of an entry has to be for a hit to not mark it
+    TOUCH_INTERVAL = 60  # seconds
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._lock_file = os.path.join(self._dir, 'incr.lock')
+        self._next_cull = 0
+
+    def get(self, key, default=None, version=None):
+        fname = self._key_to_file(key, version)
+        try:
+            with open(fname, 'rb') as f:
+                if self._is_expired(f):
+                    return default
+                value = pickle.loads(zlib.decompress(f.read()))
+                used = os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            return default
+        if used < time.time() - self.TOUCH_INTERVAL:
+            try:
+                os.utime(fname)  # recently used
+            except FileNotFoundError:
+                pass
+        return value
+
+    def _write_file(self, fname, expiry, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+        renamed = False
+        try:
+            with open(fd, 'wb') as f:
+                f.write(pickle.dumps(expiry, self.pickle_protocol))
+                f.write(zlib.compress(pickle.dumps(value, self.pickle_protocol)))
+            file_move_safe(tmp_path, fname, allow_overwrite=True)
+            renamed = True
+        finally:
+            if not renamed:
+                os.remove(tmp_path)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._createdir()  # Cache dir can be deleted at any time.
+        fname = self._key_to_file(key, version)
+        self._cull()
+        self._write_file(fname, self.get_backend_timeout(timeout), value)
+
+    def incr(self, key, delta=1, version=None):
+        self._createdir()
+        fname = self._key_to_file(key, version)
+        with open(self._lock_file, 'ab') as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                try:
+                    with open(fname, 'rb') as f:
+                        expiry = pickle.load(f)
+                        value = pickle.loads(zlib.decompress(f.read()))
+                except (FileNotFoundError, EOFError):
+                    raise ValueError(f"Key '{key}' not found") from None
+                if expiry is not None and expiry < time.time():
+                    raise ValueError(f"Key '{key}' not found")
+                value += delta
+                self._write_file(fname, expiry, value)
+            finally:
+                locks.unlock(lock)
+        return value
+
+    def _cull(self):
+        now = time.monotonic()
+        if now < self._next_cull:
+            return
+        self._next_cull = now + self.CULL_INTERVAL
+
+        filelist = self._list_cache_files()
+        if len(filelist) < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+
+        entries = []
+        for fname in filelist:
+            try:
+                entries.append((os.stat(fname).st_mtime, fname))
+            except FileNotFoundError:
+                pass  # removed by another process
+        entries.sort()
+        # down to (1 - 1 / CULL_FREQUENCY) of MAX_ENTRIES
+        excess = len(entries) - self._max_entries
+        for _, fname in entries[: excess + self._max_entries // self._cull_frequency]:
+            self._delete(fname)
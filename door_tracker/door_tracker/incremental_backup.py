@@ -0,0 +1,166 @@
+"""Content-addressed incremental backups.
+
+A snapshot is split into fixed-size chunks, which are stored under the hash
+of their contents, so a chunk that did not change since an earlier backup
+is not stored again. A manifest lists the chunks of one snapshot, in order.
+Most of a night's changes land in the last pages of the session and log
+tables and their indexes, so a backup costs about as much as that day's
+churn rather than the whole database.
+
+Storage layout, flat so that it also works in a Drive folder:
+
+    chunk-<sha256>.<extension>       a compressed chunk
+    manifest-<YYYYmmdd_HHMMSS>.json  the list of chunks of one snapshot
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from .backup_upload import COMPRESSIONS, DEFAULT_COMPRESSION, compress, decompress
+from .backup_upload import upload as upload_file
+
+# a multiple of the SQLite page size, so that a changed page touches one chunk
+CHUNK_SIZE = 64 * 1024
+
+MANIFEST_PREFIX = 'manifest-'
+CHUNK_PREFIX = 'chunk-'
+TIME_FORMAT = '%Y%m%d_%H%M%S'
+
+KEEP_DAILY = 30  # days
+KEEP_WEEKLY = 52  # weeks
+
+
+def manifest_name(created):
+    return f'{MANIFEST_PREFIX}{created.strftime(TIME_FORMAT)}.json'
+
+
+def manifest_time(name):
+    return datetime.strptime(
+        name.removeprefix(MANIFEST_PREFIX).removesuffix('.json'), TIME_FORMAT
+    )
+
+
+def chunk_name(digest, compression):
+    extension, _ = COMPRESSIONS[compression]
+    return f'{CHUNK_PREFIX}{digest}{extension}'
+
+
+def split(snapshot, chunk_size=CHUNK_SIZE):
+    """Return (SHA-256 hex digest, data) of every chunk of the snapshot."""
+    view = memoryview(snapshot)
+    return [
+        (hashlib.sha256(view[i : i + chunk_size]).hexdigest(), view[i : i + chunk_size])
+        for i in range(0, len(view), chunk_size)
+    ]
+
+
+def backup(
+    storage,
+    snapshot,
+    created,
+    compression=DEFAULT_COMPRESSION,
+    chunk_size=CHUNK_SIZE,
+):
+    """Store the chunks of the snapshot that are new, then its manifest.
+
+    Returns (manifest name, number of chunks stored, bytes stored).
+    """
+    stored = set(storage.list(CHUNK_PREFIX))
+    chunks = split(snapshot, chunk_size)
+
+    new_chunks = 0
+    new_bytes = 0
+    for digest, data in chunks:
+        name = chunk_name(digest, compression)
+        if name in stored:
+            continue
+        compressed = b''.join(compress([data], compression))
+        upload_file(storage, name, 'application/octet-stream', [compressed])
+        stored.add(name)
+        new_chunks += 1
+        new_bytes += len(compressed)
+
+    # the manifest goes last, so it only ever refers to stored chunks
+    name = manifest_name(created)
+    manifest = {
+        'created': created.isoformat(),
+        'size': len(snapshot),
+        'chunk_size': chunk_size,
+        'compression': compression,
+        'chunks': [digest for digest, _ in chunks],
+    }
+    upload_file(storage, name, 'application/json', [json.dumps(manifest).encode()])
+    return name, new_chunks, new_bytes
+
+
+def read_manifest(storage, name):
+    return json.loads(storage.read(name))
+
+
+def restore(storage, name, file):
+    """Write the snapshot of manifest `name` to the binary `file`.
+
+    Every chunk is checked against its hash.
+    """
+    manifest = read_manifest(storage, name)
+    compression = manifest['compression']
+    size = 0
+    for digest in manifest['chunks']:
+        data = decompress(storage.read(chunk_name(digest, compression)), compression)
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f'Chunk {digest} is corrupt')
+        file.write(data)
+        size += len(data)
+    if size != manifest['size']:
+        raise ValueError(f'Restored {size} bytes, expected {manifest["size"]}')
+    return size
+
+
+def retained(times, now, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY):
+    """Return which of the backup `times` the retention policy keeps.
+
+    Keeps the last backup of each of the last `keep_daily` days, the last
+    one of each of the last `keep_weekly` weeks, and always the newest one.
+    """
+    daily = {}
+    weekly = {}
+    for time in sorted(times):
+        age = now - time
+        if age < timedelta(days=keep_daily):
+            daily[time.date()] = time
+        if age < timedelta(weeks=keep_weekly):
+            weekly[time.isocalendar()[:2]] = time
+    keep = set(daily.values()) | set(weekly.values())
+    if times:
+        keep.add(max(times))
+    return keep
+
+
+def prune(storage, now, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY):
+    """Delete the manifests outside the retention policy, and unused chunks.
+
+    Returns (number of manifests deleted, number of chunks deleted).
+    """
+    manifests = {manifest_time(name): name for name in storage.list(MANIFEST_PREFIX)}
+    keep = retained(manifests, now, keep_daily, keep_weekly)
+
+    used = set()
+    deleted_manifests = 0
+    for time, name in manifests.items():
+        if time in keep:
+            manifest = read_manifest(storage, name)
+            used.update(
+                chunk_name(digest, manifest['compression'])
+                for digest in manifest['chunks']
+            )
+        else:
+            storage.delete(name)
+            deleted_manifests += 1
+
+    deleted_chunks = 0
+    for name in storage.list(CHUNK_PREFIX):
+        if name not in used:
+            storage.delete(name)
+            deleted_chunks += 1
+    return deleted_manifests, deleted_chunks
@@ -1,101 +1,131 @@
-import os
 from datetime import datetime
-from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import connection
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
 
-from door_tracker.settings import BACKUP_FOLDER_NAME, BACKUP_SHARED_DRIVE_ID
+from door_tracker import incremental_backup
+from door_tracker.backup_storage import get_storage
+from door_tracker.backup_upload import (
+    COMPRESSIONS,
+    DEFAULT_COMPRESSION,
+    compress,
+    upload,
+)
+from door_tracker.settings import BACKUP_STORAGE
+from door_tracker.sqlite_backup import (
+    PAGES_PER_STEP,
+    SLEEP_BETWEEN_STEPS,
+    BackupProgress,
+    snapshot_sqlite,
+)
+
+# how much of the snapshot is compressed at a time
+SNAPSHOT_CHUNK_SIZE = 1024 * 1024
 
 
 class Command(BaseCommand):
     help = 'Back up SQLite3 database to Shared Drive'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages',
+            type=int,
+            default=PAGES_PER_STEP,
+            help='Database pages to copy per step',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=SLEEP_BETWEEN_STEPS,
+            help='Seconds to wait between steps, for writers to get in',
+        )
+        parser.add_argument(
+            '--storage',
+            default=BACKUP_STORAGE,
+            help="Where to upload to: 'drive', or a local directory",
+        )
+        parser.add_argument(
+            '--compression',
+            choices=COMPRESSIONS,
+            default=DEFAULT_COMPRESSION,
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Only store the chunks that changed since earlier backups, '
+            'then apply the retention policy',
+        )
+        parser.add_argument(
+            '--keep-daily',
+            type=int,
+            default=incremental_backup.KEEP_DAILY,
+            help='Days to keep a daily incremental backup for',
+        )
+        parser.add_argument(
+            '--keep-weekly',
+            type=int,
+            default=incremental_backup.KEEP_WEEKLY,
+            help='Weeks to keep a weekly incremental backup for',
+        )
+
     def handle(self, *args, **options):
-        # ---------- CONFIG ----------
+        now = datetime.now()
+        extension, content_type = COMPRESSIONS[options['compression']]
         BACKUP_FILENAME = (
-            f'db_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.sqlite3'
-        )
-        SERVICE_ACCOUNT_FILE = os.getenv(
-            'DJANGO_BACKUP_CREDENTIALS_FILE',
-            (Path() / 'credentials' / 'service-account.json').absolute(),
+            f'db_backup_{now.strftime("%Y%m%d_%H%M%S")}.sqlite3{extension}'
         )
 
         # ---------- STEP 1: Copy DB ----------
-        with connection.cursor() as cursor:
-            cursor.execute(f"VACUUM INTO '{BACKUP_FILENAME}'")
-        self.stdout.write(f'Copied database to {BACKUP_FILENAME}')
-
-        # ---------- STEP 2: Authenticate ----------
-        creds = service_account.Credentials.from_service_account_file(
-            SERVICE_ACCOUNT_FILE, scopes=['https://www.googleapis.com/auth/drive']
+        if connection.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be backed up')
+        started = datetime.now()
+        snapshot = snapshot_sqlite(
+            connection.settings_dict['NAME'],
+            pages=options['pages'],
+            sleep=options['sleep'],
+            progress=BackupProgress(
+                lambda percent: self.stdout.write(f'Copied {percent}% of the database')
+            ),
         )
-        service = build('drive', 'v3', credentials=creds)
-
-        # ---------- STEP 3: Find folder inside Shared Drive ----------
-        results = (
-            service.files()
-            .list(
-                q=f"name='{BACKUP_FOLDER_NAME}' and mimeType='application/vnd.google-apps.folder'",
-                corpora='drive',
-                driveId=BACKUP_SHARED_DRIVE_ID,
-                includeItemsFromAllDrives=True,
-                supportsAllDrives=True,
-                fields='files(id, name)',
-            )
-            .execute()
+        self.stdout.write(
+            f'Copied database ({len(snapshot)} bytes) in '
+            f'{(datetime.now() - started).total_seconds():.2f} seconds'
         )
 
-        folders = results.get('files', [])
-
-        # If folder not found, create it
-        if not folders:
-            self.stdout.write(
-                f"Folder '{BACKUP_FOLDER_NAME}' not found. Creating it..."
-            )
-            folder_metadata = {
-                'name': BACKUP_FOLDER_NAME,
-                'mimeType': 'application/vnd.google-apps.folder',
-                'parents': [BACKUP_SHARED_DRIVE_ID],
-            }
-            folder = (
-                service.files()
-                .create(body=folder_metadata, supportsAllDrives=True, fields='id, name')
-                .execute()
-            )
-            folder_id = folder['id']
-            self.stdout.write(
-                f"Created folder '{BACKUP_FOLDER_NAME}' with ID {folder_id}"
-            )
+        storage = get_storage(options['storage'], log=self.stdout.write)
+        if options['incremental']:
+            self.incremental(storage, snapshot, now, options)
         else:
-            folder_id = folders[0]['id']
-            self.stdout.write(
-                f"Found folder '{BACKUP_FOLDER_NAME}' with ID {folder_id}"
+            # ---------- STEP 2: Compress and upload ----------
+            view = memoryview(snapshot)
+            chunks = (
+                view[i : i + SNAPSHOT_CHUNK_SIZE]
+                for i in range(0, len(view), SNAPSHOT_CHUNK_SIZE)
             )
+            location = upload(
+                storage,
+                BACKUP_FILENAME,
+                content_type,
+                compress(chunks, options['compression']),
+                progress=lambda sent: self.stdout.write(f'Uploaded {sent} bytes'),
+            )
+            self.stdout.write(f'Backup stored at {location}')
 
-        # ---------- STEP 4: Upload backup ----------
-        file_metadata = {'name': BACKUP_FILENAME, 'parents': [folder_id]}
-        media = MediaFileUpload(BACKUP_FILENAME, mimetype='application/x-sqlite3')
-
-        file = (
-            service.files()
-            .create(
-                body=file_metadata,
-                media_body=media,
-                fields='id, webViewLink',
-                supportsAllDrives=True,
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Backup done in {(datetime.now() - started).total_seconds():.2f}'
+                ' seconds'
             )
-            .execute()
         )
 
-        self.stdout.write(f'Backup uploaded! File ID: {file["id"]}')
+    def incremental(self, storage, snapshot, now, options):
+        name, new_chunks, new_bytes = incremental_backup.backup(
+            storage, snapshot, now, options['compression']
+        )
         self.stdout.write(
-            f'View in Drive: https://drive.google.com/file/d/{file["id"]}/view?usp=drivesdk'
+            f'Stored {name} with {new_chunks} new chunks ({new_bytes} bytes)'
         )
-
-        # ---------- STEP 5: Cleanup ----------
-        os.remove(BACKUP_FILENAME)
-        self.stdout.write('Temporary backup file removed locally.')
+        manifests, chunks = incremental_backup.prune(
+            storage, now, options['keep_daily'], options['keep_weekly']
+        )
+        self.stdout.write(f'Removed {manifests} old backups and {chunks} unused chunks')
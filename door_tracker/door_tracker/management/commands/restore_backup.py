@@ -0,0 +1,58 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from door_tracker import incremental_backup
+from door_tracker.backup_storage import get_storage
+from door_tracker.settings import BACKUP_STORAGE
+
+
+class Command(BaseCommand):
+    help = 'Restore an incremental backup of the SQLite3 database to a file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', nargs='?', help='File to write the database to')
+        parser.add_argument(
+            '--manifest',
+            help='Manifest of the backup to restore (default: the latest)',
+        )
+        parser.add_argument(
+            '--storage',
+            default=BACKUP_STORAGE,
+            help="Where the backups are: 'drive', or a local directory",
+        )
+        parser.add_argument(
+            '--list',
+            action='store_true',
+            help='List the backups instead of restoring one',
+        )
+
+    def handle(self, *args, **options):
+        storage = get_storage(options['storage'], log=self.stdout.write)
+        manifests = storage.list(incremental_backup.MANIFEST_PREFIX)
+        if options['list']:
+            for name in manifests:
+                self.stdout.write(name)
+            return
+        if options['output'] is None:
+            raise CommandError('Give a file to restore the database to')
+        if not manifests:
+            raise CommandError('There are no backups to restore')
+
+        name = options['manifest'] or manifests[-1]
+        if name not in manifests:
+            raise CommandError(f'Backup {name} does not exist')
+
+        output = Path(options['output'])
+        if output.exists():
+            raise CommandError(f'{output} already exists')
+        try:
+            with output.open('xb') as file:
+                size = incremental_backup.restore(storage, name, file)
+        except Exception:
+            output.unlink(missing_ok=True)
+            raise
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Restored {name} ({size} bytes) to {output}')
+        )
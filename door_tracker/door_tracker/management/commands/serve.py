@@ -0,0 +1,93 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# caches that workers don't share
+PER_PROCESS_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve the site with several daphne worker processes, all accepting '
+        'connections on one shared socket.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=int(os.getenv('DJANGO_WORKERS', '1')),
+            help='Number of worker processes (default: $DJANGO_WORKERS or 1)',
+        )
+        parser.add_argument(
+            'daphne_args',
+            nargs='*',
+            help='Extra arguments for daphne, after --',
+        )
+
+    def handle(self, *args, **options):
+        if (
+            options['workers'] > 1
+            and settings.CACHES['default']['BACKEND'] in PER_PROCESS_CACHES
+        ):
+            # one worker's invalidations would never reach the others
+            raise CommandError(
+                'Several workers need a shared cache: set DJANGO_CACHE_DIR, '
+                'or DJANGO_DEBUG=False'
+            )
+
+        sock = socket.create_server(
+            (options['bind'], options['port']), backlog=1024, reuse_port=False
+        )
+        sock.set_inheritable(True)
+        command = [
+            sys.executable,
+            '-m',
+            'daphne',
+            '--fd',
+            str(sock.fileno()),
+            *options['daphne_args'],
+            'door_tracker.asgi:application',
+        ]
+        workers = [
+            subprocess.Popen(command, pass_fds=[sock.fileno()])
+            for _ in range(options['workers'])
+        ]
+        self.stdout.write(
+            f'Serving on {options["bind"]}:{options["port"]} with '
+            f'{len(workers)} workers'
+        )
+
+        stopping = False
+
+        def stop(signum=None, frame=None):
+            nonlocal stopping
+            stopping = True
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        # if one worker dies, stop them all and let the supervisor restart us
+        pid, status = os.wait()
+        failed = not stopping
+        stop()
+        for worker in workers:
+            worker.wait()
+        sock.close()
+        if failed:
+            raise CommandError(
+                f'Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}'
+            )
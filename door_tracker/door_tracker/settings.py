@@ -11,10 +11,13 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 import dj_database_url
 
+from door_tracker import sqlite_profile
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -124,6 +127,30 @@ if dj_database_url.DEFAULT_ENV in os.environ:
         conn_health_checks=True,
     )
 
+# WAL, BEGIN IMMEDIATE and tuned pragmas, see sqlite_profile.py
+if (
+    DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3'
+    and os.getenv('DJANGO_SQLITE_PROFILE', '') != 'False'
+):
+    DATABASES['default'].setdefault('OPTIONS', {}).update(
+        sqlite_profile.database_options()
+    )
+
+# With DJANGO_DB_POOL=True, every worker process keeps a pool of PostgreSQL
+# connections instead of one persistent connection per thread. Off by
+# default, since it needs psycopg[pool], which is not a dependency.
+if (
+    DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql'
+    and os.getenv('DJANGO_DB_POOL', '') == 'True'
+):
+    DATABASES['default']['CONN_MAX_AGE'] = 0  # pooling requires it
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = False
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': int(os.getenv('DJANGO_DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DJANGO_DB_POOL_MAX_SIZE', '10')),
+        'timeout': int(os.getenv('DJANGO_DB_POOL_TIMEOUT', '10')),
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -152,6 +179,7 @@ SPECTACULAR_SETTINGS = {
     'TITLE': 'RFiD Tracker Server API',
     'DESCRIPTION': "API endpoints provided by the server, for RFiD scanner's perusal",
     'REDOC_DIST': 'SIDECAR',
+    'PREPROCESSING_HOOKS': ['midas.schema.document_sync_scanner_api'],
 }
 
 # Internationalization
@@ -184,8 +212,15 @@ LOGIN_EXEMPT_URLS = [STATIC_URL]
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# run scheduled jobs (in whichever server process is elected to)
+SCHEDULER = os.getenv('DJANGO_SCHEDULER', '') != 'False'
+
 BACKUP_SHARED_DRIVE_ID = os.getenv('DJANGO_BACKUP_SHARED_DRIVE_ID', None)
 BACKUP_FOLDER_NAME = os.getenv('DJANGO_BACKUP_FOLDER_NAME', None)
+# 'drive', or a directory to store backups in instead
+BACKUP_STORAGE = os.getenv('DJANGO_BACKUP_STORAGE', 'drive')
+# the nightly backup stores only changed chunks, and prunes old backups
+BACKUP_INCREMENTAL = os.getenv('DJANGO_BACKUP_INCREMENTAL', '') != 'False'
 
 # Production
 
@@ -195,3 +230,20 @@ if not DEBUG:
     SECURE_SSL_REDIRECT = True
     SESSION_COOKIE_SECURE = True
     USE_X_FORWARDED_HOST = True
+
+# Shared by all workers on the host, which they need to see each other's
+# changes; see the serve command. Development uses a cache per process,
+# unless DJANGO_CACHE_DIR is set. Bump DJANGO_CACHE_VERSION when the shape
+# of cached values changes, so old entries are ignored.
+if not DEBUG or 'DJANGO_CACHE_DIR' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'door_tracker.file_cache.FileCache',
+            'LOCATION': os.getenv(
+                'DJANGO_CACHE_DIR', Path(tempfile.gettempdir()) / 'door-tracker-cache'
+            ),
+            'TIMEOUT': 300,
+            'VERSION': int(os.getenv('DJANGO_CACHE_VERSION', '1')),
+            'OPTIONS': {'MAX_ENTRIES': 50_000, 'CULL_FREQUENCY': 4},
+        },
+    }
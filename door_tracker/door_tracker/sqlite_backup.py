@@ -0,0 +1,64 @@
+"""Online backups of the SQLite database.
+
+Uses SQLite's incremental backup API on a connection of its own: a few
+pages are copied at a time, and the source is released in between, so
+scans keep committing while the backup runs. SQLite restarts the copy if
+another connection writes to a page that was already copied, which is
+cheap for a database of our size.
+"""
+
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PAGES_PER_STEP = 256
+SLEEP_BETWEEN_STEPS = 0.005  # seconds
+
+
+class BackupProgress:
+    """Calls `report(percent)` each time another `every` percent is copied."""
+
+    def __init__(self, report, every=10):
+        self.report = report
+        self.every = every
+        self.reported = -every
+        self.lock = threading.Lock()
+
+    def __call__(self, status, remaining, total):
+        percent = 100 * (total - remaining) // total if total else 100
+        with self.lock:
+            due = percent - self.reported >= self.every or percent == 100
+            if due and percent != self.reported:
+                self.reported = percent
+                self.report(percent)
+
+
+def _in_worker(function):
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='backup') as pool:
+        return pool.submit(function).result()
+
+
+def snapshot_sqlite(
+    source,
+    pages=PAGES_PER_STEP,
+    sleep=SLEEP_BETWEEN_STEPS,
+    progress=None,
+):
+    """Copy the SQLite database at path `source`, and return it as bytes.
+
+    The copy is made in memory, so nothing is written to disk. Runs in a
+    worker thread with its own connections, and waits for it. `progress` is
+    passed on to sqlite3.Connection.backup().
+    """
+
+    def run():
+        src = sqlite3.connect(source)
+        dst = sqlite3.connect(':memory:')
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+            return dst.serialize()
+        finally:
+            dst.close()
+            src.close()
+
+    return _in_worker(run)
@@ -4,7 +4,9 @@ from django.db.models import Q
 from django.urls import resolve
 from django.utils import timezone
 
+from . import liveness
 from .api import sessions_to_csv
+from .directory import directory
 from .models import (
     Assignment,
     Checkin,
@@ -212,6 +214,11 @@ class SessionAdmin(admin.ModelAdmin):
             default = list(default) + ['user']
         return default
 
+    def save_related(self, request, form, formsets, change):
+        # the check-in and checkout inlines are only saved now
+        super().save_related(request, form, formsets, change)
+        form.instance.update_is_open()
+
 
 @admin.register(Assignment)
 class AssignmentAdmin(admin.ModelAdmin):
@@ -234,8 +241,24 @@ class AssignmentAdmin(admin.ModelAdmin):
     ordering = ['-starting_from']
 
 
+class DirectoryModelAdmin(admin.ModelAdmin):
+    """Drops the tag directory after every change made through the admin."""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        directory.invalidate()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        directory.invalidate()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        directory.invalidate()
+
+
 @admin.register(ClaimedTag)
-class ClaimedTagAdmin(admin.ModelAdmin):
+class ClaimedTagAdmin(DirectoryModelAdmin):
     list_display = ['name', 'owner__last_name', 'owner__first_name']
     search_fields = ['name', 'owner__last_name', 'owner__first_name']
     list_filter = [ClaimedTagListFilter]
@@ -250,7 +273,7 @@ class ClaimedTagAdmin(admin.ModelAdmin):
 
 
 @admin.register(PendingTag)
-class PendingTagAdmin(admin.ModelAdmin):
+class PendingTagAdmin(DirectoryModelAdmin):
     list_display = [
         'name',
         'owner__last_name',
@@ -266,11 +289,15 @@ class PendingTagAdmin(admin.ModelAdmin):
 
 
 @admin.register(Scanner)
-class ScannerAdmin(admin.ModelAdmin):
-    list_display = ['name', 'id']
-    readonly_fields = ['id']
+class ScannerAdmin(DirectoryModelAdmin):
+    list_display = ['name', 'id', 'last_seen', 'alive']
+    readonly_fields = ['id', 'last_seen']
     ordering = ['name']
 
+    @admin.display(boolean=True)
+    def alive(self, obj):
+        return liveness.is_alive(obj.last_seen)
+
 
 @admin.register(Subteam)
 class SubteamAdmin(admin.ModelAdmin):
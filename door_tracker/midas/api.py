@@ -1,11 +1,15 @@
 import csv
+import itertools
+import json
 from dataclasses import dataclass
 from datetime import datetime
 
-from django.db import transaction
-from django.db.models import TextChoices
-from django.http import HttpResponse
-from django.utils import timezone
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_not_required
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import (
     OpenApiExample,
     extend_schema,
@@ -13,31 +17,44 @@ from drf_spectacular.utils import (
 )
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.serializers import (
+    BooleanField,
     CharField,
     ChoiceField,
     DateTimeField,
     HiddenField,
     IntegerField,
+    ListField,
     Serializer,
 )
 from rest_framework.settings import api_settings
 
-from .models import (
-    Checkin,
-    Checkout,
-    ClaimedTag,
-    LogType,
-    PendingTag,
-    Scanner,
-    Session,
+from . import columnar
+from .changes import ExportedSession, changes_since
+from .directory import directory
+from .liveness import liveness
+from .models import Session
+from .presence import presence
+from .scans import (
+    RegisterScanState,
+    ScanInFuture,
+    ScannerNotAuthorized,
+    ScanOutOfOrder,
+    TagNotRegistered,
+    aprocess_scan,
+    in_future,
+    process_scan,
+    process_scans,
+)
+from .statistics import (
+    aget_minutes_today_and_this_week,
+    get_minutes_today_and_this_week,
 )
-from .statistics import get_minutes_this_week, get_minutes_today
 
 
-def serializer_error(serializer):
+def serializer_error_message(serializer):
     msg = 'Invalid request:\n'
     for field, errors in serializer.errors.items():
         if field == 'non_field_errors':
@@ -46,8 +63,12 @@ def serializer_error(serializer):
             msg += f'  field {field}:\n'
         for error in errors:
             msg += f'    {error}\n'
+    return msg
+
+
+def serializer_error(serializer):
     return Response(
-        {'status': 'error', 'message': msg},
+        {'status': 'error', 'message': serializer_error_message(serializer)},
         status=400,
     )
 
@@ -74,16 +95,20 @@ class APIResponseSerializer(Serializer):
         return APIResponse(**validated_data)
 
 
+def validate_not_in_future(value):
+    if in_future(value):
+        raise ValidationError(SCAN_IN_FUTURE)
+
+
+SCAN_OUT_OF_ORDER = 'Scan is older than the open session'
+SCAN_IN_FUTURE = 'Scan time must not be in the future'
+
+
 @dataclass
 class RegisterScanRequest:
     device_id: str
     tag_id: str
-
-
-class RegisterScanState(TextChoices):
-    REGISTER = 'register', 'Tag registered'
-    CHECKIN = 'checkin', 'User checked in'
-    CHECKOUT = 'checkout', 'User checked out'
+    time: datetime | None = None
 
 
 @dataclass
@@ -94,12 +119,27 @@ class RegisterScanResponse:
     hours_week: int
 
     @classmethod
-    def make(cls, state, user, date):
+    def make(cls, scan):
+        minutes_day, minutes_week = get_minutes_today_and_this_week(
+            scan.owner_id, scan.time
+        )
         return RegisterScanResponse(
-            state=state,
-            owner_name=user.get_full_name(),
-            hours_day=get_minutes_today(user, date) // 60,
-            hours_week=get_minutes_this_week(user, date) // 60,
+            state=scan.state,
+            owner_name=scan.owner_name,
+            hours_day=minutes_day // 60,
+            hours_week=minutes_week // 60,
+        )
+
+    @classmethod
+    async def amake(cls, scan):
+        minutes_day, minutes_week = await aget_minutes_today_and_this_week(
+            scan.owner_id, scan.time
+        )
+        return RegisterScanResponse(
+            state=scan.state,
+            owner_name=scan.owner_name,
+            hours_day=minutes_day // 60,
+            hours_week=minutes_week // 60,
         )
 
 
@@ -113,12 +153,26 @@ class RegisterScanResponse:
                 'tag_id': 'DEADBEEF',
             },
         ),
+        OpenApiExample(
+            'with timestamp',
+            value={
+                'device_id': '44bb652ea2a696e1b2a7ce412f24a46d',
+                'tag_id': 'DEADBEEF',
+                'time': '2025-10-11T12:42:00+02:00',
+            },
+        ),
     ],
 )
 class RegisterScanRequestSerializer(Serializer):
     device_id = CharField(label='Scanner ID')
     tag_id = CharField(required=False, label='Tag ID')
     card_id = CharField(required=False, source='tag_id', label='Tag ID')
+    time = DateTimeField(
+        required=False,
+        label='Scan time',
+        help_text='When the tag was scanned. Defaults to the time of the request.',
+        validators=[validate_not_in_future],
+    )
 
     def validate(self, attrs):
         if 'tag_id' not in attrs and 'card_id' not in attrs:
@@ -182,6 +236,7 @@ class RegisterScanResponseSerializer(Serializer):
         200: RegisterScanResponseSerializer,
         403: APIResponseSerializer,
         404: APIResponseSerializer,
+        409: APIResponseSerializer,
     },
 )
 @api_view(['POST'])
@@ -197,86 +252,156 @@ def register_scan(request):
 
     args = serializer.save()
 
-    scanner = Scanner.objects.filter(pk=args.device_id).first()
-    if not scanner:
+    try:
+        scan = process_scan(args.device_id, args.tag_id, args.time)
+    except ScannerNotAuthorized:
         res = APIResponse.error('Scanner not authorized')
         s = APIResponseSerializer(res)
         return Response(s.data, status=403)
+    except TagNotRegistered:
+        liveness.seen(args.device_id)
+        res = APIResponse.error('Card not registered')
+        s = APIResponseSerializer(res)
+        return Response(s.data, status=404)
+    except ScanOutOfOrder:
+        liveness.seen(args.device_id)
+        res = APIResponse.error(SCAN_OUT_OF_ORDER)
+        s = APIResponseSerializer(res)
+        return Response(s.data, status=409)
 
-    # try to register a pending tag
+    liveness.seen(args.device_id)
+    res = RegisterScanResponse.make(scan)
+    serializer = RegisterScanResponseSerializer(res)
+    return Response(serializer.data)
 
-    try:
-        with transaction.atomic():
-            claimed_tag = ClaimedTag.objects.create(
-                owner=scanner.pending_tag.owner,
-                name=scanner.pending_tag.name,
-                code=args.tag_id,
-            )
-            scanner.pending_tag.delete()
-    except PendingTag.DoesNotExist:
-        pass
-    else:
-        user = claimed_tag.owner
-        today = timezone.now()
-        res = RegisterScanResponse.make(RegisterScanState.REGISTER, user, today)
-        serializer = RegisterScanResponseSerializer(res)
-        return Response(serializer.data)
-
-    # try to check out
 
-    try:
-        with transaction.atomic():
-            claimed_tag = ClaimedTag.objects.select_related('owner').get(
-                code=args.tag_id
-            )
-            current_session = Session.objects.filter(
-                user=claimed_tag.owner,
-                checkout__isnull=True,
-            ).first()
-            if not current_session:
-                raise Session.DoesNotExist
-            Checkout.objects.create(
-                type=LogType.TAG,
-                tag=claimed_tag,
-                session=current_session,
-            )
-    except (ClaimedTag.DoesNotExist, Session.DoesNotExist):
-        pass
-    else:
-        user = claimed_tag.owner
-        today = timezone.now()
-        res = RegisterScanResponse.make(RegisterScanState.CHECKOUT, user, today)
+@dataclass
+class RegisterScansRequest:
+    device_id: str
+    scans: list[tuple[str, datetime]]
+
 
-        serializer = RegisterScanResponseSerializer(res)
-        return Response(serializer.data)
+class BufferedScanSerializer(Serializer):
+    tag_id = CharField(label='Tag ID')
+    # a scan in the future fails on its own, see RegisterScansResult
+    time = DateTimeField(label='Scan time')
 
-    # try to check in
+
+@extend_schema_serializer(
+    examples=[
+        OpenApiExample(
+            'example',
+            value={
+                'device_id': '44bb652ea2a696e1b2a7ce412f24a46d',
+                'scans': [
+                    {'tag_id': 'DEADBEEF', 'time': '2025-10-11T09:00:00+02:00'},
+                    {'tag_id': 'DEADBEEF', 'time': '2025-10-11T17:30:00+02:00'},
+                ],
+            },
+        ),
+    ],
+)
+class RegisterScansRequestSerializer(Serializer):
+    device_id = CharField(label='Scanner ID')
+    scans = BufferedScanSerializer(many=True, label='Scans, oldest first')
+
+    def validate_scans(self, value):
+        times = [scan['time'] for scan in value]
+        if times != sorted(times):
+            raise ValidationError('Scans must be ordered by time')
+        return value
+
+    def create(self, validated_data):
+        return RegisterScansRequest(
+            device_id=validated_data['device_id'],
+            scans=[(scan['tag_id'], scan['time']) for scan in validated_data['scans']],
+        )
+
+
+@dataclass
+class RegisterScansResult:
+    status: str
+    message: str | None = None
+    state: RegisterScanState | None = None
+    owner_name: str | None = None
+
+    @classmethod
+    def make(cls, result):
+        if isinstance(result, TagNotRegistered):
+            return RegisterScansResult(status='error', message='Card not registered')
+        if isinstance(result, ScanOutOfOrder):
+            return RegisterScansResult(status='error', message=SCAN_OUT_OF_ORDER)
+        if isinstance(result, ScanInFuture):
+            return RegisterScansResult(status='error', message=SCAN_IN_FUTURE)
+        return RegisterScansResult(
+            status='ok', state=result.state, owner_name=result.owner_name
+        )
+
+
+class RegisterScansResultSerializer(Serializer):
+    status = CharField()
+    message = CharField(required=False)
+    state = ChoiceField(choices=RegisterScanState.choices, required=False)
+    owner_name = CharField(required=False)
+
+
+@dataclass
+class RegisterScansResponse:
+    results: list[RegisterScansResult]
+
+
+@extend_schema_serializer(
+    examples=[
+        OpenApiExample(
+            'example',
+            value={
+                'results': [
+                    {'status': 'ok', 'state': 'checkin', 'owner_name': 'John Doe'},
+                    {'status': 'error', 'message': 'Card not registered'},
+                ],
+            },
+        ),
+    ],
+)
+class RegisterScansResponseSerializer(Serializer):
+    results = RegisterScansResultSerializer(many=True)
+
+
+@extend_schema(
+    operation_id='register_scans',
+    auth=[],
+    request=RegisterScansRequestSerializer,
+    responses={
+        200: RegisterScansResponseSerializer,
+        403: APIResponseSerializer,
+    },
+)
+@api_view(['POST'])
+def register_scans(request):
+    """Register a backlog of tag scans
+
+    This endpoint is called by a scanner that buffered scans while it was
+    offline. Scans are processed in order, each with its own timestamp;
+    the response contains one result per scan.
+    """
+
+    serializer = RegisterScansRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return serializer_error(serializer)
+
+    args = serializer.save()
 
     try:
-        with transaction.atomic():
-            claimed_tag = ClaimedTag.objects.select_related('owner').get(
-                code=args.tag_id
-            )
-            new_session = Session.objects.create(user=claimed_tag.owner)
-            Checkin.objects.create(
-                type=LogType.TAG,
-                tag=claimed_tag,
-                session=new_session,
-            )
-    except ClaimedTag.DoesNotExist:
-        pass
-    else:
-        user = claimed_tag.owner
-        today = timezone.now()
-        res = RegisterScanResponse.make(RegisterScanState.CHECKIN, user, today)
-        serializer = RegisterScanResponseSerializer(res)
-        return Response(serializer.data)
-
-    # nothing worked, return a generic error
-
-    res = APIResponse.error('Card not registered')
-    s = APIResponseSerializer(res)
-    return Response(s.data, status=404)
+        results = process_scans(args.device_id, args.scans)
+    except ScannerNotAuthorized:
+        res = APIResponse.error('Scanner not authorized')
+        s = APIResponseSerializer(res)
+        return Response(s.data, status=403)
+
+    liveness.seen(args.device_id)
+    res = RegisterScansResponse(results=[RegisterScansResult.make(r) for r in results])
+    serializer = RegisterScansResponseSerializer(res)
+    return Response(serializer.data)
 
 
 class HealthcheckRequestSerializer(Serializer):
@@ -300,24 +425,109 @@ def healthcheck(request):
     """Mark the scanner as alive
 
     This endpoint is called by the scanner every 30 seconds. If the
-    scanner does not do it in 5 minutes, it is declared dead.
-
-    TODO: actually check this
+    scanner does not do it (or scan a tag) in 5 minutes, it is declared
+    dead; see the scanners endpoint.
     """
     serializer = HealthcheckRequestSerializer(data=request.data)
     if not serializer.is_valid():
         return serializer_error(serializer)
 
-    if not Scanner.objects.filter(pk=serializer.save()).exists():
+    scanner_id = serializer.save()
+    if directory.scanner(scanner_id) is None:
         res = APIResponse.error('Scanner not registered')
         s = APIResponseSerializer(res)
         return Response(s.data, status=403)
 
+    liveness.seen(scanner_id)
+
     res = APIResponse.success()
     s = APIResponseSerializer(res)
     return Response(s.data)
 
 
+# Async versions of the scanner endpoints. DRF does not support async views,
+# so these are plain Django views that reuse the serializers above. They are
+# served at the canonical URLs; see urls.py.
+#
+# Accepted scans still do their database work on the one thread that
+# sync_to_async shares between requests, so these are about as fast as the
+# sync versions (see manage.py benchmark_scans). What they save is the
+# thread for healthchecks and rejected scans, which the directory answers
+# from memory.
+
+
+def request_data(request):
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+
+def api_error(message, status):
+    res = APIResponse.error(message)
+    s = APIResponseSerializer(res)
+    return JsonResponse(s.data, status=status)
+
+
+@csrf_exempt
+@login_not_required
+@require_POST
+async def register_scan_async(request):
+    """Async version of register_scan"""
+
+    try:
+        data = request_data(request)
+    except ValueError:
+        return api_error('Invalid request: malformed JSON', 400)
+
+    serializer = RegisterScanRequestSerializer(data=data)
+    if not serializer.is_valid():
+        return api_error(serializer_error_message(serializer), 400)
+
+    args = serializer.save()
+
+    try:
+        scan = await aprocess_scan(args.device_id, args.tag_id, args.time)
+    except ScannerNotAuthorized:
+        return api_error('Scanner not authorized', 403)
+    except TagNotRegistered:
+        await liveness.aseen(args.device_id)
+        return api_error('Card not registered', 404)
+    except ScanOutOfOrder:
+        await liveness.aseen(args.device_id)
+        return api_error(SCAN_OUT_OF_ORDER, 409)
+
+    await liveness.aseen(args.device_id)
+    res = await RegisterScanResponse.amake(scan)
+    serializer = RegisterScanResponseSerializer(res)
+    return JsonResponse(serializer.data)
+
+
+@csrf_exempt
+@login_not_required
+@require_POST
+async def healthcheck_async(request):
+    """Async version of healthcheck"""
+
+    try:
+        data = request_data(request)
+    except ValueError:
+        return api_error('Invalid request: malformed JSON', 400)
+
+    serializer = HealthcheckRequestSerializer(data=data)
+    if not serializer.is_valid():
+        return api_error(serializer_error_message(serializer), 400)
+
+    scanner_id = serializer.save()
+    if await directory.ascanner(scanner_id) is None:
+        return api_error('Scanner not registered', 403)
+
+    await liveness.aseen(scanner_id)
+
+    res = APIResponse.success()
+    s = APIResponseSerializer(res)
+    return JsonResponse(s.data)
+
+
 class ExportSessionsResponseSerializer(Serializer):
     pass
 
@@ -329,63 +539,217 @@ class ExportSessionsResponseSerializer(Serializer):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def export_sessions_csv(request):
-    sessions = (
-        Session.objects.filter(user=request.user)
-        .select_related('checkin', 'checkout')
-        .order_by('checkin__time', 'checkout__time')
+    sessions = Session.objects.filter(user=request.user).order_by(
+        'checkin__time', 'checkout__time'
     )
     return sessions_to_csv(sessions)
 
 
+@extend_schema(
+    operation_id='sessions_columnar',
+    responses={
+        (200, content_type): OpenApiTypes.BINARY
+        for content_type in columnar.FORMATS.values()
+    },
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def export_all_sessions(request, file_format):
+    """All sessions of all users, as a Parquet or Arrow file"""
+    response = StreamingHttpResponse(
+        # one row group per trip to the worker thread
+        iterate_in_thread(columnar.export_sessions(file_format)),
+        content_type=columnar.FORMATS[file_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="sessions.{file_format}"'
+    return response
+
+
+class SessionChangesRequestSerializer(Serializer):
+    cursor = IntegerField(
+        min_value=0,
+        default=0,
+        help_text='The cursor returned by the previous call; 0 to start over.',
+    )
+
+
+class ExportedSessionSerializer(Serializer):
+    session_id = IntegerField()
+    user_id = IntegerField()
+    deleted = BooleanField()
+    checkin_type = CharField(allow_null=True)
+    checkin_time = DateTimeField(allow_null=True)
+    checkin_tag = CharField(allow_null=True)
+    checkout_type = CharField(allow_null=True)
+    checkout_time = DateTimeField(allow_null=True)
+    checkout_tag = CharField(allow_null=True)
+
+    def create(self, validated_data):
+        return ExportedSession(**validated_data)
+
+
+@dataclass
+class SessionChangesResponse:
+    cursor: int
+    has_more: bool
+    sessions: list[ExportedSession]
+
+
+class SessionChangesResponseSerializer(Serializer):
+    cursor = IntegerField(help_text='Pass this as the cursor of the next call.')
+    has_more = BooleanField(help_text='Whether to call again right away.')
+    sessions = ExportedSessionSerializer(many=True)
+
+
+@extend_schema(
+    operation_id='sessions_changes',
+    parameters=[SessionChangesRequestSerializer],
+    responses={200: SessionChangesResponseSerializer},
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_sessions_changes(request):
+    """Sessions changed since the last call
+
+    Returns the current state of every session that was created, changed or
+    deleted after the cursor, oldest change first. Deleted sessions only
+    have their IDs and `deleted` set. Staff get the sessions of all users,
+    everyone else only their own.
+
+    A change shows up here about ten seconds after it was made. Deletions
+    are only kept for 90 days; after a longer pause, start over from 0.
+    """
+
+    serializer = SessionChangesRequestSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return serializer_error(serializer)
+
+    user = None if request.user.is_staff else request.user
+    cursor, sessions, has_more = changes_since(
+        serializer.validated_data['cursor'], user=user
+    )
+
+    res = SessionChangesResponse(cursor=cursor, has_more=has_more, sessions=sessions)
+    serializer = SessionChangesResponseSerializer(res)
+    return Response(serializer.data)
+
+
+class ScannerStatusSerializer(Serializer):
+    id = CharField()
+    name = CharField(allow_null=True)
+    last_seen = DateTimeField(
+        allow_null=True, help_text='Last healthcheck or scan, if ever.'
+    )
+    alive = BooleanField(help_text='Seen in the last 5 minutes.')
+
+
+@extend_schema(responses={200: ScannerStatusSerializer(many=True)})
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def scanners(request):
+    """Status of the scanner fleet
+
+    Every scanner, and whether it has been heard from recently.
+    """
+
+    serializer = ScannerStatusSerializer(liveness.fleet(), many=True)
+    return Response(serializer.data)
+
+
+class PresentUserSerializer(Serializer):
+    user_id = IntegerField()
+    name = CharField()
+    since = DateTimeField(allow_null=True, help_text='When they checked in.')
+    subteams = ListField(child=CharField())
+
+
+@extend_schema(responses={200: PresentUserSerializer(many=True)})
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def present_users(request):
+    """Who is in the lab
+
+    Everyone who is checked in right now, longest present first. Served from
+    memory, without touching the database.
+    """
+
+    serializer = PresentUserSerializer(presence.present(), many=True)
+    return Response(serializer.data)
+
+
+class Echo:
+    """File-like object that hands whatever is written back to the caller.
+
+    Lets csv.writer produce lines for a StreamingHttpResponse.
+    """
+
+    def write(self, value):
+        return value
+
+
+CSV_CHUNK_SIZE = 2000
+
+
+async def iterate_in_thread(iterable):
+    """Iterate a sync iterable that runs queries, from async code.
+
+    Every item is fetched with sync_to_async. Under ASGI, Django would
+    otherwise read a sync iterator into memory before sending anything.
+    Keep the items big, since each one costs a trip to the worker thread.
+    """
+    iterator = iter(iterable)
+    done = object()
+    try:
+        while (item := await sync_to_async(next)(iterator, done)) is not done:
+            yield item
+    finally:
+        if hasattr(iterator, 'close'):
+            # e.g. closes the server-side cursor of QuerySet.iterator()
+            await sync_to_async(iterator.close)()
+
+
 def sessions_to_csv(sessions):
-    response = HttpResponse(content_type='text/csv')
-    writer = csv.writer(response, dialect='excel')
-
-    writer.writerow(
-        [
-            'checkin_type',
-            'checkin_time',
-            'checkin_tag',
-            'checkout_type',
-            'checkout_time',
-            'checkout_tag',
-        ]
+    rows = sessions.values_list(
+        'checkin__type',
+        'checkin__time',
+        'checkin__tag__name',
+        'checkout__type',
+        'checkout__time',
+        'checkout__tag__name',
     )
+    writer = csv.writer(Echo(), dialect='excel')
+
+    def format_time(time):
+        return time.strftime('%F %T') if time else '-'
 
-    for s in sessions:
-        try:
-            cin_type = s.checkin.type
-            cin_time = s.checkin.time.strftime('%F %T')
-            if s.checkin.tag:
-                cin_tag = s.checkin.tag.name
-            else:
-                cin_tag = '-'
-        except Checkin.DoesNotExist:
-            cin_type = '-'
-            cin_time = '-'
-            cin_tag = '-'
-
-        try:
-            cout_type = s.checkout.type
-            cout_time = s.checkout.time.strftime('%F %T')
-            if s.checkout.tag:
-                cout_tag = s.checkout.tag.name
-            else:
-                cout_tag = '-'
-        except Checkout.DoesNotExist:
-            cout_type = '-'
-            cout_time = '-'
-            cout_tag = '-'
-
-        writer.writerow(
+    def lines():
+        yield writer.writerow(
             [
-                cin_type,
-                cin_time,
-                cin_tag,
-                cout_type,
-                cout_time,
-                cout_tag,
+                'checkin_type',
+                'checkin_time',
+                'checkin_tag',
+                'checkout_type',
+                'checkout_time',
+                'checkout_tag',
             ]
         )
 
-    return response
+        # one string per chunk of rows
+        for chunk in itertools.batched(
+            rows.iterator(chunk_size=CSV_CHUNK_SIZE), CSV_CHUNK_SIZE
+        ):
+            yield ''.join(
+                writer.writerow(
+                    [
+                        cin_type or '-',
+                        format_time(cin_time),
+                        cin_tag or '-',
+                        cout_type or '-',
+                        format_time(cout_time),
+                        cout_tag or '-',
+                    ]
+                )
+                for cin_type, cin_time, cin_tag, cout_type, cout_time, cout_tag in chunk
+            )
+
+    return StreamingHttpResponse(iterate_in_thread(lines()), content_type='text/csv')
@@ -0,0 +1,115 @@
+"""Helpers shared by the benchmark_* management commands."""
+
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from . import rollup
+from .directory import directory
+from .models import Checkin, Checkout, ClaimedTag, LogType, Scanner, Session
+
+
+@contextmanager
+def benchmark_database(verbosity=0):
+    """Run the benchmark against a throwaway database, like the test runner."""
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(
+        verbosity=verbosity, autoclobber=True, serialize=False
+    )
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity)
+        teardown_test_environment()
+
+
+def create_members(count, scanner_id='benchmark'):
+    """Create a scanner and `count` users with a claimed tag each.
+
+    Returns the users and their tag codes.
+    """
+    Scanner.objects.create(id=scanner_id, name='Benchmark')
+    users = User.objects.bulk_create(
+        User(username=f'member{i}', first_name='Member', last_name=str(i))
+        for i in range(count)
+    )
+    tags = ClaimedTag.objects.bulk_create(
+        ClaimedTag(code=f'{i:08X}', name='benchmark', owner=user)
+        for i, user in enumerate(users)
+    )
+    directory.warm()
+    return users, [tag.code for tag in tags]
+
+
+def create_sessions(users, days, seed=0):
+    """Give every user a closed session on most of the past `days` days.
+
+    Sessions start in the afternoon and last up to ten hours, so some run
+    past midnight. Returns the number of sessions.
+    """
+    rng = random.Random(seed)
+    today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    sessions = []
+    times = []
+    for user in users:
+        for day in range(days, 0, -1):
+            if rng.random() < 0.3:
+                continue
+            checkin = today - timedelta(days=day, hours=-rng.randint(12, 18))
+            checkout = checkin + timedelta(minutes=rng.randint(30, 600))
+            sessions.append(Session(user=user, is_open=False))
+            times.append((checkin, checkout))
+
+    Session.objects.bulk_create(sessions, batch_size=1000)
+    Checkin.objects.bulk_create(
+        (
+            Checkin(type=LogType.TAG, time=checkin, session=session)
+            for session, (checkin, _) in zip(sessions, times)
+        ),
+        batch_size=1000,
+    )
+    Checkout.objects.bulk_create(
+        (
+            Checkout(type=LogType.TAG, time=checkout, session=session)
+            for session, (_, checkout) in zip(sessions, times)
+        ),
+        batch_size=1000,
+    )
+    rollup.rebuild()
+    return len(sessions)
+
+
+class Timer:
+    """Collects latencies and formats a one-line summary."""
+
+    def __init__(self):
+        self.latencies = []
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        yield
+        self.latencies.append(time.perf_counter() - start)
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        return (
+            f'{len(latencies)} requests in {self.elapsed:.2f}s '
+            f'({len(latencies) / self.elapsed:.0f} req/s), '
+            f'p50 {statistics.median(latencies) * 1000:.1f}ms, '
+            f'p95 {p95 * 1000:.1f}ms'
+        )
@@ -0,0 +1,140 @@
+"""Change feed of sessions, for incremental exports.
+
+Every write to a session, its check-in or its check-out appends a
+SessionChange row (see `midas.signals`). A consumer remembers the ID of
+the last change it has seen and asks for everything after it. Sessions that
+no longer exist are reported as deleted.
+
+IDs are handed out in insertion order, which is not commit order when
+several transactions write at once: a lower ID can commit after a higher
+one was read, and a cursor past the higher one would skip it. So changes
+are held back until they are SETTLE_TIME old, long after the transaction
+that wrote them has committed, and the cursor never passes a change that
+might still be in flight.
+
+The feed is kept small by `prune()`: a change superseded by a later
+change of the same session is dropped, and so is the tombstone of a
+deleted session after RETENTION. A consumer that has not synced for
+RETENTION may therefore miss deletions, and should start over from 0.
+"""
+
+import itertools
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Session, SessionChange
+
+PAGE_SIZE = 1000
+SETTLE_TIME = timedelta(seconds=10)
+RETENTION = timedelta(days=90)
+
+
+@dataclass
+class ExportedSession:
+    session_id: int
+    user_id: int
+    deleted: bool
+    checkin_type: str | None = None
+    checkin_time: datetime | None = None
+    checkin_tag: str | None = None
+    checkout_type: str | None = None
+    checkout_time: datetime | None = None
+    checkout_tag: str | None = None
+
+
+def record(sessions):
+    """Append a change for every (session ID, user ID)."""
+    SessionChange.objects.bulk_create(
+        SessionChange(session_id=session_id, user_id=user_id)
+        for session_id, user_id in sessions
+    )
+
+
+def changes_since(cursor, user=None, limit=PAGE_SIZE, now=None):
+    """Return the sessions changed after `cursor`, in order of their last change.
+
+    Returns (new cursor, list of ExportedSession, whether there is more).
+    Only the sessions of `user` are included if one is given, and only
+    changes older than SETTLE_TIME. Takes two queries.
+    """
+    horizon = (now or timezone.now()) - SETTLE_TIME
+    changes = SessionChange.objects.filter(pk__gt=cursor)
+    if user is not None:
+        changes = changes.filter(user=user)
+    changes = changes.order_by('pk').values_list('pk', 'session_id', 'user_id', 'time')[
+        : limit + 1
+    ]
+    # stop at the first unsettled change, so that the cursor can't pass it
+    changes = list(itertools.takewhile(lambda change: change[3] <= horizon, changes))
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if not changes:
+        return cursor, [], False
+
+    # only the latest change of each session matters
+    latest = {}
+    for _, session_id, user_id, _ in changes:
+        latest.pop(session_id, None)
+        latest[session_id] = user_id
+
+    current = {
+        row[0]: row[1:]
+        for row in Session.objects.filter(pk__in=latest).values_list(
+            'pk',
+            'checkin__type',
+            'checkin__time',
+            'checkin__tag__name',
+            'checkout__type',
+            'checkout__time',
+            'checkout__tag__name',
+        )
+    }
+
+    sessions = []
+    for session_id, user_id in latest.items():
+        if session_id not in current:
+            sessions.append(
+                ExportedSession(session_id=session_id, user_id=user_id, deleted=True)
+            )
+            continue
+        cin_type, cin_time, cin_tag, cout_type, cout_time, cout_tag = current[
+            session_id
+        ]
+        sessions.append(
+            ExportedSession(
+                session_id=session_id,
+                user_id=user_id,
+                deleted=False,
+                checkin_type=cin_type,
+                checkin_time=cin_time,
+                checkin_tag=cin_tag,
+                checkout_type=cout_type,
+                checkout_time=cout_time,
+                checkout_tag=cout_tag,
+            )
+        )
+
+    new_cursor = changes[-1][0]
+    return new_cursor, sessions, has_more
+
+
+def prune(now=None):
+    """Drop superseded changes, and tombstones older than RETENTION.
+
+    Returns the number of changes deleted.
+    """
+    superseded, _ = SessionChange.objects.filter(
+        Exists(
+            SessionChange.objects.filter(
+                session_id=OuterRef('session_id'), pk__gt=OuterRef('pk')
+            )
+        )
+    ).delete()
+    tombstones, _ = SessionChange.objects.filter(
+        ~Exists(Session.objects.filter(pk=OuterRef('session_id'))),
+        time__lt=(now or timezone.now()) - RETENTION,
+    ).delete()
+    return superseded + tombstones
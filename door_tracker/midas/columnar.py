@@ -0,0 +1,187 @@
+"""Columnar (Parquet or Arrow) export of all sessions.
+
+Same columns as the CSV export, plus who the session belongs to, the
+subteams and quota of their assignment at check-in, and the duration.
+Sessions are read in chunks and every chunk becomes one row group, which
+is sent on before the next chunk is read.
+
+pyarrow is only imported once an export is made, so that the rest of the
+app keeps working without it.
+"""
+
+import io
+from bisect import bisect_right
+from collections import defaultdict
+
+from .models import Assignment, Session
+
+FORMATS = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+
+ROW_GROUP_SIZE = 50_000
+
+
+def _schema():
+    import pyarrow as pa
+
+    time = pa.timestamp('us', tz='UTC')
+    return pa.schema(
+        [
+            ('session_id', pa.int64()),
+            ('user_id', pa.int64()),
+            ('username', pa.string()),
+            ('first_name', pa.string()),
+            ('last_name', pa.string()),
+            ('subteam', pa.string()),
+            ('quota_hours', pa.int64()),
+            ('checkin_type', pa.string()),
+            ('checkin_time', time),
+            ('checkin_tag', pa.string()),
+            ('checkout_type', pa.string()),
+            ('checkout_time', time),
+            ('checkout_tag', pa.string()),
+            ('duration', pa.duration('us')),
+        ]
+    )
+
+
+class _Sink(io.RawIOBase):
+    """Collects what the writer produced since the last drain().
+
+    Keeps counting the position, since file formats store offsets in their
+    footer.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _assignments():
+    """Per user, assignment start times and (subteams, quota hours)."""
+    starts = defaultdict(list)
+    values = defaultdict(list)
+    for assignment in (
+        Assignment.objects.select_related('quota')
+        .prefetch_related('subteams')
+        .order_by('starting_from')
+    ):
+        starts[assignment.user_id].append(assignment.starting_from)
+        values[assignment.user_id].append(
+            (assignment.subteam_names(), assignment.quota.hours)
+        )
+    return starts, values
+
+
+def _batches(sessions, schema):
+    import pyarrow as pa
+
+    starts, values = _assignments()
+    rows = sessions.values_list(
+        'pk',
+        'user_id',
+        'user__username',
+        'user__first_name',
+        'user__last_name',
+        'checkin__type',
+        'checkin__time',
+        'checkin__tag__name',
+        'checkout__type',
+        'checkout__time',
+        'checkout__tag__name',
+    ).order_by('pk')
+
+    columns = defaultdict(list)
+    for (
+        session_id,
+        user_id,
+        username,
+        first_name,
+        last_name,
+        cin_type,
+        cin_time,
+        cin_tag,
+        cout_type,
+        cout_time,
+        cout_tag,
+    ) in rows.iterator(chunk_size=ROW_GROUP_SIZE):
+        # the assignment at the start of the session
+        subteam, quota_hours = None, None
+        start = cin_time or cout_time
+        i = bisect_right(starts.get(user_id, []), start) if start else 0
+        if i:
+            subteam, quota_hours = values[user_id][i - 1]
+
+        for name, value in [
+            ('session_id', session_id),
+            ('user_id', user_id),
+            ('username', username),
+            ('first_name', first_name),
+            ('last_name', last_name),
+            ('subteam', subteam),
+            ('quota_hours', quota_hours),
+            ('checkin_type', cin_type),
+            ('checkin_time', cin_time),
+            ('checkin_tag', cin_tag),
+            ('checkout_type', cout_type),
+            ('checkout_time', cout_time),
+            ('checkout_tag', cout_tag),
+            ('duration', cout_time - cin_time if cin_time and cout_time else None),
+        ]:
+            columns[name].append(value)
+
+        if len(columns['session_id']) == ROW_GROUP_SIZE:
+            yield pa.RecordBatch.from_pydict(columns, schema=schema)
+            columns = defaultdict(list)
+
+    if columns:
+        yield pa.RecordBatch.from_pydict(columns, schema=schema)
+
+
+def _write(writer, sink, batches):
+    for batch in batches:
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_sessions(file_format, sessions=None):
+    """Return the sessions as a Parquet or Arrow file, in chunks.
+
+    The chunks are produced lazily, one row group at a time.
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown format: {file_format}')
+    if sessions is None:
+        sessions = Session.objects.all()
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _schema()
+    sink = _Sink()
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+    return _write(writer, sink, _batches(sessions, schema))
@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 
 
 def to_start_of_day(dt: datetime):
@@ -34,3 +34,21 @@ def to_end_of_month(dt: datetime):
     dt = to_start_of_month(dt)
     dt = dt.replace(month=dt.month + 1, day=dt.day - 1)
     return to_end_of_day(dt)
+
+
+def split_by_day(start: datetime, end: datetime, tz):
+    """Split the [start, end) interval at midnights in the given pytz timezone.
+
+    Returns a dict mapping each local date to the time spent in it.
+    """
+    days = {}
+    day = start.astimezone(tz).date()
+    while True:
+        day_start = tz.localize(datetime.combine(day, time.min))
+        day_end = tz.localize(datetime.combine(day + timedelta(days=1), time.min))
+        duration = min(end, day_end) - max(start, day_start)
+        if duration > timedelta(0):
+            days[day] = duration
+        if day_end >= end:
+            return days
+        day += timedelta(days=1)
@@ -0,0 +1,150 @@
+"""In-process cache of scanners and claimed tags.
+
+Every scan and healthcheck needs to know who a scanner or tag belongs to,
+but these tables almost never change. The directory keeps them in memory
+and is invalidated by model signals (see `midas.signals`). Invalidation
+bumps a generation counter in the Django cache, so other processes sharing
+that cache drop their copy as well.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import DatabaseError
+
+from .models import ClaimedTag, PendingTag, Scanner
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'midas_directory_generation'
+
+
+@dataclass(frozen=True)
+class PendingTagEntry:
+    id: int
+    name: str | None
+    owner_id: int
+    owner_name: str
+
+
+@dataclass(frozen=True)
+class ScannerEntry:
+    id: str
+    name: str | None
+    pending_tag: PendingTagEntry | None
+
+
+@dataclass(frozen=True)
+class TagEntry:
+    code: str
+    name: str
+    owner_id: int
+    owner_name: str
+
+
+class Directory:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._scanners = {}
+        self._tags = {}
+
+    def _current_generation(self):
+        # not 0: if the counter gets evicted, it must not restart at a value
+        # that some process still has a copy of
+        return cache.get_or_set(GENERATION_KEY, time.time_ns, timeout=None)
+
+    def warm(self):
+        """(Re)load all scanners and claimed tags from the database."""
+        generation = self._current_generation()
+
+        pending_tags = {
+            p.scanner_id: PendingTagEntry(
+                id=p.id,
+                name=p.name,
+                owner_id=p.owner_id,
+                owner_name=p.owner.get_full_name(),
+            )
+            for p in PendingTag.objects.select_related('owner')
+        }
+        scanners = {
+            s.id: ScannerEntry(
+                id=s.id,
+                name=s.name,
+                pending_tag=pending_tags.get(s.id),
+            )
+            for s in Scanner.objects.all()
+        }
+        tags = {
+            t.code: TagEntry(
+                code=t.code,
+                name=t.name,
+                owner_id=t.owner_id,
+                owner_name=t.owner.get_full_name(),
+            )
+            for t in ClaimedTag.objects.select_related('owner')
+        }
+
+        with self._lock:
+            self._scanners = scanners
+            self._tags = tags
+            self._generation = generation
+
+    def invalidate(self):
+        """Drop the cached entries, in this and every other process."""
+        with self._lock:
+            self._generation = None
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, time.time_ns(), timeout=None)
+
+    def _is_fresh(self):
+        return (
+            self._generation is not None
+            and self._generation == self._current_generation()
+        )
+
+    def _ensure_fresh(self):
+        if not self._is_fresh():
+            self.warm()
+
+    async def _aensure_fresh(self):
+        if not self._is_fresh():
+            await sync_to_async(self.warm)()
+
+    def scanner(self, scanner_id):
+        """Return the ScannerEntry for this ID, or None if it does not exist."""
+        self._ensure_fresh()
+        return self._scanners.get(scanner_id)
+
+    def tag(self, code):
+        """Return the TagEntry for this code, or None if it is not claimed."""
+        self._ensure_fresh()
+        return self._tags.get(code)
+
+    async def ascanner(self, scanner_id):
+        """Async version of scanner()."""
+        await self._aensure_fresh()
+        return self._scanners.get(scanner_id)
+
+    async def atag(self, code):
+        """Async version of tag()."""
+        await self._aensure_fresh()
+        return self._tags.get(code)
+
+
+directory = Directory()
+
+
+def warm_up():
+    """Fill the directory at server startup."""
+    try:
+        directory.warm()
+    except DatabaseError:
+        # e.g. migrations haven't been applied yet; the first lookup retries
+        logger.warning('Could not warm up the tag directory', exc_info=True)
@@ -0,0 +1,95 @@
+"""In-process publish/subscribe for pushing events to open connections.
+
+Subscribers are async views (e.g. server-sent event streams) running on the
+event loop of a daphne worker; publishers can be any thread, usually a
+model signal handler. Messages are only delivered within one process, so
+subscribers that may be served by another worker than the publisher must
+fall back to checking the database every now and then.
+"""
+
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class Subscription:
+    """Messages on some topics, while used as an async context manager."""
+
+    def __init__(self, broker, topics, maxsize):
+        self._broker = broker
+        self._topics = topics
+        self._queue = asyncio.Queue(maxsize)
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._broker._add(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._broker._remove(self)
+
+    def _put(self, message):
+        # runs on the subscriber's loop; a slow subscriber loses old messages
+        # rather than holding up the publisher or growing without bound
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(message)
+
+    def deliver(self, message):
+        """Queue a message, from any thread."""
+        try:
+            self._loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # the loop has been closed
+            pass
+
+    async def get(self, timeout=None):
+        """The next message; raises TimeoutError if none arrives in time."""
+        async with asyncio.timeout(timeout):
+            return await self._queue.get()
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, *topics, maxsize=100):
+        """Receive the messages published on any of the topics.
+
+        Use as `async with broker.subscribe(topic) as subscription:`.
+        """
+        return Subscription(self, topics, maxsize)
+
+    def _add(self, subscription):
+        with self._lock:
+            for topic in subscription._topics:
+                self._subscriptions[topic].add(subscription)
+
+    def _remove(self, subscription):
+        with self._lock:
+            for topic in subscription._topics:
+                self._subscriptions[topic].discard(subscription)
+                if not self._subscriptions[topic]:
+                    del self._subscriptions[topic]
+
+    def publish(self, topic, message=None):
+        """Send a message to every subscriber of the topic, from any thread."""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(topic, ()))
+        for subscription in subscriptions:
+            subscription.deliver(message)
+
+    def subscribers(self, topic):
+        with self._lock:
+            return len(self._subscriptions.get(topic, ()))
+
+
+broker = Broker()
+
+# published when someone checks in or out, see presence.py
+PRESENCE_TOPIC = 'presence'
+
+
+def pending_tag_topic(pending_tag_id):
+    return f'pending_tag:{pending_tag_id}'
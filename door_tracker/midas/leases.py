@@ -0,0 +1,46 @@
+"""Leases on named jobs, so that one process out of many does them.
+
+A lease is one row, taken over with a conditional UPDATE: either we hold
+it already, or it has expired. The holder renews it well before it
+expires; if the holder dies, another process takes over after at most
+`ttl`.
+"""
+
+import os
+import socket
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Lease
+
+
+def new_holder():
+    """A name for this process, unique across hosts and restarts."""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def acquire(name, holder, ttl):
+    """Take or renew the lease `name` for `ttl`. Returns whether we hold it."""
+    now = timezone.now()
+    expires = now + timedelta(seconds=ttl)
+    if (
+        Lease.objects.filter(name=name)
+        .filter(Q(holder=holder) | Q(expires__lte=now))
+        .update(holder=holder, expires=expires)
+    ):
+        return True
+    try:
+        with transaction.atomic():
+            Lease.objects.create(name=name, holder=holder, expires=expires)
+    except IntegrityError:
+        return False  # someone else holds it
+    return True
+
+
+def release(name, holder):
+    """Give up the lease `name`, if we hold it."""
+    Lease.objects.filter(name=name, holder=holder).update(expires=timezone.now())
@@ -0,0 +1,154 @@
+"""Which scanners are alive.
+
+Scanners call the healthcheck every 30 seconds, and a scanner that has
+neither pinged nor scanned for DEAD_AFTER is considered dead. Writing every
+ping to the database would cost a write per scanner every 30 seconds, so
+pings are recorded in memory, and each process writes the last-seen times
+to `Scanner.last_seen` in one batched update, at most every FLUSH_INTERVAL.
+The database can therefore lag behind by up to FLUSH_INTERVAL, well within
+DEAD_AFTER.
+
+A scheduled sweep (see `door_tracker.backup_scheduler`) logs scanners as
+they die and come back.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError
+from django.db.models import DateTimeField, F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Scanner
+
+logger = logging.getLogger(__name__)
+
+DEAD_AFTER = timedelta(minutes=5)
+FLUSH_INTERVAL = 60  # seconds
+
+
+@dataclass(frozen=True)
+class ScannerStatus:
+    id: str
+    name: str | None
+    last_seen: datetime | None
+    alive: bool
+
+
+def is_alive(last_seen, now=None):
+    if last_seen is None:
+        return False
+    return last_seen > (now or timezone.now()) - DEAD_AFTER
+
+
+class Liveness:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # everything seen by this process, and what hasn't been written yet
+        self._seen = {}
+        self._unflushed = {}
+        self._flushed_at = time.monotonic()
+
+    def _record(self, scanner_id, when):
+        """Returns whether a flush is due."""
+        with self._lock:
+            if scanner_id not in self._seen or self._seen[scanner_id] < when:
+                self._seen[scanner_id] = when
+                self._unflushed[scanner_id] = when
+            return time.monotonic() - self._flushed_at >= FLUSH_INTERVAL
+
+    def seen(self, scanner_id, when=None):
+        """Record a sign of life from a scanner."""
+        if self._record(scanner_id, when or timezone.now()):
+            self.flush()
+
+    async def aseen(self, scanner_id, when=None):
+        """Async version of seen()."""
+        if self._record(scanner_id, when or timezone.now()):
+            await sync_to_async(self.flush)()
+
+    def flush(self):
+        """Write the unwritten last-seen times in one query.
+
+        Never moves last_seen back, since other processes write it too.
+        Returns the number of scanners written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                unflushed, self._unflushed = self._unflushed, {}
+                self._flushed_at = time.monotonic()
+            if not unflushed:
+                return 0
+
+            scanners = []
+            for scanner_id, when in unflushed.items():
+                when = Value(when, output_field=DateTimeField())
+                scanners.append(
+                    Scanner(
+                        pk=scanner_id,
+                        last_seen=Greatest(Coalesce(F('last_seen'), when), when),
+                    )
+                )
+            try:
+                # bulk_update sends no signals, so the directory stays put
+                Scanner.objects.bulk_update(scanners, ['last_seen'])
+            except DatabaseError:
+                logger.exception('Could not write scanner last-seen times')
+                with self._lock:
+                    for scanner_id, when in unflushed.items():
+                        self._unflushed.setdefault(scanner_id, when)
+                return 0
+            return len(unflushed)
+
+    def last_seen(self, scanner_id):
+        """When this process last heard from the scanner, if ever."""
+        with self._lock:
+            return self._seen.get(scanner_id)
+
+    def fleet(self, now=None):
+        """The status of every scanner, as far as this process knows."""
+        now = now or timezone.now()
+        statuses = []
+        for scanner_id, name, last_seen in Scanner.objects.order_by(
+            'name', 'id'
+        ).values_list('id', 'name', 'last_seen'):
+            recent = self.last_seen(scanner_id)
+            if recent is not None and (last_seen is None or recent > last_seen):
+                last_seen = recent
+            statuses.append(
+                ScannerStatus(
+                    id=scanner_id,
+                    name=name,
+                    last_seen=last_seen,
+                    alive=is_alive(last_seen, now),
+                )
+            )
+        return statuses
+
+
+liveness = Liveness()
+
+# scanners found dead by the last sweep in this process
+_dead = set()
+
+
+def sweep(now=None):
+    """Log the scanners that died or came back since the last sweep.
+
+    Returns the IDs of the dead scanners.
+    """
+    liveness.flush()
+    dead = {status.id for status in liveness.fleet(now) if not status.alive}
+    for scanner_id in sorted(dead - _dead):
+        logger.warning('Scanner %s has not been seen for %s', scanner_id, DEAD_AFTER)
+    for scanner_id in sorted(_dead - dead):
+        logger.info('Scanner %s is back', scanner_id)
+    _dead.clear()
+    _dead.update(dead)
+    return dead
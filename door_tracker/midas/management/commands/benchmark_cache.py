@@ -0,0 +1,57 @@
+import statistics
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from door_tracker.file_cache import FileCache
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the latency of cache hits, of the per-process cache and of '
+        'the file caches shared between processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keys', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        # room for every key, so that every get() is a hit
+        params = {'OPTIONS': {'MAX_ENTRIES': 2 * options['keys']}}
+        with tempfile.TemporaryDirectory() as directory:
+            backends = [
+                ('locmem', LocMemCache('benchmark', params)),
+                ('django file', FileBasedCache(f'{directory}/django', params)),
+                ('shared file', FileCache(f'{directory}/shared', params)),
+            ]
+            for label, cache in backends:
+                self.stdout.write(f'{label:>12}: {self.run(cache, options)}')
+
+    def run(self, cache, options):
+        keys = [f'midas_statistics:{i}:1:today' for i in range(options['keys'])]
+        for i, key in enumerate(keys):
+            cache.set(key, i, timeout=None)
+        cache.set('generation', 0, timeout=None)
+        assert len(cache.get_many(keys)) == len(keys)
+
+        results = []
+        for name, operation in [
+            ('get', lambda i: cache.get(keys[i % len(keys)])),
+            ('get_many(4)', lambda i: cache.get_many(keys[i % len(keys) :][:4])),
+            ('incr', lambda i: cache.incr('generation')),
+        ]:
+            latencies = []
+            for i in range(options['repeat']):
+                start = time.perf_counter()
+                operation(i)
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            results.append(
+                f'{name} p50 {statistics.median(latencies) * 1e6:.1f}µs '
+                f'p95 {latencies[int(len(latencies) * 0.95) - 1] * 1e6:.1f}µs'
+            )
+        assert cache.get('generation') == options['repeat']
+        return ', '.join(results)
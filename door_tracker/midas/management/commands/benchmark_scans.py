@@ -0,0 +1,57 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.urls import reverse
+
+from midas.benchmarks import Timer, benchmark_database, create_members
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark concurrent register_scan calls through the ASGI handler, '
+        'comparing the sync and async implementations.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=50)
+        parser.add_argument('--scans', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            _, tags = create_members(options['members'])
+
+            for label, url_name in [
+                ('sync', 'midas:register_scan_sync'),
+                ('async', 'midas:register_scan'),
+            ]:
+                timer = asyncio.run(
+                    self.run_scans(
+                        reverse(url_name),
+                        tags,
+                        options['scans'],
+                        options['concurrency'],
+                    )
+                )
+                self.stdout.write(f'{label:>5}: {timer.summary()}')
+
+    async def run_scans(self, url, tags, count, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        timer = Timer()
+
+        async def scan(i):
+            async with semaphore:
+                with timer.measure():
+                    res = await client.post(
+                        url,
+                        {'device_id': 'benchmark', 'tag_id': tags[i % len(tags)]},
+                        content_type='application/json',
+                    )
+                if res.status_code != 200:
+                    raise RuntimeError(f'scan failed: {res.content}')
+
+        await asyncio.gather(*(scan(i) for i in range(count)))
+        timer.stop()
+        return timer
@@ -0,0 +1,129 @@
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from door_tracker import sqlite_profile
+from midas.benchmarks import Timer
+
+# Django's default busy timeout for SQLite
+DEFAULT_TIMEOUT = 5
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark how long scan transactions wait for the SQLite write lock '
+        'while pages are being read, with and without the SQLite profile.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--scans', type=int, default=200, help='Per writer')
+        parser.add_argument('--members', type=int, default=100)
+
+    def handle(self, *args, **options):
+        for label, profile in [('default', False), ('profile', True)]:
+            with tempfile.TemporaryDirectory() as directory:
+                path = Path(directory) / 'benchmark.sqlite3'
+                self.create(path, options['members'])
+                scans, reads, errors = self.run(path, profile, options)
+            self.stdout.write(f'{label:>7}, scans: {scans.summary()}')
+            self.stdout.write(f'{label:>7}, reads: {reads.summary()}')
+            self.stdout.write(f'{label:>7}, "database is locked" retries: {errors}')
+
+    def connect(self, path, profile):
+        if not profile:
+            return sqlite3.connect(path, timeout=DEFAULT_TIMEOUT, isolation_level=None)
+        db = sqlite3.connect(
+            path, timeout=sqlite_profile.BUSY_TIMEOUT, isolation_level=None
+        )
+        db.executescript(sqlite_profile.init_command())
+        return db
+
+    def create(self, path, members):
+        db = sqlite3.connect(path)
+        db.executescript(
+            """
+            CREATE TABLE session (id INTEGER PRIMARY KEY, user INTEGER, open INTEGER);
+            CREATE INDEX session_user ON session (user, open);
+            CREATE TABLE log (id INTEGER PRIMARY KEY, session INTEGER, time REAL);
+            """
+        )
+        db.executemany(
+            'INSERT INTO session (user, open) VALUES (?, 0)',
+            [(i % members,) for i in range(20 * members)],
+        )
+        db.commit()
+        db.close()
+
+    def run(self, path, profile, options):
+        scans = Timer()
+        reads = Timer()
+        errors = 0
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def write(writer):
+            nonlocal errors
+            db = self.connect(path, profile)
+            for i in range(options['scans']):
+                user = (writer * options['scans'] + i) % options['members']
+                with scans.measure():
+                    while True:
+                        try:
+                            self.scan(db, user, profile)
+                            break
+                        except sqlite3.OperationalError as e:
+                            if 'locked' not in str(e) and 'busy' not in str(e):
+                                raise
+                            if db.in_transaction:
+                                db.execute('ROLLBACK')
+                            with lock:
+                                errors += 1
+            db.close()
+
+        def read():
+            db = self.connect(path, profile)
+            while not done.is_set():
+                with reads.measure():
+                    db.execute(
+                        'SELECT user, COUNT(*), SUM(log.time) FROM session '
+                        'LEFT JOIN log ON log.session = session.id GROUP BY user'
+                    ).fetchall()
+            db.close()
+
+        readers = [threading.Thread(target=read) for _ in range(options['readers'])]
+        writers = [
+            threading.Thread(target=write, args=(i,)) for i in range(options['writers'])
+        ]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+        scans.stop()
+        reads.stop()
+        return scans, reads, errors
+
+    def scan(self, db, user, profile):
+        # like process_scans: look up the open session, then write
+        db.execute('BEGIN IMMEDIATE' if profile else 'BEGIN')
+        row = db.execute(
+            'SELECT id FROM session WHERE user = ? AND open = 1', (user,)
+        ).fetchone()
+        if row is None:
+            session = db.execute(
+                'INSERT INTO session (user, open) VALUES (?, 1)', (user,)
+            ).lastrowid
+        else:
+            (session,) = row
+            db.execute('UPDATE session SET open = 0 WHERE id = ?', (session,))
+        db.execute(
+            "INSERT INTO log (session, time) VALUES (?, julianday('now'))", (session,)
+        )
+        db.execute('COMMIT')
@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from midas.benchmarks import Timer, benchmark_database, create_members, create_sessions
+from midas.statistics import get_sessions_time, get_sessions_time_per_user
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark team statistics over a year of sessions, comparing one '
+        'query per member with a single grouped query.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=200)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            users, _ = create_members(options['members'])
+            sessions = create_sessions(users, options['days'])
+            self.stdout.write(f'{len(users)} members, {sessions} sessions')
+
+            end = timezone.now()
+            for label, days in [('week', 7), ('year', options['days'])]:
+                start = end - timedelta(days=days)
+                per_member = self.run(
+                    lambda start=start: {
+                        user.pk: get_sessions_time(user, start, end) for user in users
+                    },
+                    options['repeat'],
+                )
+                grouped = self.run(
+                    lambda start=start: get_sessions_time_per_user(users, start, end),
+                    options['repeat'],
+                )
+                self.stdout.write(f'{label}, per member: {per_member}')
+                self.stdout.write(f'{label},   grouped: {grouped}')
+
+    def run(self, compute, repeat):
+        with CaptureQueriesContext(connection) as queries:
+            result = compute()
+        timer = Timer()
+        for _ in range(repeat):
+            with timer.measure():
+                assert compute() == result
+        timer.stop()
+        return f'{len(queries)} queries, {timer.summary()}'
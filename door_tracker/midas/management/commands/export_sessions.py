@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from midas.columnar import FORMATS, export_sessions
+
+
+class Command(BaseCommand):
+    help = 'Export all sessions as a Parquet or Arrow file, for analysis.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='file to write to')
+        parser.add_argument('--format', choices=FORMATS, default='parquet')
+
+    def handle(self, *args, **options):
+        with open(options['output'], 'wb') as f:
+            f.writelines(export_sessions(options['format']))
+        self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
@@ -0,0 +1,187 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from midas.benchmarks import Timer, create_members, create_sessions
+from midas.models import Assignment, Quota, Subteam
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the server as it scales from 1 to N worker processes: '
+        'scans per second, and team overview pages per second.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+        parser.add_argument('--members', type=int, default=100)
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument(
+            '--database-url',
+            help='Database to test against (default: a temporary SQLite file). '
+            'It is migrated and filled with test data.',
+        )
+        parser.add_argument(
+            '--seed',
+            action='store_true',
+            help='Only fill the configured database, and print a session key',
+        )
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.stdout.write(self.seed(options['members'], options['days']))
+            return
+
+        if options['members'] < options['concurrency']:
+            # clients scan disjoint tags; concurrent scans of one tag race
+            raise CommandError('Need at least as many members as concurrent clients')
+
+        with tempfile.TemporaryDirectory() as directory:
+            env = {
+                **os.environ,
+                'DATABASE_URL': options['database_url']
+                or f'sqlite:///{directory}/load_test.sqlite3',
+                'DJANGO_SCHEDULER': 'False',
+                'DJANGO_CACHE_DIR': f'{directory}/cache',
+            }
+            django = [sys.executable, '-m', 'django']
+            subprocess.run(
+                [*django, 'migrate', '--noinput', '-v0'], env=env, check=True
+            )
+            seeded = subprocess.run(
+                [
+                    *django,
+                    'load_test',
+                    '--seed',
+                    f'--members={options["members"]}',
+                    f'--days={options["days"]}',
+                ],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            session_key = seeded.stdout.split()[-1]
+            tags = [f'{i:08X}' for i in range(options['members'])]
+
+            for workers in options['workers']:
+                port = free_port()
+                server = subprocess.Popen(
+                    [*django, 'serve', f'--port={port}', f'--workers={workers}'],
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+                try:
+                    self.wait_until_up(port)
+                    scans = self.run(
+                        port,
+                        options,
+                        lambda client, i: (
+                            'POST',
+                            '/api/register_scan',
+                            json.dumps(
+                                {
+                                    'device_id': 'benchmark',
+                                    'tag_id': self.client_tag(tags, client, i, options),
+                                }
+                            ),
+                            {'Content-Type': 'application/json'},
+                        ),
+                    )
+                    pages = self.run(
+                        port,
+                        options,
+                        lambda client, i: (
+                            'GET',
+                            '/team_overview',
+                            None,
+                            {'Cookie': f'{settings.SESSION_COOKIE_NAME}={session_key}'},
+                        ),
+                    )
+                finally:
+                    server.terminate()
+                    server.wait()
+                self.stdout.write(f'{workers} workers, scans: {scans}')
+                self.stdout.write(f'{workers} workers, pages: {pages}')
+
+    def seed(self, members, days):
+        users, _ = create_members(members)
+        create_sessions(users, days)
+        quota = Quota.objects.create(name='Load test', hours=16)
+        subteam = Subteam.objects.create(name='Load test')
+        for user in users:
+            assignment = Assignment.objects.create(user=user, quota=quota)
+            assignment.subteams.add(subteam)
+
+        admin = User.objects.create_superuser('load_test')
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(admin.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = admin.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    def client_tag(self, tags, client, i, options):
+        own_tags = tags[client :: options['concurrency']]
+        return own_tags[i % len(own_tags)]
+
+    def wait_until_up(self, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError(f'The server on port {port} did not come up')
+
+    def run(self, port, options, make_request):
+        timer = Timer()
+        # one connection per client, like scanners and browsers keep alive
+        clients = options['concurrency']
+        per_client = options['requests'] // clients
+
+        def client(n):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            try:
+                for i in range(per_client):
+                    method, url, body, headers = make_request(n, i)
+                    with timer.measure():
+                        connection.request(
+                            method,
+                            url,
+                            body,
+                            {'X-Forwarded-Proto': 'https', **headers},
+                        )
+                        response = connection.getresponse()
+                        response.read()
+                    if response.status != 200:
+                        raise CommandError(f'{method} {url}: {response.status}')
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(clients) as pool:
+            list(pool.map(client, range(clients)))
+        timer.stop()
+        return timer.summary()
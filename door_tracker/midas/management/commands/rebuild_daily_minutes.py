@@ -0,0 +1,16 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from midas import rollup, statistics_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the DailyMinutes rollup from all closed sessions, e.g. after '
+        'sessions were changed outside of the ORM.'
+    )
+
+    def handle(self, *args, **options):
+        rows = rollup.rebuild()
+        statistics_cache.invalidate(User.objects.values_list('pk', flat=True))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} daily totals'))
@@ -0,0 +1,40 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_closed_sessions(apps, schema_editor):
+    Session = apps.get_model('midas', 'Session')
+    Session.objects.filter(checkout__isnull=False).update(is_open=False)
+
+    # only the latest open session of a user can stay open
+    open_sessions = Session.objects.filter(is_open=True).order_by('user', '-pk')
+    latest = {}
+    for session in open_sessions.only('pk', 'user'):
+        latest.setdefault(session.user_id, session.pk)
+    open_sessions.exclude(pk__in=latest.values()).update(is_open=False)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('midas', '0006_alter_assignment_quota_alter_pendingtag_scanner'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='is_open',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.RunPython(mark_closed_sessions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='session',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('is_open', True)),
+                fields=('user',),
+                name='unique_open_session_per_user',
+            ),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:08
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+import django.db.models.deletion
+import pytz
+from django.conf import settings
+from django.db import migrations, models
+
+AMSTERDAM_TZ = pytz.timezone('Europe/Amsterdam')
+BATCH_SIZE = 1000
+
+
+def split_by_day(start, end, tz):
+    # a copy of midas.datetime_util.split_by_day, as of this migration
+    days = {}
+    day = start.astimezone(tz).date()
+    while True:
+        day_start = tz.localize(datetime.combine(day, time.min))
+        day_end = tz.localize(datetime.combine(day + timedelta(days=1), time.min))
+        duration = min(end, day_end) - max(start, day_start)
+        if duration > timedelta(0):
+            days[day] = duration
+        if day_end >= end:
+            return days
+        day += timedelta(days=1)
+
+
+def fill_daily_minutes(apps, schema_editor):
+    """Sum the closed sessions per user and Amsterdam day.
+
+    Only sessions with a check-in and a check-out have a duration. Sessions
+    that 0007 closed without a check-out (forgotten check-outs, followed by
+    a later check-in) are left out, just like the statistics leave them out.
+    """
+    Session = apps.get_model('midas', 'Session')
+    DailyMinutes = apps.get_model('midas', 'DailyMinutes')
+
+    totals = defaultdict(timedelta)
+    sessions = Session.objects.filter(
+        checkin__isnull=False, checkout__isnull=False
+    ).values_list('user_id', 'checkin__time', 'checkout__time')
+    for user_id, checkin, checkout in sessions.iterator(chunk_size=BATCH_SIZE):
+        for date, duration in split_by_day(checkin, checkout, AMSTERDAM_TZ).items():
+            totals[user_id, date] += duration
+
+    DailyMinutes.objects.bulk_create(
+        (
+            DailyMinutes(user_id=user_id, date=date, duration=duration)
+            for (user_id, date), duration in totals.items()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('midas', '0007_session_is_open'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMinutes',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('date', models.DateField()),
+                ('duration', models.DurationField()),
+                (
+                    'user',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='daily_minutes',
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(
+                        fields=('user', 'date'), name='unique_daily_minutes_per_user'
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_daily_minutes, migrations.RunPython.noop),
+    ]
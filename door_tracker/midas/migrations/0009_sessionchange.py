@@ -0,0 +1,62 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_existing_sessions(apps, schema_editor):
+    # so that syncing from the start also returns sessions from before
+    Session = apps.get_model('midas', 'Session')
+    SessionChange = apps.get_model('midas', 'SessionChange')
+    SessionChange.objects.bulk_create(
+        (
+            SessionChange(session_id=session_id, user_id=user_id)
+            for session_id, user_id in Session.objects.order_by('pk').values_list(
+                'pk', 'user_id'
+            )
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('midas', '0008_dailyminutes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionChange',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('session_id', models.BigIntegerField()),
+                (
+                    'user',
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name='+',
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                'indexes': [
+                    models.Index(
+                        fields=['user', 'id'], name='midas_sessi_user_id_446f81_idx'
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(record_existing_sessions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('midas', '0009_sessionchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lease',
+            fields=[
+                ('name', models.CharField(primary_key=True, serialize=False)),
+                ('holder', models.CharField()),
+                ('expires', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('midas', '0010_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanner',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('midas', '0011_scanner_last_seen'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='session',
+            name='is_open',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
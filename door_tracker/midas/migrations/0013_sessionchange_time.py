@@ -0,0 +1,30 @@
+# Generated by Django 6.0.6 on 2026-10-18 07:58
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('midas', '0012_session_starts_closed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sessionchange',
+            name='time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='sessionchange',
+            index=models.Index(
+                fields=['session_id', 'id'], name='midas_sessi_session_2e9eb8_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='sessionchange',
+            index=models.Index(fields=['time'], name='midas_sessi_time_0816df_idx'),
+        ),
+    ]
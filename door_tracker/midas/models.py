@@ -68,6 +68,100 @@ class Checkout(Log):
 
 class Session(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sessions')
+    # Whether the session has no checkout yet. Kept in sync by signals on
+    # Checkout (see signals.py), so that finding the open session of a user
+    # is a single probe of the partial index below. Sessions start closed:
+    # only a check-in opens one, see `update_is_open()`.
+    is_open = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(is_open=True),
+                name='unique_open_session_per_user',
+            ),
+        ]
+
+    def update_is_open(self):
+        """Set is_open from whether the session has a checkout.
+
+        A user can only have one open session, so a session without checkout
+        is only opened if it is the user's latest and no other one is open;
+        an older session without checkout (e.g. added in the admin) stays
+        closed.
+        """
+        sessions = Session.objects.filter(pk=self.pk)
+        if Checkout.objects.filter(session_id=self.pk).exists():
+            sessions.update(is_open=False)
+            return
+
+        checkin_time = (
+            Checkin.objects.filter(session_id=self.pk)
+            .values_list('time', flat=True)
+            .first()
+        )
+        others = Session.objects.filter(user_id=self.user_id).exclude(pk=self.pk)
+        if others.filter(is_open=True).exists() or (
+            checkin_time is not None
+            and others.filter(checkin__time__gt=checkin_time).exists()
+        ):
+            sessions.update(is_open=False)
+        else:
+            sessions.update(is_open=True)
+
+
+class DailyMinutes(models.Model):
+    """Time a user spent in closed sessions on one Amsterdam calendar day.
+
+    Derived from Session, Checkin and Checkout; see rollup.py.
+    """
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='daily_minutes'
+    )
+    date = models.DateField()
+    duration = models.DurationField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'date'], name='unique_daily_minutes_per_user'
+            ),
+        ]
+
+
+class SessionChange(models.Model):
+    """A session was created, changed or deleted.
+
+    The ever-increasing ID is the cursor of the incremental export; see
+    changes.py. Rows don't point to the session itself, so that they
+    outlive it as a tombstone.
+    """
+
+    session_id = models.BigIntegerField()
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    time = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['session_id', 'id']),
+            models.Index(fields=['time']),
+        ]
+
+
+class Lease(models.Model):
+    """Whoever holds an unexpired lease is the only one doing a job.
+
+    Used to elect the process that runs scheduled jobs; see leases.py.
+    """
+
+    name = models.CharField(primary_key=True)
+    holder = models.CharField()
+    expires = models.DateTimeField()
 
 
 class ClaimedTag(models.Model):
@@ -89,6 +183,8 @@ def _generate_scanner_id():
 class Scanner(models.Model):
     id = models.CharField(primary_key=True, default=_generate_scanner_id)
     name = models.CharField(null=True, blank=True)
+    # written in batches, see liveness.py
+    last_seen = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.name or '-'
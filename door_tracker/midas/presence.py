@@ -0,0 +1,274 @@
+"""In-process registry of who is checked in right now.
+
+Every page shows whether the user is checked in, and the occupancy board
+shows everyone who is. The registry keeps the open sessions in memory, so
+neither needs a query. Check-ins and check-outs are applied to it as their
+transaction commits (see `midas.signals` and `midas.scans`), and bump a
+generation counter in the shared cache once, so that other processes
+reload all open sessions the next time they are asked. Other changes, such
+as edits in the admin, make every process reload. Changes are also
+published on the presence topic (see `midas.events`), so open occupancy
+boards update at once.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, replace
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, transaction
+
+from . import events
+from .models import Assignment, Session, Subteam
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'midas_presence_generation'
+
+
+@dataclass(frozen=True)
+class PresentUser:
+    user_id: int
+    name: str
+    since: datetime | None
+    subteams: tuple[str, ...] = ()
+
+
+class Presence:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._warm_lock = threading.Lock()
+        self._present = {}
+        # everyone seen checked in since the last reload, for check-ins
+        self._members = {}
+        self._subteam_names = []
+        self._occupancy = None
+
+    def _current_generation(self):
+        # not 0: if the counter gets evicted, it must not restart at a value
+        # that some process still has a copy of
+        return cache.get_or_set(GENERATION_KEY, time.time_ns, timeout=None)
+
+    def warm(self):
+        """(Re)load all open sessions from the database."""
+        generation = self._current_generation()
+
+        sessions = list(
+            Session.objects.filter(is_open=True).values(
+                'user_id', 'user__first_name', 'user__last_name', 'checkin__time'
+            )
+        )
+        subteams = _subteams([row['user_id'] for row in sessions])
+
+        present = {}
+        for row in sessions:
+            present[row['user_id']] = PresentUser(
+                user_id=row['user_id'],
+                name=_name(row['user__first_name'], row['user__last_name']),
+                since=row['checkin__time'],
+                subteams=subteams.get(row['user_id'], ()),
+            )
+        subteam_names = list(
+            Subteam.objects.order_by('name').values_list('name', flat=True)
+        )
+
+        with self._lock:
+            self._present = present
+            self._members = dict(present)
+            self._subteam_names = subteam_names
+            self._occupancy = _occupancy(_by_arrival(present.values()), subteam_names)
+            self._generation = generation
+
+    def apply(self, changes):
+        """Apply committed check-ins and check-outs, and tell other processes.
+
+        `changes` maps user IDs to their check-in time, or to None for a
+        check-out. Bumps the shared generation once; if another process
+        bumped it since the last reload, the next lookup reloads instead.
+        """
+        # the name and subteams of users that checked in before are kept
+        unknown = [
+            user_id
+            for user_id, since in changes.items()
+            if since is not None and user_id not in self._members
+        ]
+        members = {}
+        if unknown and self._generation is not None:
+            members = _members(unknown)
+
+        generation = _bump()
+        with self._lock:
+            if self._generation is None or generation != self._generation + 1:
+                return
+            members |= self._members
+            present = dict(self._present)
+            for user_id, since in changes.items():
+                if since is None:
+                    present.pop(user_id, None)
+                elif user_id in members:
+                    present[user_id] = replace(members[user_id], since=since)
+                else:
+                    # e.g. deleted in the meantime; let the next lookup sort it out
+                    return
+
+            self._present = present
+            self._members = members | present
+            self._occupancy = _occupancy(
+                _by_arrival(present.values()), self._subteam_names
+            )
+            self._generation = generation
+
+    def invalidate(self):
+        """Drop the registry, in this and every other process."""
+        with self._lock:
+            self._generation = None
+        _bump()
+
+    def _is_fresh(self):
+        return (
+            self._generation is not None
+            and self._generation == self._current_generation()
+        )
+
+    def _ensure_fresh(self):
+        if not self._is_fresh():
+            # many requests can find it stale at once; one reload will do
+            with self._warm_lock:
+                if not self._is_fresh():
+                    self.warm()
+
+    async def _aensure_fresh(self):
+        if not self._is_fresh():
+            await sync_to_async(self._ensure_fresh)()
+
+    def is_present(self, user_id):
+        """Whether the user is checked in."""
+        self._ensure_fresh()
+        return user_id in self._present
+
+    def present(self):
+        """Everyone who is checked in, longest present first."""
+        self._ensure_fresh()
+        return _by_arrival(self._present.values())
+
+    def occupancy(self):
+        """Who is in and the headcount per subteam, as JSON.
+
+        Computed once per reload, so any number of viewers can be sent the
+        same string.
+        """
+        self._ensure_fresh()
+        return self._occupancy
+
+    async def ais_present(self, user_id):
+        """Async version of is_present()."""
+        await self._aensure_fresh()
+        return user_id in self._present
+
+    async def apresent(self):
+        """Async version of present()."""
+        await self._aensure_fresh()
+        return _by_arrival(self._present.values())
+
+    async def aoccupancy(self):
+        """Async version of occupancy()."""
+        await self._aensure_fresh()
+        return self._occupancy
+
+
+def _bump():
+    """Increment the shared generation and return it."""
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        generation = time.time_ns()
+        cache.set(GENERATION_KEY, generation, timeout=None)
+        return generation
+
+
+def _name(first_name, last_name):
+    return f'{first_name} {last_name}'.strip()
+
+
+def _subteams(user_ids):
+    """The sorted subteams of each user's current assignment."""
+    subteams = {}
+    for row in (
+        Assignment.objects.filter_current()
+        .filter(user_id__in=user_ids)
+        .exclude(subteams=None)
+        .values('user_id', 'subteams__name')
+    ):
+        subteams.setdefault(row['user_id'], []).append(row['subteams__name'])
+    return {user_id: tuple(sorted(names)) for user_id, names in subteams.items()}
+
+
+def _members(user_ids):
+    """PresentUser entries without a check-in time, by user ID."""
+    subteams = _subteams(user_ids)
+    return {
+        pk: PresentUser(pk, _name(first_name, last_name), None, subteams.get(pk, ()))
+        for pk, first_name, last_name in User.objects.filter(
+            pk__in=user_ids
+        ).values_list('pk', 'first_name', 'last_name')
+    }
+
+
+def _by_arrival(users):
+    return sorted(users, key=lambda u: (u.since is None, u.since or 0, u.name))
+
+
+def _occupancy(present, subteam_names):
+    headcount = Counter(subteam for user in present for subteam in user.subteams)
+    return json.dumps(
+        {
+            'present': [
+                {'name': user.name, 'since': user.since, 'subteams': user.subteams}
+                for user in present
+            ],
+            'subteams': [
+                {'name': name, 'headcount': headcount[name]} for name in subteam_names
+            ],
+        },
+        cls=DjangoJSONEncoder,
+    )
+
+
+presence = Presence()
+
+
+def _changed():
+    presence.invalidate()
+    events.broker.publish(events.PRESENCE_TOPIC)
+
+
+def _applied(changes):
+    presence.apply(changes)
+    events.broker.publish(events.PRESENCE_TOPIC)
+
+
+def invalidate_presence():
+    """Make every process reload the registry once the transaction commits."""
+    transaction.on_commit(_changed)
+
+
+def record_presence(changes):
+    """Apply {user ID: check-in time, or None} once the transaction commits."""
+    transaction.on_commit(lambda: _applied(changes))
+
+
+def warm_up():
+    """Fill the registry at server startup."""
+    try:
+        presence.warm()
+    except DatabaseError:
+        # e.g. migrations haven't been applied yet; the first lookup retries
+        logger.warning('Could not warm up the presence registry', exc_info=True)
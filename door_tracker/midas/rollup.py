@@ -0,0 +1,158 @@
+"""Maintenance of the DailyMinutes rollup.
+
+Closed sessions are split at Amsterdam midnight and summed per user and
+day. New checkouts add their session to the rollup; any other change to a
+closed session (edits or deletes, e.g. through the admin) recomputes the
+days it touched. The signal handlers in signals.py call into this module.
+Open sessions are not part of the rollup; statistics add them separately.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+
+from .datetime_util import split_by_day
+from .models import DailyMinutes, Session
+from .statistics import AMSTERDAM_TZ
+
+BATCH_SIZE = 1000
+
+
+def session_span(session_id):
+    """Return (user_id, checkin time, checkout time) of a closed session.
+
+    Returns None if the session is open, incomplete or doesn't exist.
+    """
+    return (
+        Session.objects.filter(
+            pk=session_id,
+            checkin__isnull=False,
+            checkout__isnull=False,
+        )
+        .values_list('user_id', 'checkin__time', 'checkout__time')
+        .first()
+    )
+
+
+def span_days(span):
+    if span is None:
+        return set()
+    _, checkin, checkout = span
+    return set(split_by_day(checkin, checkout, AMSTERDAM_TZ))
+
+
+def add_durations(durations):
+    """Add {(user_id, date): timedelta} to the rollup."""
+    if not durations:
+        return
+
+    existing = {
+        (row.user_id, row.date): row
+        for row in DailyMinutes.objects.filter(
+            user_id__in={user_id for user_id, _ in durations},
+            date__in={date for _, date in durations},
+        )
+    }
+
+    to_update = []
+    to_create = []
+    for (user_id, date), duration in durations.items():
+        row = existing.get((user_id, date))
+        if row is not None:
+            row.duration += duration
+            to_update.append(row)
+        else:
+            to_create.append(
+                DailyMinutes(user_id=user_id, date=date, duration=duration)
+            )
+
+    with transaction.atomic(savepoint=False):
+        DailyMinutes.objects.bulk_update(to_update, ['duration'])
+        DailyMinutes.objects.bulk_create(to_create)
+
+
+def add_sessions(spans):
+    """Add closed sessions, given as (user_id, checkin, checkout), to the rollup."""
+    durations = defaultdict(timedelta)
+    for user_id, checkin, checkout in spans:
+        for date, duration in split_by_day(checkin, checkout, AMSTERDAM_TZ).items():
+            durations[user_id, date] += duration
+    add_durations(durations)
+
+
+def refresh_days(user_id, dates):
+    """Recompute the given days of a user from the sessions themselves."""
+    if not dates:
+        return
+
+    start = AMSTERDAM_TZ.localize(datetime.combine(min(dates), time.min))
+    end = AMSTERDAM_TZ.localize(
+        datetime.combine(max(dates) + timedelta(days=1), time.min)
+    )
+    sessions = Session.objects.filter(
+        user_id=user_id,
+        checkin__time__lt=end,
+        checkout__time__gt=start,
+    ).values_list('checkin__time', 'checkout__time')
+
+    totals = defaultdict(timedelta)
+    for checkin, checkout in sessions:
+        for date, duration in split_by_day(checkin, checkout, AMSTERDAM_TZ).items():
+            if date in dates:
+                totals[date] += duration
+
+    with transaction.atomic(savepoint=False):
+        DailyMinutes.objects.filter(user_id=user_id, date__in=dates).delete()
+        DailyMinutes.objects.bulk_create(
+            DailyMinutes(user_id=user_id, date=date, duration=duration)
+            for date, duration in totals.items()
+        )
+
+
+def refresh_span_change(old_span, new_span):
+    """Recompute the days touched by a session before and after a change."""
+    dates = defaultdict(set)
+    for span in (old_span, new_span):
+        if span is not None:
+            user_id, _, _ = span
+            dates[user_id] |= span_days(span)
+    for user_id, user_dates in dates.items():
+        refresh_days(user_id, user_dates)
+
+
+def rebuild():
+    """Throw away the rollup and compute it again from all closed sessions."""
+    sessions = (
+        Session.objects.filter(checkin__isnull=False, checkout__isnull=False)
+        .values_list('user_id', 'checkin__time', 'checkout__time')
+        .order_by('user_id')
+    )
+
+    def flush(user_id, totals):
+        DailyMinutes.objects.bulk_create(
+            (
+                DailyMinutes(user_id=user_id, date=date, duration=duration)
+                for date, duration in totals.items()
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+    rows = 0
+    with transaction.atomic():
+        DailyMinutes.objects.all().delete()
+
+        current_user_id = None
+        totals = defaultdict(timedelta)
+        for user_id, checkin, checkout in sessions.iterator(chunk_size=BATCH_SIZE):
+            if user_id != current_user_id:
+                flush(current_user_id, totals)
+                rows += len(totals)
+                current_user_id = user_id
+                totals = defaultdict(timedelta)
+            for date, duration in split_by_day(checkin, checkout, AMSTERDAM_TZ).items():
+                totals[date] += duration
+        flush(current_user_id, totals)
+        rows += len(totals)
+
+    return rows
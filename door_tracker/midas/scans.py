@@ -0,0 +1,326 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import TextChoices
+from django.utils import timezone
+
+from . import changes, rollup, statistics_cache
+from .directory import TagEntry, directory
+from .models import (
+    Checkin,
+    Checkout,
+    ClaimedTag,
+    LogType,
+    PendingTag,
+    Session,
+)
+from .presence import record_presence
+
+
+class RegisterScanState(TextChoices):
+    REGISTER = 'register', 'Tag registered'
+    CHECKIN = 'checkin', 'User checked in'
+    CHECKOUT = 'checkout', 'User checked out'
+
+
+class ScannerNotAuthorized(Exception):
+    pass
+
+
+class TagNotRegistered(Exception):
+    pass
+
+
+class ScanOutOfOrder(Exception):
+    pass
+
+
+class ScanInFuture(Exception):
+    pass
+
+
+# how far a scanner's clock may run ahead of ours
+MAX_CLOCK_SKEW = timedelta(seconds=10)
+
+
+def in_future(time, now=None):
+    return time > (now or timezone.now()) + MAX_CLOCK_SKEW
+
+
+@dataclass
+class Scan:
+    state: RegisterScanState
+    owner_id: int
+    owner_name: str
+    time: datetime
+
+
+def process_scan(device_id, tag_id, time=None):
+    """Register a pending tag, check in or check out, depending on state.
+
+    Scanners and tags come from the in-process directory; the only read is
+    the open session lookup. All writes happen in a single transaction.
+    Raises ScanOutOfOrder for a checkout before the open session's check-in.
+    """
+
+    if time is None:
+        time = timezone.now()
+
+    scanner = directory.scanner(device_id)
+    if scanner is None:
+        raise ScannerNotAuthorized
+
+    with transaction.atomic():
+        # try to register a pending tag
+        pending_tag = scanner.pending_tag
+        if pending_tag is not None:
+            deleted, _ = PendingTag.objects.filter(pk=pending_tag.id).delete()
+            if deleted:
+                ClaimedTag.objects.create(
+                    owner_id=pending_tag.owner_id,
+                    name=pending_tag.name,
+                    code=tag_id,
+                )
+                return Scan(
+                    state=RegisterScanState.REGISTER,
+                    owner_id=pending_tag.owner_id,
+                    owner_name=pending_tag.owner_name,
+                    time=time,
+                )
+
+        tag = directory.tag(tag_id)
+        if tag is None:
+            raise TagNotRegistered
+
+        state = _check_in_or_out(tag, time)
+
+    return Scan(
+        state=state,
+        owner_id=tag.owner_id,
+        owner_name=tag.owner_name,
+        time=time,
+    )
+
+
+def _check_in_or_out(tag, time):
+    """Check out if the owner has an open session, check in otherwise.
+
+    Must run in a transaction. Scans of the same user wait for each other,
+    so that two of them can't both find no open session and check in; on
+    SQLite, write transactions are serialized anyway (see sqlite_profile).
+    """
+    if connection.features.has_select_for_update:
+        list(User.objects.select_for_update().filter(pk=tag.owner_id).values('pk'))
+
+    open_session = (
+        Session.objects.filter(user_id=tag.owner_id, is_open=True)
+        .values_list('pk', 'checkin__time')
+        .first()
+    )
+
+    # try to check out
+    if open_session is not None:
+        open_session_id, checkin_time = open_session
+        if checkin_time is not None and time < checkin_time:
+            raise ScanOutOfOrder
+        _check_out(tag, open_session_id, time)
+        return RegisterScanState.CHECKOUT
+
+    # check in otherwise
+    _check_in(tag, time)
+    return RegisterScanState.CHECKIN
+
+
+def _check_out(tag, session_id, time):
+    # also closes the session, see signals.py
+    Checkout.objects.create(
+        type=LogType.TAG,
+        time=time,
+        tag_id=tag.code,
+        # with the owner filled in, so signals don't have to look it up
+        session=Session(pk=session_id, user_id=tag.owner_id),
+    )
+
+
+def _check_in(tag, time):
+    new_session = Session.objects.create(user_id=tag.owner_id, is_open=True)
+    Checkin.objects.create(
+        type=LogType.TAG,
+        time=time,
+        tag_id=tag.code,
+        session=new_session,
+    )
+
+
+async def aprocess_scan(device_id, tag_id, time=None):
+    """Async version of process_scan.
+
+    The scanner and tag come from the directory without leaving the event
+    loop, so rejected scans never need a thread. The async ORM does not
+    support transactions yet, so looking up the open session and writing,
+    which must happen in one transaction, are handed to a worker thread
+    together. That thread is shared by all requests, so accepted scans are
+    no faster than with process_scan.
+    """
+
+    if time is None:
+        time = timezone.now()
+
+    scanner = await directory.ascanner(device_id)
+    if scanner is None:
+        raise ScannerNotAuthorized
+
+    # registering is rare enough to just use the sync version
+    if scanner.pending_tag is not None:
+        return await sync_to_async(process_scan)(device_id, tag_id, time)
+
+    tag = await directory.atag(tag_id)
+    if tag is None:
+        raise TagNotRegistered
+
+    state = await sync_to_async(transaction.atomic(_check_in_or_out))(tag, time)
+
+    return Scan(
+        state=state,
+        owner_id=tag.owner_id,
+        owner_name=tag.owner_name,
+        time=time,
+    )
+
+
+def process_scans(device_id, scans):
+    """Process a backlog of (tag_id, time) scans from a single scanner.
+
+    Scans must be ordered by time. They are processed in one transaction,
+    with sessions, check-ins and check-outs inserted in bulk. Returns a Scan
+    for every successful scan, or the exception explaining why it failed.
+    """
+
+    scanner = directory.scanner(device_id)
+    if scanner is None:
+        raise ScannerNotAuthorized
+
+    results = []
+    if not scans:
+        return results
+
+    now = timezone.now()
+
+    with transaction.atomic():
+        tags = {tag_id: directory.tag(tag_id) for tag_id, _ in scans}
+
+        # the first scan registers the pending tag, if there is one
+        registered = False
+        pending_tag = scanner.pending_tag
+        if pending_tag is not None:
+            deleted, _ = PendingTag.objects.filter(pk=pending_tag.id).delete()
+            if deleted:
+                tag_id = scans[0][0]
+                ClaimedTag.objects.create(
+                    owner_id=pending_tag.owner_id,
+                    name=pending_tag.name,
+                    code=tag_id,
+                )
+                tags[tag_id] = TagEntry(
+                    code=tag_id,
+                    name=pending_tag.name,
+                    owner_id=pending_tag.owner_id,
+                    owner_name=pending_tag.owner_name,
+                )
+                registered = True
+
+        # current open session and its checkin time, by user
+        open_sessions = {
+            row['user_id']: (
+                Session(pk=row['pk'], user_id=row['user_id']),
+                row['checkin__time'],
+            )
+            for row in Session.objects.filter(
+                user_id__in={t.owner_id for t in tags.values() if t is not None},
+                is_open=True,
+            ).values('pk', 'user_id', 'checkin__time')
+        }
+
+        new_sessions = []
+        checkins = []
+        checkouts = []
+        closed_spans = []
+        presence_changes = {}
+
+        for i, (tag_id, time) in enumerate(scans):
+            tag = tags[tag_id]
+
+            if i == 0 and registered:
+                state = RegisterScanState.REGISTER
+
+            elif in_future(time, now):
+                results.append(ScanInFuture())
+                continue
+
+            elif tag is None:
+                results.append(TagNotRegistered())
+                continue
+
+            elif tag.owner_id in open_sessions:
+                session, checkin_time = open_sessions[tag.owner_id]
+                if checkin_time is not None and time < checkin_time:
+                    results.append(ScanOutOfOrder())
+                    continue
+                checkouts.append(
+                    Checkout(
+                        type=LogType.TAG, time=time, tag_id=tag_id, session=session
+                    )
+                )
+                session.is_open = False
+                if checkin_time is not None:
+                    closed_spans.append((tag.owner_id, checkin_time, time))
+                del open_sessions[tag.owner_id]
+                presence_changes[tag.owner_id] = None
+                state = RegisterScanState.CHECKOUT
+
+            else:
+                session = Session(user_id=tag.owner_id, is_open=True)
+                new_sessions.append(session)
+                checkins.append(
+                    Checkin(type=LogType.TAG, time=time, tag_id=tag_id, session=session)
+                )
+                open_sessions[tag.owner_id] = (session, time)
+                presence_changes[tag.owner_id] = time
+                state = RegisterScanState.CHECKIN
+
+            results.append(
+                Scan(
+                    state=state,
+                    owner_id=tag.owner_id,
+                    owner_name=tag.owner_name,
+                    time=time,
+                )
+            )
+
+        # bulk_create skips signals, so close the sessions and update the
+        # rollup ourselves; close before inserting new open sessions for the
+        # same users
+        Session.objects.filter(
+            pk__in=[c.session.pk for c in checkouts if c.session.pk is not None]
+        ).update(is_open=False)
+        Session.objects.bulk_create(new_sessions)
+        Checkin.objects.bulk_create(checkins)
+        Checkout.objects.bulk_create(checkouts)
+        rollup.add_sessions(closed_spans)
+
+        if presence_changes:
+            record_presence(presence_changes)
+        statistics_cache.invalidate(
+            scan.owner_id for scan in results if isinstance(scan, Scan)
+        )
+        changes.record(
+            dict.fromkeys(
+                (session.pk, session.user_id)
+                for session in [*new_sessions, *(c.session for c in checkouts)]
+            )
+        )
+
+    return results
@@ -0,0 +1,193 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from . import changes, events, rollup, statistics_cache
+from .directory import directory
+from .models import (
+    Assignment,
+    Checkin,
+    Checkout,
+    ClaimedTag,
+    PendingTag,
+    Scanner,
+    Session,
+    Subteam,
+)
+from .presence import invalidate_presence, record_presence
+
+
+def invalidate_directory():
+    # Once right away, so this connection sees its own writes, and once more
+    # after commit, in case someone re-read the old rows in the meantime.
+    directory.invalidate()
+    transaction.on_commit(directory.invalidate)
+
+
+@receiver(post_save, sender=ClaimedTag)
+@receiver(post_delete, sender=ClaimedTag)
+@receiver(post_save, sender=PendingTag)
+@receiver(post_delete, sender=PendingTag)
+@receiver(post_save, sender=Scanner)
+@receiver(post_delete, sender=Scanner)
+def on_directory_change(sender, **kwargs):
+    invalidate_directory()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def on_user_change(sender, update_fields=None, **kwargs):
+    # logging in only touches last_login, which the directory doesn't store
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_directory()
+    invalidate_presence()
+
+
+@receiver(post_save, sender=Checkout)
+def on_checkout_save(sender, instance, **kwargs):
+    if Session.objects.filter(pk=instance.session_id, is_open=True).update(
+        is_open=False
+    ):
+        record_presence({instance.session.user_id: None})
+
+
+@receiver(post_delete, sender=Checkout)
+def on_checkout_delete(sender, instance, **kwargs):
+    # also runs when the session itself is being deleted, before it goes
+    session = Session.objects.filter(pk=instance.session_id).first()
+    if session is not None:
+        session.update_is_open()
+
+
+# DailyMinutes rollup, see rollup.py. The span of the session before the
+# change is stashed on the instance, so both old and new days get refreshed.
+
+
+@receiver(pre_save, sender=Checkin)
+@receiver(pre_save, sender=Checkout)
+def on_log_pre_save(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._rollup_span = rollup.session_span(instance.session_id)
+
+
+@receiver(pre_delete, sender=Checkin)
+@receiver(pre_delete, sender=Checkout)
+def on_log_pre_delete(sender, instance, **kwargs):
+    instance._rollup_span = rollup.session_span(instance.session_id)
+
+
+@receiver(post_save, sender=Checkout)
+def on_checkout_rollup(sender, instance, created, **kwargs):
+    span = rollup.session_span(instance.session_id)
+    if created:
+        # the common case: a session was just closed
+        if span is not None:
+            rollup.add_sessions([span])
+    else:
+        rollup.refresh_span_change(getattr(instance, '_rollup_span', None), span)
+
+
+@receiver(post_save, sender=Checkin)
+def on_checkin_rollup(sender, instance, created, **kwargs):
+    # checking in on an open session doesn't touch the rollup
+    if created and instance.session.is_open:
+        return
+    on_log_rollup(sender, instance)
+
+
+@receiver(post_delete, sender=Checkin)
+@receiver(post_delete, sender=Checkout)
+def on_log_rollup(sender, instance, **kwargs):
+    rollup.refresh_span_change(
+        getattr(instance, '_rollup_span', None),
+        rollup.session_span(instance.session_id),
+    )
+
+
+# Statistics cache and change feed, see statistics_cache.py and changes.py
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+def on_session_change(sender, instance, **kwargs):
+    statistics_cache.invalidate([instance.user_id])
+    changes.record([(instance.pk, instance.user_id)])
+
+
+@receiver(post_save, sender=Checkin)
+@receiver(post_delete, sender=Checkin)
+@receiver(post_save, sender=Checkout)
+@receiver(post_delete, sender=Checkout)
+def on_log_change(sender, instance, **kwargs):
+    if sender.session.is_cached(instance):
+        user_id = instance.session.user_id
+    else:
+        user_id = (
+            Session.objects.filter(pk=instance.session_id)
+            .values_list('user_id', flat=True)
+            .first()
+        )
+    if user_id is not None:
+        statistics_cache.invalidate([user_id])
+        changes.record([(instance.session_id, user_id)])
+
+
+@receiver(post_save, sender=User)
+def on_user_created(sender, instance, created, **kwargs):
+    # IDs of deleted users can be reused
+    if created:
+        statistics_cache.invalidate([instance.pk])
+
+
+# Presence registry, see presence.py. Check-ins and check-outs are applied
+# to it directly (see also on_checkout_save); anything else reloads it.
+
+
+@receiver(post_save, sender=Checkin)
+def on_checkin_presence(sender, instance, created, **kwargs):
+    if created and instance.session.is_open:
+        record_presence({instance.session.user_id: instance.time})
+    else:
+        invalidate_presence()
+
+
+@receiver(post_save, sender=Session)
+def on_session_presence(sender, instance, created, **kwargs):
+    # a new session only opens with its check-in
+    if not created:
+        invalidate_presence()
+
+
+@receiver(post_delete, sender=Session)
+@receiver(post_delete, sender=Checkin)
+@receiver(post_save, sender=Checkout)
+@receiver(post_delete, sender=Checkout)
+# the occupancy board counts people per subteam
+@receiver(post_save, sender=Assignment)
+@receiver(post_delete, sender=Assignment)
+@receiver(m2m_changed, sender=Assignment.subteams.through)
+@receiver(post_save, sender=Subteam)
+@receiver(post_delete, sender=Subteam)
+def on_presence_change(sender, created=False, **kwargs):
+    # check-outs are recorded by on_checkout_save
+    if not (sender is Checkout and created):
+        invalidate_presence()
+
+
+# Push notifications, see events.py
+
+
+@receiver(post_delete, sender=PendingTag)
+def on_pending_tag_delete(sender, instance, **kwargs):
+    # claimed by a scan, or cancelled; either way the profile page is done
+    # waiting for it
+    topic = events.pending_tag_topic(instance.pk)
+    transaction.on_commit(lambda: events.broker.publish(topic))
@@ -0,0 +1,205 @@
+"""WebSocket channel for scanners.
+
+Instead of a new HTTP request per scan and per healthcheck, a scanner can
+keep one WebSocket open at /api/scanner_socket. Messages are JSON objects,
+and every message gets exactly one reply, in order:
+
+- `{"type": "hello", "device_id": "..."}` must come first and authenticates
+  the scanner; the reply is `{"status": "ok"}`. An unknown scanner gets an
+  error reply, and the socket is closed with code 4003.
+- `{"type": "scan", "tag_id": "...", "time": "..."}` registers a scan, like
+  the register_scan endpoint (`time` is optional). The reply has the shape
+  of `RegisterScanResponseSerializer`, or of `APIResponseSerializer` if the
+  scan failed.
+- `{"type": "healthcheck"}` is answered with `{"status": "ok"}`.
+
+While the socket is open, the scanner counts as alive: daphne pings the
+client and drops the connection if it stops answering, so an open socket
+is refreshed in `midas.liveness` every LIVENESS_INTERVAL even if the
+scanner sends nothing.
+"""
+
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from .api import (
+    SCAN_OUT_OF_ORDER,
+    APIResponse,
+    APIResponseSerializer,
+    RegisterScanRequestSerializer,
+    RegisterScanResponse,
+    RegisterScanResponseSerializer,
+    serializer_error_message,
+)
+from .directory import directory
+from .liveness import liveness
+from .scans import (
+    ScannerNotAuthorized,
+    ScanOutOfOrder,
+    TagNotRegistered,
+    aprocess_scan,
+)
+
+LIVENESS_INTERVAL = 30  # seconds
+
+# close code for an unknown scanner, like HTTP 403
+CLOSE_NOT_AUTHORIZED = 4003
+
+
+class Disconnected(Exception):
+    pass
+
+
+class ScannerSocket:
+    def __init__(self, receive, send):
+        self._receive = receive
+        self._send = send
+        self.scanner_id = None
+
+    async def receive(self, timeout=None):
+        """The next message, or None if there was none in time."""
+        while True:
+            try:
+                async with asyncio.timeout(timeout):
+                    event = await self._receive()
+            except TimeoutError:
+                return None
+            if event['type'] == 'websocket.disconnect':
+                raise Disconnected
+            if event['type'] == 'websocket.receive':
+                return event.get('text') or event.get('bytes')
+
+    async def send(self, data):
+        await self._send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    async def send_status(self, response):
+        await self.send(APIResponseSerializer(response).data)
+
+    async def close(self, code=1000):
+        await self._send({'type': 'websocket.close', 'code': code})
+
+    async def run(self):
+        event = await self._receive()
+        if event['type'] != 'websocket.connect':
+            return
+        await self._send({'type': 'websocket.accept'})
+
+        try:
+            if not await self.hello():
+                return
+            while True:
+                message = await self.receive(timeout=LIVENESS_INTERVAL)
+                await liveness.aseen(self.scanner_id)
+                if message is not None:
+                    await self.handle(message)
+        except Disconnected:
+            pass
+        finally:
+            if self.scanner_id is not None:
+                await liveness.aseen(self.scanner_id)
+
+    async def hello(self):
+        message = _parse(await self.receive(timeout=LIVENESS_INTERVAL))
+        if message is None or message.get('type') != 'hello':
+            await self.send_status(APIResponse.error('Expected a hello message'))
+            await self.close(CLOSE_NOT_AUTHORIZED)
+            return False
+
+        scanner_id = str(message.get('device_id', ''))
+        if await directory.ascanner(scanner_id) is None:
+            await self.send_status(APIResponse.error('Scanner not authorized'))
+            await self.close(CLOSE_NOT_AUTHORIZED)
+            return False
+
+        self.scanner_id = scanner_id
+        await liveness.aseen(scanner_id)
+        await self.send_status(APIResponse.success())
+        return True
+
+    async def handle(self, message):
+        message = _parse(message)
+        if message is None:
+            await self.send_status(APIResponse.error('Invalid request: malformed JSON'))
+            return
+
+        # like a request: don't hold on to broken or expired connections
+        await sync_to_async(close_old_connections)()
+        try:
+            match message.get('type'):
+                case 'scan':
+                    await self.scan(message)
+                case 'healthcheck':
+                    await self.send_status(APIResponse.success())
+                case other:
+                    await self.send_status(
+                        APIResponse.error(f'Unknown message type: {other}')
+                    )
+        finally:
+            await sync_to_async(close_old_connections)()
+
+    async def scan(self, message):
+        serializer = RegisterScanRequestSerializer(
+            data={**message, 'device_id': self.scanner_id}
+        )
+        if not serializer.is_valid():
+            await self.send_status(
+                APIResponse.error(serializer_error_message(serializer))
+            )
+            return
+
+        args = serializer.save()
+
+        try:
+            scan = await aprocess_scan(args.device_id, args.tag_id, args.time)
+        except ScannerNotAuthorized:
+            # deleted while connected
+            await self.send_status(APIResponse.error('Scanner not authorized'))
+            await self.close(CLOSE_NOT_AUTHORIZED)
+            raise Disconnected
+        except TagNotRegistered:
+            await self.send_status(APIResponse.error('Card not registered'))
+            return
+        except ScanOutOfOrder:
+            await self.send_status(APIResponse.error(SCAN_OUT_OF_ORDER))
+            return
+
+        res = await RegisterScanResponse.amake(scan)
+        await self.send(RegisterScanResponseSerializer(res).data)
+
+
+def _parse(message):
+    try:
+        message = json.loads(message)
+    except (TypeError, ValueError):
+        return None
+    return message if isinstance(message, dict) else None
+
+
+async def scanner_socket(scope, receive, send):
+    await ScannerSocket(receive, send).run()
+
+
+WEBSOCKETS = {
+    '/api/scanner_socket': scanner_socket,
+}
+
+
+def route(django_application):
+    """Serve the WebSockets above, and everything else with Django."""
+
+    async def application(scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await django_application(scope, receive, send)
+
+        handler = WEBSOCKETS.get(scope['path'])
+        if handler is None:
+            # rejects the handshake
+            await receive()
+            await send({'type': 'websocket.close'})
+            return
+        await handler(scope, receive, send)
+
+    return application
@@ -1,6 +1,9 @@
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
 from datetime import datetime, time, timedelta
 
 import pytz
+from asgiref.sync import sync_to_async
 from django.db.models import (
     Case,
     DurationField,
@@ -14,22 +17,25 @@ from django.db.models.functions import Coalesce, ExtractWeek, ExtractYear
 from django.utils import timezone
 from pytz import AmbiguousTimeError, NonExistentTimeError
 
-from .models import Assignment, Session
+from . import statistics_cache
+from .datetime_util import split_by_day
+from .models import Assignment, DailyMinutes, Session
 
 # Explicitly define Amsterdam Timezone
 AMSTERDAM_TZ = pytz.timezone('Europe/Amsterdam')
 
 
-def get_sessions_time(user, start_of_day, end_of_day):
+def _clamped_sessions(sessions, start_of_day, end_of_day):
     # Ensure inputs are aware to avoid DB warnings/errors
     if timezone.is_naive(start_of_day) or timezone.is_naive(end_of_day):
         raise ValueError('get_sessions_time expects aware datetimes')
 
-    # Get all sessions that overlap with the specified range
-    sessions = Session.objects.filter(
+    # Get all sessions that overlap with the specified range. A session
+    # without checkout only counts if it is open: an older one left without
+    # checkout (see Session.update_is_open) has no end.
+    sessions = sessions.filter(
         Q(checkin__time__lte=end_of_day),
-        Q(checkout__time__gte=start_of_day) | Q(checkout__time__isnull=True),
-        user=user,
+        Q(checkout__time__gte=start_of_day) | Q(is_open=True),
     )
 
     # Replace null with current time for ongoing sessions
@@ -50,20 +56,168 @@ def get_sessions_time(user, start_of_day, end_of_day):
         ),
     )
 
-    # Compute duration and sum
-    sessions = sessions.annotate(
+    # Compute duration
+    return sessions.annotate(
         duration=ExpressionWrapper(
             F('clamped_checkout') - F('clamped_checkin'),
             output_field=DurationField(),
         )
     )
 
-    total_duration = sessions.aggregate(total=Sum('duration'))['total']
 
-    if total_duration is None:
+def _to_minutes(duration):
+    if duration is None:
         return 0
+    return int(duration.total_seconds() // 60)
+
+
+def get_sessions_time(user, start_of_day, end_of_day):
+    sessions = _clamped_sessions(
+        Session.objects.filter(user=user), start_of_day, end_of_day
+    )
+    total_duration = sessions.aggregate(total=Sum('duration'))['total']
+    return _to_minutes(total_duration)
+
+
+def get_sessions_time_per_user(users, start_of_day, end_of_day):
+    """get_sessions_time for many users at once.
+
+    Returns a dict from user ID to minutes, with every given user in it.
+    Takes one grouped query, instead of one per user.
+    """
+    user_ids = [getattr(user, 'pk', user) for user in users]
+    sessions = _clamped_sessions(
+        Session.objects.filter(user__in=user_ids), start_of_day, end_of_day
+    )
+    totals = dict(
+        sessions.values('user')
+        .annotate(total=Sum('duration'))
+        .values_list('user', 'total')
+    )
+    return {user_id: _to_minutes(totals.get(user_id)) for user_id in user_ids}
+
+
+# cache names, see statistics_cache
+OPEN_SESSION = 'open_since'
+ACTIVE_WEEKS = 'active_weeks'
+
+
+def _range_name(first_day, last_day):
+    return f'minutes:{first_day}:{last_day}'
+
+
+def _days_query(user, day_ranges):
+    totals = {}
+    for i, (first_day, last_day) in enumerate(day_ranges):
+        days = Q(date__lte=last_day)
+        if first_day is not None:
+            days &= Q(date__gte=first_day)
+        totals[f'total_{i}'] = Sum('duration', filter=days)
+    return DailyMinutes.objects.filter(user=user), totals
+
 
-    return int(total_duration.total_seconds() // 60)
+def _open_session_query(user):
+    return Session.objects.filter(user=user, is_open=True).values_list(
+        'checkin__time', flat=True
+    )
+
+
+def _missing_ranges(day_ranges, cached):
+    return [r for r in dict.fromkeys(day_ranges) if _range_name(*r) not in cached]
+
+
+def _closed_totals(day_ranges, totals):
+    return {
+        _range_name(*r): totals[f'total_{i}'] or timedelta(0)
+        for i, r in enumerate(day_ranges)
+    }
+
+
+def _days_to_minutes(day_ranges, values):
+    # the open session isn't in the rollup yet, count it up to now
+    (open_since,) = values[OPEN_SESSION]
+    open_days = {}
+    if open_since is not None:
+        open_days = split_by_day(open_since, timezone.now(), AMSTERDAM_TZ)
+
+    minutes = []
+    for first_day, last_day in day_ranges:
+        total = values[_range_name(first_day, last_day)]
+        for day, duration in open_days.items():
+            if (first_day is None or first_day <= day) and day <= last_day:
+                total += duration
+        minutes.append(int(total.total_seconds() // 60))
+    return minutes
+
+
+def get_minutes_for_days(user, day_ranges):
+    """Minutes worked in each (first day, last day) range of Amsterdam dates.
+
+    Both days are inclusive; a first day of None means "since the beginning".
+    Closed sessions are summed from the DailyMinutes rollup and the open
+    session is added on top, so this takes two indexed queries no matter how
+    long the ranges are. Both are cached until the user's sessions change,
+    after which repeated calls take no queries at all.
+    """
+    user_id = getattr(user, 'pk', user)
+    names = [OPEN_SESSION, *(_range_name(*r) for r in day_ranges)]
+    generation, cached = statistics_cache.lookup(user_id, names)
+
+    computed = {}
+    missing = _missing_ranges(day_ranges, cached)
+    if missing:
+        days, totals = _days_query(user_id, missing)
+        computed |= _closed_totals(missing, days.aggregate(**totals))
+    if OPEN_SESSION not in cached:
+        computed[OPEN_SESSION] = (_open_session_query(user_id).first(),)
+    statistics_cache.store(user_id, generation, computed)
+
+    return _days_to_minutes(day_ranges, cached | computed)
+
+
+async def aget_minutes_for_days(user, day_ranges):
+    """Async version of get_minutes_for_days.
+
+    Every async cache and ORM call is a separate trip to the worker thread,
+    which costs more than the queries themselves, so the whole lookup is
+    handed over in one go instead.
+    """
+    return await sync_to_async(get_minutes_for_days)(user, day_ranges)
+
+
+def get_minutes_per_day(user, first_day, last_day):
+    """Minutes worked on every Amsterdam date from first_day to last_day.
+
+    Returns a dict from date to minutes, including days without any. The
+    sessions overlapping the range are fetched in a single query and split
+    at midnight in Python, so long ranges don't cost a query per day.
+    """
+    start = AMSTERDAM_TZ.localize(datetime.combine(first_day, time.min))
+    end = AMSTERDAM_TZ.localize(
+        datetime.combine(last_day + timedelta(days=1), time.min)
+    )
+    now = timezone.now()
+
+    sessions = Session.objects.filter(
+        Q(checkin__time__lt=end),
+        # see _clamped_sessions() about closed sessions without a checkout
+        Q(checkout__time__gt=start) | Q(is_open=True),
+        user=user,
+    ).values_list('checkin__time', 'checkout__time')
+
+    totals = {}
+    day = first_day
+    while day <= last_day:
+        totals[day] = timedelta(0)
+        day += timedelta(days=1)
+
+    for checkin, checkout in sessions:
+        days = split_by_day(checkin, checkout or now, AMSTERDAM_TZ)
+        for day, duration in days.items():
+            if day in totals:
+                totals[day] += duration
+
+    return {day: int(total.total_seconds() // 60) for day, total in totals.items()}
 
 
 def get_quota_durations_time_period(user, start_day, end_day):
@@ -118,15 +272,7 @@ def get_minutes_today(user, day):
     if isinstance(day, datetime):
         day = day.date()
 
-    # Create boundary in Amsterdam time
-    start_of_day_ams = AMSTERDAM_TZ.localize(datetime.combine(day, time.min))
-
-    # End of day is start of next day (easier for calculations than max time)
-    end_of_day_ams = AMSTERDAM_TZ.localize(
-        datetime.combine(day + timedelta(days=1), time.min)
-    ) - timedelta(microseconds=1)
-
-    return get_sessions_time(user, start_of_day_ams, end_of_day_ams)
+    return get_minutes_for_days(user, [(day, day)])[0]
 
 
 def get_minutes_this_week(user, day):
@@ -146,14 +292,35 @@ def get_minutes_this_week(user, day):
 
     # 2. Find start of week (Monday) based on Amsterdam Date
     start_of_week_date = current_date_ams - timedelta(days=current_date_ams.weekday())
+    end_of_week_date = start_of_week_date + timedelta(days=6)
+
+    return get_minutes_for_days(user, [(start_of_week_date, end_of_week_date)])[0]
+
+
+def _day_and_week_ranges(day):
+    if isinstance(day, datetime):
+        if timezone.is_naive(day):
+            day = AMSTERDAM_TZ.localize(day)
+        else:
+            day = day.astimezone(AMSTERDAM_TZ)
+        day = day.date()
+
+    start_of_week = day - timedelta(days=day.weekday())
+    return [(day, day), (start_of_week, start_of_week + timedelta(days=6))]
 
-    # 3. Create Aware Boundaries
-    start_of_week_ams = AMSTERDAM_TZ.localize(
-        datetime.combine(start_of_week_date, time.min)
-    )
-    end_of_week_ams = start_of_week_ams + timedelta(days=7) - timedelta(microseconds=1)
 
-    return get_sessions_time(user, start_of_week_ams, end_of_week_ams)
+def get_minutes_today_and_this_week(user, day):
+    """Return (minutes today, minutes this week) in one go."""
+    minutes_day, minutes_week = get_minutes_for_days(user, _day_and_week_ranges(day))
+    return minutes_day, minutes_week
+
+
+async def aget_minutes_today_and_this_week(user, day):
+    """Async version of get_minutes_today_and_this_week."""
+    minutes_day, minutes_week = await aget_minutes_for_days(
+        user, _day_and_week_ranges(day)
+    )
+    return minutes_day, minutes_week
 
 
 def get_minutes_this_month(user, day):
@@ -174,34 +341,12 @@ def get_minutes_this_month(user, day):
     else:
         next_month_date = day.replace(month=day.month + 1, day=1)
 
-    start_of_month_ams = AMSTERDAM_TZ.localize(
-        datetime.combine(start_of_month_date, time.min)
-    )
-    end_of_month_ams = AMSTERDAM_TZ.localize(
-        datetime.combine(next_month_date, time.min)
-    ) - timedelta(microseconds=1)
+    end_of_month_date = next_month_date - timedelta(days=1)
 
-    return get_sessions_time(user, start_of_month_ams, end_of_month_ams)
+    return get_minutes_for_days(user, [(start_of_month_date, end_of_month_date)])[0]
 
 
 def get_total_minutes(user, day):
-    # Get the date of the earliest checkin
-    earliest_session = (
-        Session.objects.filter(user=user, checkin__isnull=False)
-        .order_by('checkin__time')
-        .first()
-    )
-
-    if earliest_session is None or not hasattr(earliest_session, 'checkin'):
-        return 0  # No checkin yet
-
-    # Earliest session is already Aware (UTC from DB).
-    # We should use it directly or floor it to the day start in Amsterdam.
-    earliest_checkin_ams = earliest_session.checkin.time.astimezone(AMSTERDAM_TZ)
-    start_of_period = earliest_checkin_ams.replace(
-        hour=0, minute=0, second=0, microsecond=0
-    )
-
     # Handle 'day' argument (End of period)
     if isinstance(day, datetime):
         if timezone.is_naive(day):
@@ -212,11 +357,7 @@ def get_total_minutes(user, day):
     else:
         end_date = day
 
-    end_of_period = AMSTERDAM_TZ.localize(
-        datetime.combine(end_date + timedelta(days=1), time.min)
-    ) - timedelta(microseconds=1)
-
-    return get_sessions_time(user, start_of_period, end_of_period)
+    return get_minutes_for_days(user, [(None, end_date)])[0]
 
 
 def get_average_week(user, day):
@@ -226,21 +367,155 @@ def get_average_week(user, day):
         return 0
 
     # Count distinct weeks with at least one check-in
-    active_weeks_count = (
-        Session.objects.filter(user=user, checkin__isnull=False)
+    user_id = getattr(user, 'pk', user)
+    generation, cached = statistics_cache.lookup(user_id, [ACTIVE_WEEKS])
+    active_weeks_count = cached.get(ACTIVE_WEEKS)
+    if active_weeks_count is None:
+        active_weeks_count = (
+            Session.objects.filter(user=user, checkin__isnull=False)
+            .annotate(
+                year=ExtractYear('checkin__time', tzinfo=AMSTERDAM_TZ),
+                week=ExtractWeek('checkin__time', tzinfo=AMSTERDAM_TZ),
+            )
+            .values('year', 'week')
+            .distinct()
+            .count()
+        )
+        statistics_cache.store(user_id, generation, {ACTIVE_WEEKS: active_weeks_count})
+
+    if active_weeks_count == 0:
+        return total_minutes
+
+    return int(total_minutes // active_weeks_count)
+
+
+def _statistics_ranges(day):
+    start_of_week = day - timedelta(days=day.weekday())
+    start_of_month = day.replace(day=1)
+    if day.month == 12:
+        next_month = day.replace(year=day.year + 1, month=1, day=1)
+    else:
+        next_month = day.replace(month=day.month + 1, day=1)
+    return {
+        'minutes_today': (day, day),
+        'minutes_this_week': (start_of_week, start_of_week + timedelta(days=6)),
+        'minutes_this_month': (start_of_month, next_month - timedelta(days=1)),
+        'total_minutes': (None, day),
+    }
+
+
+class _DailyTotals:
+    """Cumulative time per day of one user, for summing any range of days."""
+
+    def __init__(self, durations):
+        self.days = sorted(durations)
+        self.cumulative = [timedelta(0)]
+        for day in self.days:
+            self.cumulative.append(self.cumulative[-1] + durations[day])
+
+    def minutes(self, first_day, last_day):
+        lo = 0 if first_day is None else bisect_left(self.days, first_day)
+        hi = bisect_right(self.days, last_day)
+        if hi <= lo:
+            return 0
+        total = self.cumulative[hi] - self.cumulative[lo]
+        return int(total.total_seconds() // 60)
+
+
+def iter_all_statistics(users, dates):
+    """Yield the statistics of every user on every date, date by date.
+
+    Computes the same numbers as the get_minutes_*, get_total_minutes and
+    get_average_week functions, plus the assignment of that day. Everything
+    is loaded up front in a fixed number of queries, independent of the
+    number of users and dates, and rows are produced one at a time.
+    """
+    users = list(users)
+    dates = list(dates)
+    if not users or not dates:
+        return
+
+    user_ids = [user.pk for user in users]
+    ranges = {day: _statistics_ranges(day) for day in dates}
+    last_day = max(last for r in ranges.values() for _, last in r.values())
+
+    # minutes per day, from the rollup plus the open sessions
+    durations = defaultdict(lambda: defaultdict(timedelta))
+    rollup = DailyMinutes.objects.filter(
+        user_id__in=user_ids, date__lte=last_day
+    ).values_list('user_id', 'date', 'duration')
+    for user_id, day, duration in rollup:
+        durations[user_id][day] += duration
+
+    now = timezone.now()
+    open_sessions = Session.objects.filter(
+        user_id__in=user_ids, is_open=True, checkin__isnull=False
+    ).values_list('user_id', 'checkin__time')
+    for user_id, checkin in open_sessions:
+        for day, duration in split_by_day(checkin, now, AMSTERDAM_TZ).items():
+            durations[user_id][day] += duration
+
+    totals = {user_id: _DailyTotals(durations[user_id]) for user_id in user_ids}
+
+    # distinct weeks with a check-in, as in get_average_week
+    active_weeks = Counter(
+        user_id
+        for user_id, _, _ in Session.objects.filter(
+            user_id__in=user_ids, checkin__isnull=False
+        )
         .annotate(
             year=ExtractYear('checkin__time', tzinfo=AMSTERDAM_TZ),
             week=ExtractWeek('checkin__time', tzinfo=AMSTERDAM_TZ),
         )
-        .values('year', 'week')
+        .values_list('user', 'year', 'week')
         .distinct()
-        .count()
     )
 
-    if active_weeks_count == 0:
-        return total_minutes
-
-    return int(total_minutes // active_weeks_count)
+    # assignments by user, oldest first
+    cutoffs = {
+        day: AMSTERDAM_TZ.localize(datetime.combine(day, time.min)) for day in dates
+    }
+    assignments = defaultdict(list)
+    for assignment in (
+        Assignment.objects.filter(
+            user_id__in=user_ids, starting_from__lte=max(cutoffs.values())
+        )
+        .select_related('quota')
+        .prefetch_related('subteams')
+        .order_by('starting_from')
+    ):
+        assignments[assignment.user_id].append(assignment)
+    starts = {
+        user_id: [a.starting_from for a in user_assignments]
+        for user_id, user_assignments in assignments.items()
+    }
+
+    for day in dates:
+        for user in users:
+            i = bisect_right(starts.get(user.pk, []), cutoffs[day])
+            assignment = assignments[user.pk][i - 1] if i else None
+
+            minutes = {
+                key: totals[user.pk].minutes(first_day, last_day)
+                for key, (first_day, last_day) in ranges[day].items()
+            }
+            total_minutes = minutes['total_minutes']
+            weeks = active_weeks[user.pk]
+            if total_minutes == 0:
+                average_week = 0
+            elif weeks == 0:
+                average_week = total_minutes
+            else:
+                average_week = int(total_minutes // weeks)
+
+            yield {
+                'name': user.first_name + ' ' + user.last_name,
+                'subteam': assignment.subteam_names() if assignment else 'No subteam',
+                'quota': assignment.quota.hours if assignment else 'No quota',
+                'date': day,
+                **minutes,
+                'average_week': average_week,
+            }
 
 
 # Helper function kept for compatibility, but usage replaced with explicit AMSTERDAM_TZ
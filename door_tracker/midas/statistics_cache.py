@@ -0,0 +1,70 @@
+"""Cache of per-user statistics, keyed on a generation counter.
+
+Cached values are stored under (user, generation, metric and period). The
+generation of a user is bumped whenever their sessions, check-ins or
+check-outs change (see `midas.signals`), which makes every older entry
+unreachable at once. Entries therefore never need to expire by themselves;
+the cache backend evicts stale generations as it fills up.
+
+Only history goes in here. Time in the open session keeps growing, so
+callers cache when it started and add the time up to now themselves.
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _generation_key(user_id):
+    return f'midas_statistics_generation:{user_id}'
+
+
+def _new_generation():
+    # not 0: if the counter gets evicted, it must not restart at a value
+    # that old entries were stored under
+    return time.time_ns()
+
+
+def _keys(user_id, generation, names):
+    return {name: f'midas_statistics:{user_id}:{generation}:{name}' for name in names}
+
+
+def _unpack(keys, values):
+    return {name: values[key] for name, key in keys.items() if key in values}
+
+
+def _bump(user_ids):
+    for user_id in user_ids:
+        try:
+            cache.incr(_generation_key(user_id))
+        except ValueError:
+            cache.set(_generation_key(user_id), _new_generation(), timeout=None)
+
+
+def invalidate(user_ids):
+    """Drop all cached statistics of these users, in every process."""
+    # Once right away, so this connection sees its own writes, and once more
+    # after commit, so that readers that ran in between and cached the old
+    # numbers under the new generation are ignored as well.
+    user_ids = set(user_ids)
+    _bump(user_ids)
+    transaction.on_commit(lambda: _bump(user_ids))
+
+
+def lookup(user_id, names):
+    """Return the current generation and the cached values among `names`."""
+    generation = cache.get_or_set(
+        _generation_key(user_id), _new_generation, timeout=None
+    )
+    keys = _keys(user_id, generation, names)
+    return generation, _unpack(keys, cache.get_many(keys.values()))
+
+
+def store(user_id, generation, values):
+    """Cache {name: value} for the generation returned by lookup()."""
+    if values:
+        keys = _keys(user_id, generation, values)
+        cache.set_many(
+            {keys[name]: value for name, value in values.items()}, timeout=None
+        )
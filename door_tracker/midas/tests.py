@@ -1,12 +1,78 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from unittest import mock
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from asgiref.sync import async_to_sync, sync_to_async
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from door_tracker.backup_scheduler import LeaderScheduler, backup_website_job
+from door_tracker.backup_storage import (
+    DriveStorage,
+    LocalStorage,
+    TransientUploadError,
+)
+from door_tracker.backup_upload import compress, upload
+from door_tracker.file_cache import FileCache
+from door_tracker.sqlite_backup import BackupProgress, snapshot_sqlite
+
+from door_tracker import incremental_backup
 
-from .api import RegisterScanResponseSerializer
-from .models import ClaimedTag, PendingTag, Scanner
+from . import columnar, events, leases, liveness, sockets
+from .api import RegisterScanResponseSerializer, sessions_to_csv
+from .changes import changes_since, prune
+from .directory import directory
+from .models import (
+    Assignment,
+    Checkin,
+    Checkout,
+    ClaimedTag,
+    DailyMinutes,
+    LogType,
+    PendingTag,
+    Quota,
+    Scanner,
+    Session,
+    SessionChange,
+    Subteam,
+)
+from .presence import GENERATION_KEY, PresentUser, presence
+from .rollup import rebuild
+from .scans import RegisterScanState, aprocess_scan, process_scan, process_scans
+from .statistics import (
+    AMSTERDAM_TZ,
+    get_average_week,
+    get_minutes_for_days,
+    get_minutes_per_day,
+    get_minutes_this_month,
+    get_minutes_this_week,
+    get_minutes_today,
+    get_minutes_today_and_this_week,
+    get_sessions_time,
+    get_sessions_time_per_user,
+    get_total_minutes,
+    iter_all_statistics,
+)
 
 
 class RegisterScanTests(TestCase):
+    url_name = 'midas:register_scan'
+
     def test_register_thrice(self):
         user = User.objects.create(username='test', first_name='Test', last_name='User')
         scanner = Scanner.objects.create(id='scanner', name='Test Scanner')
@@ -17,7 +83,7 @@ class RegisterScanTests(TestCase):
 
         def register_scan():
             response = self.client.post(
-                reverse('midas:register_scan'),
+                reverse(self.url_name),
                 {'device_id': scanner.id, 'tag_id': tag_code},
             )
             json_response = response.json()
@@ -50,3 +116,1603 @@ class RegisterScanTests(TestCase):
             res = register_scan()
             self.assertEqual(res.state, 'checkout')
             self.assertEqual(res.owner_name, user.get_full_name())
+
+    def test_scan_times(self):
+        user = User.objects.create(username='test', first_name='Test', last_name='User')
+        Scanner.objects.create(id='scanner', name='Test Scanner')
+        ClaimedTag.objects.create(code='DEADBEEF', name='test', owner=user)
+        directory.warm()
+        now = timezone.now()
+
+        def scan(time):
+            return self.client.post(
+                reverse(self.url_name),
+                {
+                    'device_id': 'scanner',
+                    'tag_id': 'DEADBEEF',
+                    'time': time.isoformat(),
+                },
+            )
+
+        # a scanner clock running a little ahead is fine
+        res = scan(now + timedelta(seconds=2))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['state'], 'checkin')
+        self.assertEqual(scan(now + timedelta(hours=1)).status_code, 400)
+
+        # can't check out before checking in
+        res = scan(now - timedelta(hours=3))
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(res.json()['message'], 'Scan is older than the open session')
+        self.assertTrue(Session.objects.get(user=user).is_open)
+        self.assertFalse(Checkout.objects.exists())
+
+
+class SyncRegisterScanTests(RegisterScanTests):
+    url_name = 'midas:register_scan_sync'
+
+
+class RegisterScanQueryBudgetTests(TestCase):
+    url_name = 'midas:register_scan'
+    budget = {
+        # select + delete pending tag, savepoint, insert tag, release, 2x hours
+        'register': 7,
+        # savepoint, open session, insert session + change, insert checkin +
+        # change, release, 2x hours
+        'checkin': 9,
+        # savepoint, open session, insert checkout, close session, session
+        # span, select + insert daily minutes, insert change, release, 2x hours
+        'checkout': 11,
+        'unknown_tag': 0,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+        self.scanner = Scanner.objects.create(id='scanner', name='Test Scanner')
+
+    def scan(self, tag_code='DEADBEEF', device_id='scanner'):
+        return self.client.post(
+            reverse(self.url_name),
+            {'device_id': device_id, 'tag_id': tag_code},
+        )
+
+    def test_register(self):
+        PendingTag.objects.create(name='test', owner=self.user, scanner=self.scanner)
+        directory.warm()
+
+        with self.assertNumQueries(self.budget['register']):
+            res = self.scan()
+        self.assertEqual(res.json()['state'], 'register')
+        self.assertEqual(res.json()['owner_name'], 'Test User')
+
+    def test_checkin_checkout(self):
+        ClaimedTag.objects.create(code='DEADBEEF', name='test', owner=self.user)
+        directory.warm()
+
+        with self.assertNumQueries(self.budget['checkin']):
+            res = self.scan()
+        self.assertEqual(res.json()['state'], 'checkin')
+
+        with self.assertNumQueries(self.budget['checkout']):
+            res = self.scan()
+        self.assertEqual(res.json()['state'], 'checkout')
+
+    def test_errors(self):
+        directory.warm()
+
+        # unknown scanners are turned away without touching the database
+        with self.assertNumQueries(0):
+            res = self.scan(device_id='nope')
+        self.assertEqual(res.status_code, 403)
+
+        with self.assertNumQueries(self.budget['unknown_tag']):
+            res = self.scan()
+        self.assertEqual(res.status_code, 404)
+
+
+class SyncRegisterScanQueryBudgetTests(RegisterScanQueryBudgetTests):
+    url_name = 'midas:register_scan_sync'
+    budget = {
+        # savepoint, select + delete pending tag, insert tag, release, 2x hours
+        'register': 7,
+        # savepoint, open session, insert session + change, insert checkin +
+        # change, release, 2x hours
+        'checkin': 9,
+        # savepoint, open session, insert checkout, close session, session
+        # span, select + insert daily minutes, insert change, release, 2x hours
+        'checkout': 11,
+        # savepoint, rollback, release
+        'unknown_tag': 3,
+    }
+
+
+class ConcurrentScanTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+        Scanner.objects.create(id='scanner', name='Test Scanner')
+        ClaimedTag.objects.create(code='DEADBEEF', name='test', owner=self.user)
+        directory.warm()
+
+    async def test_simultaneous_scans(self):
+        # neither scan may decide before the other one has written
+        scans = await asyncio.gather(
+            aprocess_scan('scanner', 'DEADBEEF'),
+            aprocess_scan('scanner', 'DEADBEEF'),
+        )
+        self.assertEqual(
+            sorted(scan.state for scan in scans),
+            [RegisterScanState.CHECKIN, RegisterScanState.CHECKOUT],
+        )
+        self.assertFalse(await Session.objects.filter(is_open=True).aexists())
+
+
+class OpenSessionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+        self.client.force_login(self.user)
+
+    def test_remote_checkin_checkout(self):
+        self.client.post(reverse('midas:checkin'), {'next': '/'})
+        session = Session.objects.get(user=self.user)
+        self.assertTrue(session.is_open)
+
+        # a second check-in is refused
+        self.client.post(reverse('midas:checkin'), {'next': '/'})
+        self.assertEqual(Session.objects.filter(user=self.user).count(), 1)
+
+        self.client.post(
+            reverse('midas:checkout'),
+            {'time': timezone.now().isoformat(), 'next': '/'},
+        )
+        session.refresh_from_db()
+        self.assertFalse(session.is_open)
+        self.assertTrue(hasattr(session, 'checkout'))
+
+        # deleting the checkout (e.g. in the admin) reopens the session
+        session.checkout.delete()
+        session.refresh_from_db()
+        self.assertTrue(session.is_open)
+
+    def test_one_open_session_per_user(self):
+        Session.objects.create(user=self.user, is_open=True)
+        with self.assertRaises(IntegrityError):
+            Session.objects.create(user=self.user, is_open=True)
+
+
+@override_settings(
+    STORAGES={
+        'staticfiles': {
+            'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        }
+    }
+)
+class SessionAdminTests(TestCase):
+    """Admin edits of old sessions while the user is checked in."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        now = timezone.now()
+        self.old = add_session(
+            self.user, now - timedelta(days=1, hours=8), now - timedelta(days=1)
+        )
+        self.current = add_session(self.user, now - timedelta(hours=1))
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def assertCheckedIn(self):
+        self.assertEqual(
+            list(Session.objects.filter(is_open=True).values_list('pk', flat=True)),
+            [self.current.pk],
+        )
+
+    def test_delete_old_checkout(self):
+        self.old.checkout.delete()
+        self.old.refresh_from_db()
+        self.assertFalse(self.old.is_open)
+        self.assertCheckedIn()
+
+        # with nothing else open, the latest session opens again
+        self.current.delete()
+        self.old.update_is_open()
+        self.old.refresh_from_db()
+        self.assertTrue(self.old.is_open)
+
+    def test_delete_old_session(self):
+        response = self.client.post(
+            reverse('admin:midas_session_delete', args=[self.old.pk]), {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Session.objects.filter(pk=self.old.pk).exists())
+        self.assertCheckedIn()
+
+    def add(self, checkin, checkout=None):
+        data = {
+            'user': self.user.pk,
+            'checkin-TOTAL_FORMS': 1,
+            'checkin-INITIAL_FORMS': 0,
+            'checkin-0-type': LogType.REMOTE,
+            'checkin-0-time_0': checkin.strftime('%Y-%m-%d'),
+            'checkin-0-time_1': checkin.strftime('%H:%M:%S'),
+            'checkout-TOTAL_FORMS': 0 if checkout is None else 1,
+            'checkout-INITIAL_FORMS': 0,
+        }
+        if checkout is not None:
+            data |= {
+                'checkout-0-type': LogType.REMOTE,
+                'checkout-0-time_0': checkout.strftime('%Y-%m-%d'),
+                'checkout-0-time_1': checkout.strftime('%H:%M:%S'),
+            }
+        response = self.client.post(reverse('admin:midas_session_add'), data)
+        self.assertEqual(response.status_code, 302)
+        return Session.objects.latest('pk')
+
+    def test_add_past_session(self):
+        now = timezone.localtime()
+        closed = self.add(now - timedelta(days=2, hours=8), now - timedelta(days=2))
+        self.assertFalse(closed.is_open)
+
+        # forgot to add the checkout: stays closed, the user is still in
+        forgotten = self.add(now - timedelta(days=3))
+        self.assertFalse(forgotten.is_open)
+        self.assertCheckedIn()
+
+    def test_add_current_session(self):
+        self.current.checkout = Checkout.objects.create(
+            type=LogType.REMOTE, time=timezone.now(), session=self.current
+        )
+        session = self.add(timezone.localtime())
+        session.refresh_from_db()
+        self.assertTrue(session.is_open)
+
+
+class DirectoryTests(TestCase):
+    def test_invalidated_on_write(self):
+        user = User.objects.create(username='test', first_name='Test', last_name='User')
+        scanner = Scanner.objects.create(id='scanner', name='Test Scanner')
+        directory.warm()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(directory.scanner('scanner').name, 'Test Scanner')
+            self.assertIsNone(directory.scanner('scanner').pending_tag)
+            self.assertIsNone(directory.tag('DEADBEEF'))
+
+        PendingTag.objects.create(name='test', owner=user, scanner=scanner)
+        self.assertEqual(directory.scanner('scanner').pending_tag.name, 'test')
+
+        ClaimedTag.objects.create(code='DEADBEEF', name='test', owner=user)
+        self.assertEqual(directory.tag('DEADBEEF').owner_name, 'Test User')
+
+        user.first_name = 'Renamed'
+        user.save()
+        self.assertEqual(directory.tag('DEADBEEF').owner_name, 'Renamed User')
+
+        scanner.pending_tag.delete()
+        self.assertIsNone(directory.scanner('scanner').pending_tag)
+
+        ClaimedTag.objects.filter(code='DEADBEEF').delete()
+        self.assertIsNone(directory.tag('DEADBEEF'))
+
+    def test_healthcheck(self):
+        Scanner.objects.create(id='scanner', name='Test Scanner')
+        directory.warm()
+
+        with self.assertNumQueries(0):
+            res = self.client.post(
+                reverse('midas:healthcheck'), {'scanner_id': 'scanner'}
+            )
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client.post(reverse('midas:healthcheck'), {'scanner_id': 'nope'})
+        self.assertEqual(res.status_code, 403)
+
+
+class RegisterScansTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+        self.scanner = Scanner.objects.create(id='scanner', name='Test Scanner')
+        ClaimedTag.objects.create(code='DEADBEEF', name='test', owner=self.user)
+        directory.warm()
+
+    def register_scans(self, scans):
+        return self.client.post(
+            reverse('midas:register_scans'),
+            {
+                'device_id': self.scanner.id,
+                'scans': [
+                    {'tag_id': tag_id, 'time': time.isoformat()}
+                    for tag_id, time in scans
+                ],
+            },
+            content_type='application/json',
+        )
+
+    def test_backlog(self):
+        start = timezone.now() - timedelta(days=7)
+        scans = []
+        for i in range(50):
+            scans.append(('DEADBEEF', start + timedelta(hours=2 * i)))
+            scans.append(('CAFEBABE', start + timedelta(hours=2 * i, minutes=1)))
+            scans.append(('DEADBEEF', start + timedelta(hours=2 * i + 1)))
+
+        # savepoint, open sessions, 3 bulk inserts, select + insert daily
+        # minutes, insert changes, release
+        with self.assertNumQueries(9):
+            res = self.register_scans(scans)
+        self.assertEqual(res.status_code, 200)
+
+        results = res.json()['results']
+        self.assertEqual(len(results), 150)
+        self.assertEqual(results[0]['state'], 'checkin')
+        self.assertEqual(results[1]['message'], 'Card not registered')
+        self.assertEqual(results[2]['state'], 'checkout')
+
+        # the original scan times are kept
+        sessions = Session.objects.filter(user=self.user).order_by('checkin__time')
+        self.assertEqual(sessions.count(), 50)
+        self.assertEqual(sessions[0].checkin.time, start)
+        self.assertEqual(sessions[0].checkout.time, start + timedelta(hours=1))
+
+    def test_future_scan(self):
+        now = timezone.now()
+        res = self.register_scans(
+            [
+                ('DEADBEEF', now - timedelta(hours=1)),
+                ('DEADBEEF', now + timedelta(seconds=2)),
+                ('DEADBEEF', now + timedelta(hours=1)),
+            ]
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [(r['status'], r['state'] or r['message']) for r in res.json()['results']],
+            [
+                ('ok', 'checkin'),
+                ('ok', 'checkout'),
+                ('error', 'Scan time must not be in the future'),
+            ],
+        )
+
+    def test_ordering(self):
+        now = timezone.now()
+        res = self.register_scans(
+            [('DEADBEEF', now), ('DEADBEEF', now - timedelta(hours=1))]
+        )
+        self.assertEqual(res.status_code, 400)
+
+        # fails on its own, see test_future_scan
+        res = self.register_scans([('DEADBEEF', now + timedelta(hours=1))])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['results'][0]['status'], 'error')
+
+
+def amsterdam(*args):
+    return AMSTERDAM_TZ.localize(datetime(*args))
+
+
+def add_session(user, checkin, checkout=None):
+    session = Session.objects.create(user=user, is_open=checkout is None)
+    Checkin.objects.create(type=LogType.REMOTE, time=checkin, session=session)
+    if checkout is not None:
+        Checkout.objects.create(type=LogType.REMOTE, time=checkout, session=session)
+    return session
+
+
+class DailyMinutesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+
+    def assertMatchesSessions(self, days):
+        """Compare the rollup against summing the sessions themselves."""
+        for day in days:
+            start = AMSTERDAM_TZ.localize(datetime.combine(day, time.min))
+            end = AMSTERDAM_TZ.localize(
+                datetime.combine(day + timedelta(days=1), time.min)
+            )
+            with self.subTest(day=day):
+                self.assertEqual(
+                    get_minutes_for_days(self.user, [(day, day)])[0],
+                    get_sessions_time(self.user, start, end),
+                )
+
+    def test_split_at_midnight(self):
+        add_session(
+            self.user, amsterdam(2025, 3, 10, 22, 0), amsterdam(2025, 3, 11, 1, 30)
+        )
+        self.assertEqual(
+            dict(DailyMinutes.objects.values_list('date', 'duration')),
+            {
+                date(2025, 3, 10): timedelta(hours=2),
+                date(2025, 3, 11): timedelta(hours=1, minutes=30),
+            },
+        )
+        self.assertMatchesSessions([date(2025, 3, 10), date(2025, 3, 11)])
+
+    def test_dst(self):
+        # the night clocks go forward is an hour short
+        add_session(
+            self.user, amsterdam(2025, 3, 29, 23, 0), amsterdam(2025, 3, 30, 4, 0)
+        )
+        # and the night they go back an hour long
+        add_session(
+            self.user, amsterdam(2025, 10, 25, 23, 0), amsterdam(2025, 10, 26, 4, 0)
+        )
+        self.assertEqual(
+            get_minutes_for_days(self.user, [(None, date(2025, 12, 31))]),
+            [4 * 60 + 6 * 60],
+        )
+        self.assertMatchesSessions(
+            [
+                date(2025, 3, 29),
+                date(2025, 3, 30),
+                date(2025, 10, 25),
+                date(2025, 10, 26),
+            ]
+        )
+
+    def test_edit_and_delete(self):
+        session = add_session(
+            self.user, amsterdam(2025, 5, 1, 9, 0), amsterdam(2025, 5, 1, 17, 0)
+        )
+        add_session(
+            self.user, amsterdam(2025, 5, 2, 9, 0), amsterdam(2025, 5, 2, 12, 0)
+        )
+        days = [date(2025, 5, 1), date(2025, 5, 2)]
+
+        # moving the checkout to the next day, like an admin would
+        session.checkout.time = amsterdam(2025, 5, 2, 10, 0)
+        session.checkout.save()
+        self.assertMatchesSessions(days)
+        self.assertEqual(get_minutes_this_month(self.user, date(2025, 5, 2)), 28 * 60)
+
+        session.checkin.time = amsterdam(2025, 5, 1, 23, 0)
+        session.checkin.save()
+        self.assertMatchesSessions(days)
+
+        session.checkout.delete()
+        self.assertMatchesSessions(days)
+
+        session.delete()
+        self.assertMatchesSessions(days)
+        self.assertEqual(get_total_minutes(self.user, date(2025, 5, 31)), 3 * 60)
+
+    def test_open_session(self):
+        now = timezone.now()
+        add_session(self.user, now - timedelta(hours=3), now - timedelta(hours=2))
+        add_session(self.user, now - timedelta(minutes=30))
+        self.assertEqual(
+            get_total_minutes(self.user, timezone.localdate() + timedelta(days=1)),
+            90,
+        )
+
+    def test_rebuild(self):
+        add_session(
+            self.user, amsterdam(2025, 3, 10, 22, 0), amsterdam(2025, 3, 11, 1, 30)
+        )
+        add_session(self.user, amsterdam(2025, 3, 12, 9, 0))
+        expected = set(DailyMinutes.objects.values_list('user', 'date', 'duration'))
+
+        DailyMinutes.objects.all().delete()
+        self.assertEqual(rebuild(), 2)
+        self.assertEqual(
+            set(DailyMinutes.objects.values_list('user', 'date', 'duration')),
+            expected,
+        )
+
+
+class MinutesPerDayTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+
+    def test_matches_per_day(self):
+        add_session(
+            self.user, amsterdam(2025, 3, 28, 9, 0), amsterdam(2025, 3, 28, 17, 0)
+        )
+        # across midnight and the switch to summer time
+        add_session(
+            self.user, amsterdam(2025, 3, 29, 22, 0), amsterdam(2025, 3, 30, 4, 0)
+        )
+        # two sessions on one day
+        add_session(
+            self.user, amsterdam(2025, 3, 31, 9, 0), amsterdam(2025, 3, 31, 9, 45)
+        )
+        add_session(
+            self.user, amsterdam(2025, 3, 31, 13, 0), amsterdam(2025, 3, 31, 14, 0)
+        )
+        # starting before and ending after the range
+        add_session(
+            self.user, amsterdam(2025, 3, 26, 23, 0), amsterdam(2025, 3, 27, 1, 0)
+        )
+        add_session(
+            self.user, amsterdam(2025, 4, 2, 23, 0), amsterdam(2025, 4, 3, 1, 0)
+        )
+
+        first_day, last_day = date(2025, 3, 27), date(2025, 4, 2)
+        with self.assertNumQueries(1):
+            minutes = get_minutes_per_day(self.user, first_day, last_day)
+
+        self.assertEqual(len(minutes), 7)
+        for day, day_minutes in minutes.items():
+            with self.subTest(day=day):
+                self.assertEqual(day_minutes, get_minutes_today(self.user, day))
+        self.assertEqual(minutes[date(2025, 3, 30)], 3 * 60)
+        self.assertEqual(minutes[date(2025, 4, 1)], 0)
+
+    def test_open_session(self):
+        today = timezone.localdate()
+        add_session(self.user, timezone.now() - timedelta(minutes=30))
+        minutes = get_minutes_per_day(self.user, today - timedelta(days=1), today)
+        self.assertEqual(sum(minutes.values()), 30)
+
+    def test_stale_session(self):
+        # closed without a checkout, e.g. after a forgotten checkout
+        stale = add_session(self.user, amsterdam(2025, 3, 28, 9, 0))
+        stale.is_open = False
+        stale.save()
+
+        minutes = get_minutes_per_day(self.user, date(2025, 3, 28), date(2025, 3, 30))
+        self.assertEqual(minutes, dict.fromkeys(minutes, 0))
+        self.assertEqual(get_minutes_today(self.user, date(2025, 3, 29)), 0)
+
+    @override_settings(
+        STORAGES={
+            'staticfiles': {
+                'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'
+            }
+        }
+    )
+    def test_user_overview(self):
+        Assignment.objects.create(
+            user=self.user, quota=Quota.objects.create(name='test', hours=10)
+        )
+        self.client.force_login(self.user)
+        res = self.client.get(
+            reverse('midas:user_overview'),
+            {'start_date': '2025-01-01', 'end_date': '2025-03-31'},
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.context['page_data']['chart']['data']), 90)
+
+
+class TeamStatisticsTests(TestCase):
+    def test_matches_per_user(self):
+        users = User.objects.bulk_create(
+            User(username=f'member{i}', first_name='Member', last_name=str(i))
+            for i in range(4)
+        )
+        now = timezone.now()
+        for i, user in enumerate(users[:3]):
+            add_session(
+                user, amsterdam(2025, 3, 29, 22, i), amsterdam(2025, 3, 30, 4, 0)
+            )
+            add_session(
+                user, amsterdam(2025, 3, 31, 9, 0), amsterdam(2025, 3, 31, 10 + i, 0)
+            )
+        add_session(users[2], now - timedelta(minutes=30))
+
+        start, end = amsterdam(2025, 3, 30, 0, 0), now
+        with self.assertNumQueries(1):
+            minutes = get_sessions_time_per_user(users, start, end)
+
+        self.assertEqual(
+            minutes,
+            {user.pk: get_sessions_time(user, start, end) for user in users},
+        )
+        self.assertEqual(minutes[users[3].pk], 0)
+
+
+class AllStatisticsTests(TestCase):
+    def test_matches_per_user_functions(self):
+        users = User.objects.bulk_create(
+            User(username=f'member{i}', first_name='Member', last_name=str(i))
+            for i in range(3)
+        )
+        quota = Quota.objects.create(name='test', hours=10)
+        old, new = Subteam.objects.bulk_create(
+            [Subteam(name='old'), Subteam(name='new')]
+        )
+        assignment = Assignment.objects.create(
+            user=users[0], quota=quota, starting_from=amsterdam(2025, 1, 1, 0, 0)
+        )
+        assignment.subteams.set([old])
+        assignment = Assignment.objects.create(
+            user=users[0], quota=quota, starting_from=amsterdam(2025, 3, 31, 0, 0)
+        )
+        assignment.subteams.set([old, new])
+
+        for i, user in enumerate(users[:2]):
+            add_session(
+                user, amsterdam(2025, 3, 24, 9, i), amsterdam(2025, 3, 24, 17, 0)
+            )
+            add_session(
+                user, amsterdam(2025, 3, 31, 22, 0), amsterdam(2025, 4, 1, 2, i)
+            )
+            add_session(user, amsterdam(2025, 4, 3, 9, 0), amsterdam(2025, 4, 3, 10, 0))
+        add_session(users[1], timezone.now() - timedelta(minutes=30))
+
+        dates = [date(2025, 3, 24) + timedelta(days=i) for i in range(12)]
+        # users, daily minutes, open sessions, weeks, assignments, subteams
+        with self.assertNumQueries(6):
+            rows = list(iter_all_statistics(User.objects.all(), dates))
+
+        expected = []
+        for day in dates:
+            for user in users:
+                assignment = (
+                    Assignment.objects.filter(
+                        user=user, starting_from__lte=amsterdam(*day.timetuple()[:3])
+                    )
+                    .order_by('-starting_from')
+                    .first()
+                )
+                expected.append(
+                    {
+                        'name': user.first_name + ' ' + user.last_name,
+                        'subteam': assignment.subteam_names()
+                        if assignment
+                        else 'No subteam',
+                        'quota': assignment.quota.hours if assignment else 'No quota',
+                        'date': day,
+                        'minutes_today': get_minutes_today(user, day),
+                        'minutes_this_week': get_minutes_this_week(user, day),
+                        'minutes_this_month': get_minutes_this_month(user, day),
+                        'total_minutes': get_total_minutes(user, day),
+                        'average_week': get_average_week(user, day),
+                    }
+                )
+        self.assertEqual(rows, expected)
+
+
+class StatisticsCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+
+    def test_cached_until_sessions_change(self):
+        day = date(2025, 5, 1)
+        session = add_session(
+            self.user, amsterdam(2025, 5, 1, 9, 0), amsterdam(2025, 5, 1, 11, 0)
+        )
+        self.assertEqual(get_minutes_today_and_this_week(self.user, day), (120, 120))
+        self.assertEqual(get_average_week(self.user, day), 120)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                get_minutes_today_and_this_week(self.user, day), (120, 120)
+            )
+            self.assertEqual(get_average_week(self.user, day), 120)
+
+        session.checkout.time = amsterdam(2025, 5, 1, 12, 0)
+        session.checkout.save()
+        self.assertEqual(get_minutes_today_and_this_week(self.user, day), (180, 180))
+
+        add_session(
+            self.user, amsterdam(2025, 5, 2, 9, 0), amsterdam(2025, 5, 2, 10, 0)
+        )
+        self.assertEqual(get_minutes_today_and_this_week(self.user, day), (180, 240))
+
+    def test_open_session_keeps_counting(self):
+        now = amsterdam(2025, 5, 1, 12, 0)
+        add_session(self.user, now - timedelta(minutes=30))
+        days = [(None, date(2025, 5, 1))]
+
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            self.assertEqual(get_minutes_for_days(self.user, days), [30])
+
+        # the history is cached, the open session is counted up to now
+        later = now + timedelta(minutes=15)
+        with (
+            mock.patch('django.utils.timezone.now', return_value=later),
+            self.assertNumQueries(0),
+        ):
+            self.assertEqual(get_minutes_for_days(self.user, days), [45])
+
+
+class ExportSessionsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+        self.tag = ClaimedTag.objects.create(
+            code='DEADBEEF', name='card', owner=self.user
+        )
+
+    def export(self, sessions):
+        return async_to_sync(self.aexport)(sessions)
+
+    async def aexport(self, sessions):
+        response = sessions_to_csv(sessions)
+        content = [chunk async for chunk in response.streaming_content]
+        return b''.join(content).decode().splitlines()
+
+    def test_csv(self):
+        session = Session.objects.create(user=self.user)
+        Checkin.objects.create(
+            type=LogType.TAG,
+            time=amsterdam(2025, 5, 1, 9, 0),
+            tag=self.tag,
+            session=session,
+        )
+        Checkout.objects.create(
+            type=LogType.REMOTE, time=amsterdam(2025, 5, 1, 17, 0), session=session
+        )
+        add_session(self.user, amsterdam(2025, 5, 2, 9, 0))
+
+        self.assertEqual(
+            self.export(Session.objects.order_by('pk')),
+            [
+                (
+                    'checkin_type,checkin_time,checkin_tag,'
+                    'checkout_type,checkout_time,checkout_tag'
+                ),
+                'tag,2025-05-01 07:00:00,card,remote,2025-05-01 15:00:00,-',
+                'remote,2025-05-02 07:00:00,-,-,-,-',
+            ],
+        )
+
+    def test_fixed_query_count(self):
+        for day in range(1, 31):
+            session = add_session(
+                self.user, amsterdam(2025, 5, day, 9, 0), amsterdam(2025, 5, day, 17, 0)
+            )
+            Checkin.objects.filter(session=session).update(tag=self.tag)
+
+        with self.assertNumQueries(1):
+            lines = self.export(Session.objects.all())
+        self.assertEqual(len(lines), 31)
+
+        self.async_client.force_login(self.user)
+        # session, user, sessions
+        with self.assertNumQueries(3):
+            lines = b''.join(async_to_sync(self.download)()).decode().splitlines()
+        self.assertEqual(len(lines), 31)
+
+    async def test_streamed_under_asgi(self):
+        for day in range(1, 6):
+            await sync_to_async(add_session)(
+                self.user, amsterdam(2025, 5, day, 9, 0), amsterdam(2025, 5, day, 17, 0)
+            )
+        await self.async_client.aforce_login(self.user)
+
+        with mock.patch('midas.api.CSV_CHUNK_SIZE', 2):
+            chunks = await self.download()
+
+        # the header, then rows fetched and sent two at a time
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [1, 2, 2, 1])
+
+    async def download(self):
+        response = await self.async_client.get(reverse('midas:export_user'))
+        self.assertTrue(response.is_async)
+        return [chunk async for chunk in response.streaming_content]
+
+
+class ColumnarExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+        subteam = Subteam.objects.create(name='software')
+        assignment = Assignment.objects.create(
+            user=self.user,
+            quota=Quota.objects.create(name='test', hours=10),
+            starting_from=amsterdam(2025, 1, 1, 0, 0),
+        )
+        assignment.subteams.set([subteam])
+        add_session(
+            self.user, amsterdam(2024, 12, 1, 9, 0), amsterdam(2024, 12, 1, 10, 0)
+        )
+        add_session(
+            self.user, amsterdam(2025, 5, 1, 9, 0), amsterdam(2025, 5, 1, 17, 0)
+        )
+        add_session(self.user, amsterdam(2025, 5, 2, 9, 0))
+
+    def read(self, file_format, data):
+        if file_format == 'parquet':
+            return pq.read_table(pa.BufferReader(data))
+        return pa.ipc.open_file(pa.BufferReader(data)).read_all()
+
+    def test_export(self):
+        for file_format in columnar.FORMATS:
+            with self.subTest(file_format=file_format):
+                # assignments, subteams, sessions
+                with self.assertNumQueries(3):
+                    data = b''.join(columnar.export_sessions(file_format))
+                table = self.read(file_format, data).to_pydict()
+
+                self.assertEqual(table['username'], ['test'] * 3)
+                self.assertEqual(table['subteam'], [None, 'software', 'software'])
+                self.assertEqual(table['quota_hours'], [None, 10, 10])
+                self.assertEqual(
+                    table['duration'], [timedelta(hours=1), timedelta(hours=8), None]
+                )
+                self.assertEqual(table['checkout_type'], ['remote', 'remote', None])
+
+    def test_row_groups(self):
+        with mock.patch.object(columnar, 'ROW_GROUP_SIZE', 2):
+            data = b''.join(columnar.export_sessions('parquet'))
+        parquet = pq.ParquetFile(pa.BufferReader(data))
+        self.assertEqual(parquet.metadata.num_row_groups, 2)
+
+    async def test_endpoint(self):
+        url = reverse('midas:export_all', args=['parquet'])
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+        self.user.is_staff = True
+        await self.user.asave()
+        with mock.patch.object(columnar, 'ROW_GROUP_SIZE', 2):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        # two row groups, then the footer
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(self.read('parquet', b''.join(chunks)).num_rows, 3)
+
+
+class SessionChangesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+        self.other = User.objects.create(
+            username='other', first_name='Other', last_name='User'
+        )
+        self.client.force_login(self.user)
+        # changes are held back until they settle, see test_unsettled_changes
+        patcher = mock.patch('midas.changes.SETTLE_TIME', timedelta(0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def changes(self, cursor):
+        res = self.client.get(reverse('midas:export_changes'), {'cursor': cursor})
+        self.assertEqual(res.status_code, 200)
+        return res.json()
+
+    def test_changes_since_cursor(self):
+        first = add_session(
+            self.user, amsterdam(2025, 5, 1, 9, 0), amsterdam(2025, 5, 1, 17, 0)
+        )
+        second = add_session(self.user, amsterdam(2025, 5, 2, 9, 0))
+        add_session(self.other, amsterdam(2025, 5, 2, 9, 0))
+
+        res = self.changes(0)
+        self.assertFalse(res['has_more'])
+        self.assertEqual(
+            [s['session_id'] for s in res['sessions']], [first.pk, second.pk]
+        )
+        self.assertEqual(res['sessions'][0]['checkout_type'], 'remote')
+        self.assertIsNone(res['sessions'][1]['checkout_time'])
+
+        # nothing changed
+        cursor = res['cursor']
+        self.assertEqual(self.changes(cursor), {**res, 'sessions': []})
+
+        Checkout.objects.create(
+            type=LogType.REMOTE, time=amsterdam(2025, 5, 2, 17, 0), session=second
+        )
+        first_id = first.pk
+        first.delete()
+        res = self.changes(cursor)
+        self.assertEqual(
+            [(s['session_id'], s['deleted']) for s in res['sessions']],
+            [(second.pk, False), (first_id, True)],
+        )
+        self.assertEqual(res['sessions'][0]['checkout_type'], 'remote')
+
+    def test_staff_and_paging(self):
+        for user in [self.user, self.other]:
+            add_session(user, amsterdam(2025, 5, 1, 9, 0), amsterdam(2025, 5, 1, 17, 0))
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(len(self.changes(0)['sessions']), 2)
+
+        # one session takes three changes, paging can split them
+        cursor, sessions, has_more = changes_since(0, limit=4)
+        self.assertTrue(has_more)
+        self.assertEqual(len(sessions), 2)
+        cursor, sessions, has_more = changes_since(cursor, limit=4)
+        self.assertFalse(has_more)
+        self.assertEqual(len(sessions), 1)
+
+    def test_unsettled_changes(self):
+        first = add_session(
+            self.user, amsterdam(2025, 5, 1, 9, 0), amsterdam(2025, 5, 1, 17, 0)
+        )
+        second = add_session(self.user, amsterdam(2025, 5, 2, 9, 0))
+        first_changes = SessionChange.objects.filter(session_id=first.pk)
+        now = first_changes.latest('pk').time + timedelta(seconds=5)
+        # the first session and a later change of the second one settled,
+        # but the earlier changes of the second one haven't
+        SessionChange.objects.filter(session_id=second.pk).update(
+            time=now - timedelta(seconds=5)
+        )
+        SessionChange.objects.create(
+            session_id=second.pk, user=self.user, time=now - timedelta(seconds=15)
+        )
+        first_changes.update(time=now - timedelta(seconds=10))
+
+        with mock.patch('midas.changes.SETTLE_TIME', timedelta(seconds=10)):
+            cursor, sessions, has_more = changes_since(0, now=now)
+            self.assertEqual([s.session_id for s in sessions], [first.pk])
+            self.assertEqual(cursor, first_changes.latest('pk').pk)
+            self.assertFalse(has_more)
+
+            cursor, sessions, _ = changes_since(cursor, now=now + timedelta(seconds=10))
+            self.assertEqual([s.session_id for s in sessions], [second.pk])
+
+    def test_prune(self):
+        kept = add_session(
+            self.user, amsterdam(2025, 5, 1, 9, 0), amsterdam(2025, 5, 1, 17, 0)
+        )
+        old = add_session(self.user, amsterdam(2025, 5, 2, 9, 0))
+        recent = add_session(self.other, amsterdam(2025, 5, 3, 9, 0))
+        old_id, recent_id = old.pk, recent.pk
+        old.delete()
+        recent.delete()
+        SessionChange.objects.exclude(session_id=recent_id).update(
+            time=timezone.now() - timedelta(days=100)
+        )
+        _, before, _ = changes_since(0)
+        count = SessionChange.objects.count()
+
+        # one change per session is left, minus the old tombstone
+        self.assertEqual(prune(), count - 2)
+        self.assertEqual(
+            sorted(SessionChange.objects.values_list('session_id', flat=True)),
+            [kept.pk, recent_id],
+        )
+        _, after, _ = changes_since(0)
+        self.assertEqual(after, [s for s in before if s.session_id != old_id])
+
+
+class ServeTests(SimpleTestCase):
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    )
+    def test_workers_need_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, 'shared cache'):
+            call_command('serve', '--workers=2', '--port=0')
+
+
+class SQLiteBackupTests(SimpleTestCase):
+    def test_writes_continue_during_backup(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = Path(directory) / 'db.sqlite3'
+            db = sqlite3.connect(source)
+            db.execute('CREATE TABLE scan (id INTEGER PRIMARY KEY, data TEXT)')
+            db.executemany('INSERT INTO scan (data) VALUES (?)', [('x' * 1000,)] * 2000)
+            db.commit()
+            db.close()
+
+            committed = []
+
+            def write(percent):
+                # another connection commits a scan while the backup runs
+                writer = sqlite3.connect(source, timeout=1)
+                with writer:
+                    writer.execute("INSERT INTO scan (data) VALUES ('y')")
+                writer.close()
+                committed.append(percent)
+
+            snapshot = snapshot_sqlite(
+                source, pages=64, sleep=0, progress=BackupProgress(write)
+            )
+
+            self.assertEqual(committed[-1], 100)
+            self.assertGreater(len(committed), 5)
+            backup = sqlite3.connect(':memory:')
+            backup.deserialize(snapshot)
+            (count,) = backup.execute('SELECT COUNT(*) FROM scan').fetchone()
+            backup.close()
+            self.assertGreaterEqual(count, 2000)
+
+
+class FlakyStorage(LocalStorage):
+    """Receives only half of every other chunk."""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.writes = 0
+
+    def write(self, upload, offset, data, total=None):
+        self.writes += 1
+        if self.writes % 2:
+            super().write(upload, offset, data[: len(data) // 2])
+            raise TransientUploadError('connection reset')
+        return super().write(upload, offset, data, total)
+
+
+class BackupUploadTests(SimpleTestCase):
+    def test_resumes_interrupted_chunks(self):
+        data = bytes(range(256)) * 4000
+        sleeps = []
+        with tempfile.TemporaryDirectory() as directory:
+            location = upload(
+                FlakyStorage(directory),
+                'backup.gz',
+                'application/gzip',
+                compress([data[:1000], data[1000:]], 'gzip'),
+                chunk_size=1024,
+                sleep=sleeps.append,
+            )
+            self.assertEqual(location, str(Path(directory) / 'backup.gz'))
+            self.assertEqual(gzip.decompress(Path(location).read_bytes()), data)
+            self.assertEqual(list(Path(directory).iterdir()), [Path(location)])
+        self.assertTrue(sleeps)
+
+    def test_gives_up(self):
+        class Down(LocalStorage):
+            def write(self, upload, offset, data, total=None):
+                raise TransientUploadError('down')
+
+        sleeps = []
+        with (
+            tempfile.TemporaryDirectory() as directory,
+            self.assertRaises(TransientUploadError),
+        ):
+            upload(
+                Down(directory),
+                'backup',
+                'application/octet-stream',
+                [b'data'],
+                retries=3,
+                backoff=1,
+                sleep=sleeps.append,
+            )
+        self.assertEqual(sleeps, [1, 2, 4])
+
+
+class BackupJobTests(SimpleTestCase):
+    def test_incremental_by_default(self):
+        with mock.patch('door_tracker.backup_scheduler.call_command') as command:
+            backup_website_job()
+            with self.settings(BACKUP_INCREMENTAL=False):
+                backup_website_job()
+        self.assertEqual(
+            command.call_args_list,
+            [
+                mock.call('backup_website', incremental=True),
+                mock.call('backup_website', incremental=False),
+            ],
+        )
+
+
+class DriveStorageTests(SimpleTestCase):
+    def test_one_listing_for_many_files(self):
+        with (
+            mock.patch('door_tracker.backup_storage.service_account'),
+            mock.patch('door_tracker.backup_storage.AuthorizedHttp'),
+            mock.patch('door_tracker.backup_storage.build') as build,
+        ):
+            storage = DriveStorage('service-account.json', 'drive', 'backups')
+        storage.folder_id = 'folder'
+        files = build.return_value.files.return_value
+        files.list.return_value.execute.return_value = {
+            'files': [{'id': f'id{i}', 'name': f'chunk-{i}'} for i in range(10)]
+        }
+
+        for i in range(10):
+            storage.read(f'chunk-{i}')
+        for i in range(10):
+            storage.delete(f'chunk-{i}')
+        self.assertEqual(files.list.call_count, 1)
+        files.delete.assert_called_with(fileId='id9', supportsAllDrives=True)
+
+
+class IncrementalBackupTests(SimpleTestCase):
+    def test_backup_and_restore(self):
+        first = bytearray(bytes(range(256)) * 1024)
+        second = bytearray(first)
+        first[0] ^= 1
+        second[100_000] ^= 1
+        with tempfile.TemporaryDirectory() as directory:
+            storage = LocalStorage(directory)
+            _, new_chunks, _ = incremental_backup.backup(
+                storage, first, datetime(2025, 5, 1, 23, 59), 'gzip', chunk_size=4096
+            )
+            self.assertEqual(new_chunks, 2)  # the others equal the second one
+            name, new_chunks, _ = incremental_backup.backup(
+                storage, second, datetime(2025, 5, 2, 23, 59), 'gzip', chunk_size=4096
+            )
+            self.assertEqual(new_chunks, 1)
+
+            restored = io.BytesIO()
+            incremental_backup.restore(storage, name, restored)
+            self.assertEqual(restored.getvalue(), second)
+
+            # only the second backup is kept, and the chunk only the first used goes
+            self.assertEqual(
+                incremental_backup.prune(storage, datetime(2025, 6, 5), 30, 0),
+                (1, 1),
+            )
+            self.assertEqual(
+                storage.list(incremental_backup.MANIFEST_PREFIX),
+                ['manifest-20250502_235900.json'],
+            )
+
+    def test_retention(self):
+        now = datetime(2025, 6, 29, 23, 59)  # a Sunday
+        times = [now - timedelta(days=i) for i in range(400)]
+        times.append(now - timedelta(hours=12))
+        keep = incremental_backup.retained(times, now)
+
+        # the last backup of each of the last 30 days
+        self.assertNotIn(now - timedelta(hours=12), keep)
+        self.assertEqual(len([t for t in keep if now - t < timedelta(days=30)]), 30)
+        # then the last one of each week, for a year
+        self.assertIn(now - timedelta(weeks=10), keep)
+        self.assertNotIn(now - timedelta(weeks=10, days=1), keep)
+        self.assertEqual(len(keep), 30 + 52 - 5)
+        self.assertEqual(incremental_backup.retained([times[-1]], now), {times[-1]})
+
+
+class LeaseTests(TestCase):
+    def test_one_holder(self):
+        self.assertTrue(leases.acquire('job', 'a', 60))
+        self.assertFalse(leases.acquire('job', 'b', 60))
+        self.assertTrue(leases.acquire('job', 'a', 60))  # renewed
+
+        with mock.patch(
+            'django.utils.timezone.now',
+            return_value=timezone.now() + timedelta(seconds=61),
+        ):
+            self.assertTrue(leases.acquire('job', 'b', 60))
+        self.assertFalse(leases.acquire('job', 'a', 60))
+
+        leases.release('job', 'a')  # not the holder, does nothing
+        self.assertFalse(leases.acquire('job', 'a', 60))
+        leases.release('job', 'b')
+        self.assertTrue(leases.acquire('job', 'a', 60))
+
+    def test_single_leader(self):
+        first = LeaderScheduler(mock.Mock())
+        second = LeaderScheduler(mock.Mock())
+        first.heartbeat()
+        second.heartbeat()
+        first.scheduler.resume.assert_called_once()
+        second.scheduler.resume.assert_not_called()
+
+        first.stop()
+        second.heartbeat()
+        second.scheduler.resume.assert_called_once()
+
+
+class FileCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = FileCache(
+            directory.name, {'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 2}}
+        )
+
+    def test_incr(self):
+        self.cache.set('generation', 0, timeout=None)
+
+        def bump():
+            for _ in range(50):
+                self.cache.incr('generation')
+
+        threads = [threading.Thread(target=bump) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('generation'), 200)
+
+        # keeps not expiring
+        with mock.patch('time.time', return_value=10**12):
+            self.assertEqual(self.cache.get('generation'), 200)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_evicts_least_recently_used(self):
+        self.cache.CULL_INTERVAL = 0
+        self.cache.TOUCH_INTERVAL = 0
+        for i in range(10):
+            self.cache.set(f'key{i}', i)
+            os.utime(self.cache._key_to_file(f'key{i}'), (i, i))
+        self.assertEqual(self.cache.get('key0'), 0)  # used again
+
+        self.cache.set('key10', 10)
+        self.assertEqual(
+            [i for i in range(11) if self.cache.has_key(f'key{i}')],
+            [0, 6, 7, 8, 9, 10],
+        )
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+        Scanner.objects.create(id='scanner', name='Test Scanner')
+        ClaimedTag.objects.create(code='DEADBEEF', name='test', owner=self.user)
+        directory.warm()
+        presence.warm()
+
+    def scan(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return process_scan('scanner', 'DEADBEEF')
+
+    def generation(self):
+        return cache.get(GENERATION_KEY)
+
+    def test_scans(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(presence.is_present(self.user.pk))
+
+        generation = self.generation()
+        checkin = self.scan()
+        # applied in place, and other processes are told once
+        self.assertEqual(self.generation(), generation + 1)
+        with self.assertNumQueries(0):
+            self.assertTrue(presence.is_present(self.user.pk))
+            self.assertEqual(
+                presence.present(),
+                [PresentUser(self.user.pk, 'Test User', checkin.time)],
+            )
+
+        self.scan()
+        self.assertEqual(self.generation(), generation + 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(presence.present(), [])
+
+        # bulk scans don't send signals
+        with self.captureOnCommitCallbacks(execute=True):
+            process_scans('scanner', [('DEADBEEF', timezone.now())])
+        self.assertEqual(self.generation(), generation + 3)
+        with self.assertNumQueries(0):
+            self.assertTrue(presence.is_present(self.user.pk))
+
+    def test_other_process(self):
+        self.scan()
+        # someone else checked out in the meantime
+        Session.objects.filter(user=self.user).update(is_open=False)
+        cache.incr(GENERATION_KEY)
+        self.assertFalse(presence.is_present(self.user.pk))
+
+    def test_rollback(self):
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            process_scan('scanner', 'DEADBEEF')
+            raise DatabaseError
+        self.assertFalse(presence.is_present(self.user.pk))
+
+    def test_remote_and_admin(self):
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('midas:checkin'), {'next': '/'})
+        self.assertTrue(presence.is_present(self.user.pk))
+
+        # only the two queries that authenticate the request
+        with self.assertNumQueries(2):
+            res = self.client.get(reverse('midas:presence'))
+        self.assertEqual(res.json()[0]['name'], 'Test User')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Session.objects.get(user=self.user).delete()
+        self.assertFalse(presence.is_present(self.user.pk))
+
+
+class EventsTests(SimpleTestCase):
+    async def test_publish_from_thread(self):
+        broker = events.Broker()
+        async with broker.subscribe('a', 'b') as subscription:
+            thread = threading.Thread(target=broker.publish, args=('b', 42))
+            thread.start()
+            thread.join()
+            self.assertEqual(await subscription.get(timeout=1), 42)
+
+            broker.publish('c', 'not subscribed')
+            with self.assertRaises(TimeoutError):
+                await subscription.get(timeout=0.01)
+        self.assertEqual(broker.subscribers('a'), 0)
+
+    async def test_slow_subscriber(self):
+        broker = events.Broker()
+        async with broker.subscribe('a', maxsize=2) as subscription:
+            for i in range(5):
+                broker.publish('a', i)
+            await asyncio.sleep(0)
+            self.assertEqual(await subscription.get(), 3)
+            self.assertEqual(await subscription.get(), 4)
+
+
+class TagScanEventsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        Scanner.objects.create(id='scanner', name='Test Scanner')
+        self.pending_tag = PendingTag.objects.create(
+            name='test', owner=self.user, scanner_id='scanner'
+        )
+        self.topic = events.pending_tag_topic(self.pending_tag.pk)
+
+    def scan(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            process_scan('scanner', 'DEADBEEF')
+
+    async def stream(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(
+            reverse('midas:tag_scan_events'), {'tag': self.pending_tag.pk}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return aiter(response.streaming_content)
+
+    async def test_pushed_on_scan(self):
+        stream = await self.stream()
+        event = asyncio.ensure_future(anext(stream))
+        while events.broker.subscribers(self.topic) == 0:
+            await asyncio.sleep(0.001)
+
+        await sync_to_async(self.scan)()
+
+        # well before the stream would have checked the database again
+        async with asyncio.timeout(1):
+            self.assertEqual(await event, b'event: claimed\ndata: /user_profile\n\n')
+        self.assertTrue(await ClaimedTag.objects.filter(code='DEADBEEF').aexists())
+
+    async def test_already_claimed(self):
+        await sync_to_async(self.scan)()
+        stream = await self.stream()
+        self.assertEqual(
+            await anext(stream), b'event: claimed\ndata: /user_profile\n\n'
+        )
+
+
+class OccupancyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='test', first_name='Test', last_name='User'
+        )
+        Scanner.objects.create(id='scanner', name='Test Scanner')
+        ClaimedTag.objects.create(code='DEADBEEF', name='test', owner=self.user)
+        self.software = Subteam.objects.create(name='Software')
+        Subteam.objects.create(name='Mechanics')
+        self.assignment = Assignment.objects.create(
+            user=self.user, quota=Quota.objects.create(name='test', hours=10)
+        )
+        self.assignment.subteams.add(self.software)
+        directory.warm()
+        presence.warm()
+
+    def scan(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return process_scan('scanner', 'DEADBEEF')
+
+    def test_occupancy(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                json.loads(presence.occupancy()),
+                {
+                    'present': [],
+                    'subteams': [
+                        {'name': 'Mechanics', 'headcount': 0},
+                        {'name': 'Software', 'headcount': 0},
+                    ],
+                },
+            )
+
+        checkin = self.scan()
+        occupancy = json.loads(presence.occupancy())
+        self.assertEqual(
+            occupancy['present'],
+            [
+                {
+                    'name': 'Test User',
+                    'since': DjangoJSONEncoder().default(checkin.time),
+                    'subteams': ['Software'],
+                }
+            ],
+        )
+        self.assertEqual(occupancy['subteams'][1], {'name': 'Software', 'headcount': 1})
+
+        # moving to another subteam shows up too
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assignment.subteams.set([Subteam.objects.get(name='Mechanics')])
+        occupancy = json.loads(presence.occupancy())
+        self.assertEqual(
+            occupancy['subteams'][0], {'name': 'Mechanics', 'headcount': 1}
+        )
+
+    @override_settings(
+        STORAGES={
+            'staticfiles': {
+                'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'
+            }
+        }
+    )
+    def test_page(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('midas:occupancy')).status_code, 200)
+
+    async def test_stream(self):
+        await self.async_client.aforce_login(self.user)
+        viewers = []
+        for _ in range(3):
+            response = await self.async_client.get(reverse('midas:occupancy_events'))
+            viewers.append(aiter(response.streaming_content))
+
+        # the current state when opened
+        for viewer in viewers:
+            event = await anext(viewer)
+            self.assertTrue(event.startswith(b'event: occupancy\n'))
+            self.assertIn(b'"present": []', event)
+
+        updates = [asyncio.ensure_future(anext(viewer)) for viewer in viewers]
+        while events.broker.subscribers(events.PRESENCE_TOPIC) < len(viewers):
+            await asyncio.sleep(0.001)
+        await sync_to_async(self.scan)()
+
+        # pushed to every viewer, well before they would check by themselves
+        async with asyncio.timeout(1):
+            for update in updates:
+                self.assertIn(b'"name": "Test User"', await update)
+
+
+class LivenessTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            Scanner.objects.create(id=f'scanner{i}', name=f'Scanner {i}')
+        directory.warm()
+        self.liveness = liveness.Liveness()
+        patcher = mock.patch('midas.api.liveness', self.liveness)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ping(self, scanner_id):
+        return self.client.post(
+            reverse('midas:healthcheck'), {'scanner_id': scanner_id}
+        )
+
+    def last_seen(self):
+        return dict(Scanner.objects.values_list('id', 'last_seen'))
+
+    def test_batched_writes(self):
+        for _ in range(2):
+            for i in range(3):
+                self.assertEqual(self.ping(f'scanner{i}').status_code, 200)
+        self.assertEqual(self.ping('unknown').status_code, 403)
+
+        # nothing written yet, but this process knows they're alive
+        self.assertEqual(set(self.last_seen().values()), {None})
+        self.assertTrue(all(s.alive for s in self.liveness.fleet()))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.liveness.flush(), 3)
+        self.assertNotIn(None, self.last_seen().values())
+
+    def test_flush_when_due(self):
+        with mock.patch('midas.liveness.FLUSH_INTERVAL', 0):
+            self.ping('scanner0')
+        self.assertIsNotNone(self.last_seen()['scanner0'])
+
+    def test_never_moves_back(self):
+        now = timezone.now()
+        Scanner.objects.filter(pk='scanner0').update(last_seen=now)
+        self.liveness.seen('scanner0', now - timedelta(minutes=1))
+        self.liveness.seen('scanner1', now - timedelta(minutes=1))
+        self.liveness.flush()
+        self.assertEqual(self.last_seen()['scanner0'], now)
+        self.assertEqual(self.last_seen()['scanner1'], now - timedelta(minutes=1))
+
+    def test_sweep(self):
+        now = timezone.now()
+        Scanner.objects.filter(pk='scanner0').update(last_seen=now - timedelta(hours=1))
+        Scanner.objects.filter(pk='scanner1').update(last_seen=now)
+        with mock.patch('midas.liveness._dead', set()):
+            with self.assertLogs('midas.liveness', 'WARNING') as logs:
+                self.assertEqual(liveness.sweep(now), {'scanner0', 'scanner2'})
+            self.assertEqual(len(logs.output), 2)
+
+            Scanner.objects.filter(pk='scanner0').update(last_seen=now)
+            with self.assertLogs('midas.liveness', 'INFO') as logs:
+                self.assertEqual(liveness.sweep(now), {'scanner2'})
+            self.assertEqual(
+                logs.output, ['INFO:midas.liveness:Scanner scanner0 is back']
+            )
+
+    def test_fleet_status(self):
+        self.ping('scanner1')
+        admin = User.objects.create(username='admin', is_staff=True)
+        self.client.force_login(admin)
+        res = self.client.get(reverse('midas:scanners')).json()
+        self.assertEqual(
+            [(s['id'], s['alive']) for s in res],
+            [('scanner0', False), ('scanner1', True), ('scanner2', False)],
+        )
+
+
+class ScannerSocketTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='test', first_name='Test', last_name='User')
+        Scanner.objects.create(id='scanner', name='Test Scanner')
+        ClaimedTag.objects.create(code='DEADBEEF', name='test', owner=user)
+        directory.warm()
+        self.liveness = liveness.Liveness()
+        for patcher in [
+            mock.patch('midas.sockets.liveness', self.liveness),
+            # like the test client, keep the test's transaction open
+            mock.patch('midas.sockets.close_old_connections'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def connect(self):
+        self.to_server = asyncio.Queue()
+        self.to_client = asyncio.Queue()
+        self.server = asyncio.ensure_future(
+            sockets.route(None)(
+                {'type': 'websocket', 'path': '/api/scanner_socket'},
+                self.to_server.get,
+                self.to_client.put,
+            )
+        )
+        await self.to_server.put({'type': 'websocket.connect'})
+        self.assertEqual(await self.to_client.get(), {'type': 'websocket.accept'})
+
+    async def request(self, message):
+        await self.to_server.put(
+            {'type': 'websocket.receive', 'text': json.dumps(message)}
+        )
+        async with asyncio.timeout(5):
+            event = await self.to_client.get()
+        self.assertEqual(event['type'], 'websocket.send')
+        return json.loads(event['text'])
+
+    async def disconnect(self):
+        await self.to_server.put({'type': 'websocket.disconnect', 'code': 1000})
+        await self.server
+
+    async def test_scans(self):
+        await self.connect()
+        hello = await self.request({'type': 'hello', 'device_id': 'scanner'})
+        self.assertEqual(hello, {'status': 'ok', 'message': None})
+        self.assertIsNotNone(self.liveness.last_seen('scanner'))
+
+        for state in ['checkin', 'checkout']:
+            res = await self.request({'type': 'scan', 'tag_id': 'DEADBEEF'})
+            s = RegisterScanResponseSerializer(data=res)
+            self.assertTrue(s.is_valid())
+            self.assertEqual(s.validated_data['state'], state)
+            self.assertEqual(s.validated_data['owner_name'], 'Test User')
+
+        res = await self.request({'type': 'scan', 'tag_id': 'CAFEBABE'})
+        self.assertEqual(res, {'status': 'error', 'message': 'Card not registered'})
+        res = await self.request({'type': 'scan'})
+        self.assertEqual(res['status'], 'error')
+        res = await self.request({'type': 'healthcheck'})
+        self.assertEqual(res['status'], 'ok')
+
+        await self.disconnect()
+        self.assertEqual(await Session.objects.acount(), 1)
+
+    async def test_unknown_scanner(self):
+        await self.connect()
+        res = await self.request({'type': 'hello', 'device_id': 'unknown'})
+        self.assertEqual(res['message'], 'Scanner not authorized')
+        self.assertEqual(
+            await self.to_client.get(), {'type': 'websocket.close', 'code': 4003}
+        )
+        await self.server
+
+    async def test_open_socket_is_alive(self):
+        with mock.patch('midas.sockets.LIVENESS_INTERVAL', 0.01):
+            await self.connect()
+            await self.request({'type': 'hello', 'device_id': 'scanner'})
+            first = self.liveness.last_seen('scanner')
+            await asyncio.sleep(0.05)
+            self.assertGreater(self.liveness.last_seen('scanner'), first)
+            await self.disconnect()
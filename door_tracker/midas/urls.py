@@ -1,4 +1,4 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from drf_spectacular.views import (
     SpectacularAPIView,
     SpectacularRedocView,
@@ -10,9 +10,24 @@ app_name = 'midas'
 urlpatterns = [
     # API
     path('api/auth/', include('rest_framework.urls')),
-    path('api/healthcheck', api.healthcheck, name='healthcheck'),
-    path('api/register_scan', api.register_scan, name='register_scan'),
+    path('api/healthcheck', api.healthcheck_async, name='healthcheck'),
+    path('api/register_scan', api.register_scan_async, name='register_scan'),
+    path('api/sync/healthcheck', api.healthcheck, name='healthcheck_sync'),
+    path('api/sync/register_scan', api.register_scan, name='register_scan_sync'),
+    path('api/register_scans', api.register_scans, name='register_scans'),
     path('api/export/sessions', api.export_sessions_csv, name='export_user'),
+    path(
+        'api/export/sessions/changes',
+        api.export_sessions_changes,
+        name='export_changes',
+    ),
+    re_path(
+        r'^api/export/all_sessions\.(?P<file_format>parquet|arrow)$',
+        api.export_all_sessions,
+        name='export_all',
+    ),
+    path('api/presence', api.present_users, name='presence'),
+    path('api/scanners', api.scanners, name='scanners'),
     path(
         'api/',
         SpectacularRedocView.as_view(url_name='midas:schema'),
@@ -29,8 +44,15 @@ urlpatterns = [
     path('rename_tag', views.rename_tag, name='rename_tag'),
     path('sign_up', views.sign_up, name='sign_up'),
     path('user_profile', views.user_profile, name='user_profile'),
+    path(
+        'user_profile/tag_scan_events',
+        views.tag_scan_events,
+        name='tag_scan_events',
+    ),
     path('user_statistics', views.user_statistics, name='user_statistics'),
     path('team_overview', views.team_overview, name='team_overview'),
+    path('occupancy', views.occupancy, name='occupancy'),
+    path('occupancy/events', views.occupancy_events, name='occupancy_events'),
     path('user_overview', views.user_overview, name='user_overview'),
     path('', views.index, name='index'),
 ]
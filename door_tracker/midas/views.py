@@ -1,3 +1,4 @@
+import json
 from dataclasses import dataclass
 from datetime import datetime, time, timedelta
 from typing import Optional
@@ -10,14 +11,20 @@ from django.contrib.auth.models import User
 from django.contrib.auth.views import LoginView
 from django.core.cache import cache
 from django.db import transaction
-from django.http import HttpResponse, HttpResponseForbidden
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
 from django.utils import timezone
 from django.utils.dateparse import parse_date
 from rest_framework import serializers
 
-from . import statistics
+from . import events, statistics
+from .directory import directory
 from .forms import RegistrationForm
 from .models import (
     Assignment,
@@ -31,12 +38,15 @@ from .models import (
     Session,
     Subteam,
 )
+from .presence import presence
 from .statistics import (
     get_average_week,
+    get_minutes_for_days,
+    get_minutes_per_day,
     get_minutes_this_month,
     get_minutes_this_week,
     get_minutes_today,
-    get_sessions_time,
+    get_sessions_time_per_user,
     get_total_minutes,
 )
 
@@ -164,7 +174,7 @@ def team_overview(request):
     if start_date > end_date:
         start_date, end_date = end_date, start_date
 
-    # Create aware boundaries for get_sessions_time
+    # Create aware boundaries for get_sessions_time_per_user
     start_dt = AMSTERDAM_TZ.localize(datetime.combine(start_date, time.min))
     end_dt = AMSTERDAM_TZ.localize(
         datetime.combine(end_date + timedelta(days=1), time.min)
@@ -196,11 +206,15 @@ def team_overview(request):
     chart_data = []
     total_hours_float = 0.0
 
+    # Calculate minutes spanning exact date range, for all members at once
+    minutes_per_user = get_sessions_time_per_user(
+        [assignment.user for assignment in members], start_dt, end_dt
+    )
+
     for assignment in members:
         user_obj = assignment.user
 
-        # Calculate minutes spanning exact date range
-        minutes = get_sessions_time(user_obj, start_dt, end_dt)
+        minutes = minutes_per_user[user_obj.pk]
         hours = round(minutes / 60.0, 2)
 
         chart_labels.append(user_obj.get_full_name() or user_obj.username)
@@ -263,9 +277,17 @@ def user_overview(request):
         current_user = request.user
 
     # 3. Standard Metrics
-    minutes_today = get_minutes_today(current_user, current_day)
-    minutes_week = get_minutes_this_week(current_user, current_day)
-    minutes_month = get_minutes_this_month(current_user, current_day)
+    today = current_day.date()
+    start_of_week = today - timedelta(days=today.weekday())
+    start_of_month = today.replace(day=1)
+    minutes_today, minutes_week, minutes_month = get_minutes_for_days(
+        current_user,
+        [
+            (today, today),
+            (start_of_week, start_of_week + timedelta(days=6)),
+            (start_of_month, today),
+        ],
+    )
 
     def format_time(minutes):
         hours = int(minutes) // 60
@@ -277,16 +299,12 @@ def user_overview(request):
     chart_data = []
     range_total_minutes = 0
 
-    current_iter_date = start_date
-    while current_iter_date <= end_date:
-        day_minutes = get_minutes_today(current_user, current_iter_date)
-
-        chart_labels.append(current_iter_date.strftime('%b %d'))
+    minutes_per_day = get_minutes_per_day(current_user, start_date, end_date)
+    for day, day_minutes in minutes_per_day.items():
+        chart_labels.append(day.strftime('%b %d'))
         chart_data.append(round(day_minutes / 60.0, 2))
         range_total_minutes += day_minutes
 
-        current_iter_date += timedelta(days=1)
-
     latest_assignment = (
         Assignment.objects.filter_current().filter(user=current_user).first()
     )
@@ -355,7 +373,7 @@ def sign_up(request):
 
 
 def is_checked_in(request):
-    return Session.objects.filter(user=request.user, checkout__isnull=True).exists()
+    return presence.is_present(request.user.pk)
 
 
 def user_status(request):
@@ -397,7 +415,6 @@ class ScanTagSerializer(serializers.Serializer):
 
 def user_profile(request):
     modal_name = request.GET.get('modal')
-    tag_param = request.GET.get('tag')
 
     # Base data
     pending_tags = PendingTag.objects.filter(owner=request.user).values('id', 'name')
@@ -444,16 +461,6 @@ def user_profile(request):
             )
         )
 
-    # Polling modal: check if tag was claimed
-    if modal_name == 'tag_scan' and tag_param:
-        # has this tag been moved to ClaimedTag by the scanner?
-        pending_tag_exists = PendingTag.objects.filter(id=tag_param).exists()
-        if not pending_tag_exists:
-            # pending tag disappeared → must have been claimed
-            return HttpResponse(
-                headers={'HX-Redirect': reverse_lazy('midas:user_profile')}
-            )
-
     # Render profile page normally ---
     return render(
         request,
@@ -470,9 +477,90 @@ def user_profile(request):
     )
 
 
+# how often the tag scan stream checks the database, for when the scan was
+# handled by another worker process; see events.py
+TAG_SCAN_POLL_INTERVAL = 5  # seconds
+
+
+async def tag_scan_events(request):
+    """Server-sent events for the "waiting for scan" modal.
+
+    Sends a single `claimed` event as soon as the pending tag is gone, which
+    normally means the scanner turned it into a claimed tag.
+    """
+    serializer = ScanTagSerializer(data=request.GET)
+    if not serializer.is_valid():
+        return HttpResponseBadRequest()
+    pending_tag_id = serializer.validated_data['tag']
+    user = await request.auser()
+
+    async def stream():
+        topic = events.pending_tag_topic(pending_tag_id)
+        # subscribe before checking, so a scan in between isn't missed
+        async with events.broker.subscribe(topic) as subscription:
+            while await PendingTag.objects.filter(
+                id=pending_tag_id, owner=user
+            ).aexists():
+                try:
+                    await subscription.get(timeout=TAG_SCAN_POLL_INTERVAL)
+                except TimeoutError:
+                    # also lets the server notice closed connections
+                    yield ': keep-alive\n\n'
+        yield f'event: claimed\ndata: {reverse_lazy("midas:user_profile")}\n\n'
+
+    return StreamingHttpResponse(
+        stream(),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def occupancy(request):
+    return render(
+        request,
+        'midas/occupancy.html',
+        {
+            'occupancy': json.loads(presence.occupancy()),
+            'user_status': user_status(request),
+        },
+    )
+
+
+# how often an occupancy stream checks whether another worker process
+# changed the registry; changes in this process are pushed at once
+OCCUPANCY_POLL_INTERVAL = 5  # seconds
+
+
+async def occupancy_events(request):
+    """Server-sent events for the occupancy board.
+
+    Sends an `occupancy` event with the JSON of `Presence.occupancy()` when
+    the stream opens and whenever it changes. Every viewer gets the same
+    string from the registry, so viewers cost no queries.
+    """
+
+    async def stream():
+        sent = None
+        async with events.broker.subscribe(events.PRESENCE_TOPIC) as subscription:
+            while True:
+                occupancy = await presence.aoccupancy()
+                if occupancy != sent:
+                    yield f'event: occupancy\ndata: {occupancy}\n\n'
+                    sent = occupancy
+                try:
+                    await subscription.get(timeout=OCCUPANCY_POLL_INTERVAL)
+                except TimeoutError:
+                    yield ': keep-alive\n\n'
+
+    return StreamingHttpResponse(
+        stream(),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 def get_all_statistics(request):
     date = timezone.now().date()
-    all_stats = []
 
     # Extract filters from request (GET params or POST data)
     user_id = request.GET.get('user')
@@ -514,31 +602,8 @@ def get_all_statistics(request):
     else:
         dates = {timezone.now().date()}
 
-    # Loop through all users and get their statistics
-    for date in dates:
-        for user in users:
-            # Get current assignment
-            assignment = (
-                Assignment.objects.filter(user=user, starting_from__lte=date)
-                .order_by('-starting_from')
-                .first()
-            )  # returns None if no assignment
-            subteams = assignment.subteam_names() if assignment else 'No subteam'
-            quota = assignment.quota.hours if assignment else 'No quota'
-            user_stats = {
-                'name': user.first_name + ' ' + user.last_name,
-                'subteam': subteams,
-                'quota': quota,
-                'date': date,
-                'minutes_today': statistics.get_minutes_today(user, date),
-                'minutes_this_week': statistics.get_minutes_this_week(user, date),
-                'minutes_this_month': statistics.get_minutes_this_month(user, date),
-                'total_minutes': statistics.get_total_minutes(user, date),
-                'average_week': statistics.get_average_week(user, date),
-            }
-            all_stats.append(user_stats)
-
-    return all_stats
+    # Stream the statistics of all users, computed in bulk
+    return statistics.iter_all_statistics(users, dates)
 
 
 @dataclass
@@ -598,6 +663,7 @@ def rename_tag(request):
     tag = get_object_or_404(ClaimedTag, owner=request.user, code=code)
     tag.name = new_tag_name
     tag.save()
+    directory.invalidate()
 
     return redirect('midas:user_profile')
 
@@ -632,6 +698,7 @@ def delete_tag(request):
     tag = get_object_or_404(ClaimedTag, owner=request.user, code=code)
 
     tag.delete()
+    directory.invalidate()
     messages.success(request, 'Tag deleted.')
     return redirect('midas:user_profile')
 
@@ -644,13 +711,13 @@ def checkin(request):
 
     checkin_time = timezone.localtime()
 
-    if Session.objects.filter(user=request.user, checkout__isnull=True).exists():
+    if Session.objects.filter(user=request.user, is_open=True).exists():
         messages.error(request, 'You are already checked in!')
         return redirect(request.POST.get('next'))
 
     try:
         with transaction.atomic():
-            new_session = Session.objects.create(user=request.user)
+            new_session = Session.objects.create(user=request.user, is_open=True)
             Checkin.objects.create(
                 type=LogType.REMOTE,
                 time=checkin_time,
@@ -690,17 +757,21 @@ def checkout(request):
 
     try:
         with transaction.atomic():
-            session = Session.objects.get(
+            session = Session.objects.select_related('checkin').get(
                 user=request.user,
-                checkin__time__date=checkout_time,
-                checkout__isnull=True,
+                is_open=True,
             )
+            # only sessions started on the same day can be checked out
+            if timezone.localdate(session.checkin.time) != timezone.localdate(
+                checkout_time
+            ):
+                raise Session.DoesNotExist
             Checkout.objects.create(
                 type=LogType.REMOTE,
                 time=checkout_time,
                 session=session,
             )
-    except Session.DoesNotExist:
+    except (Session.DoesNotExist, Checkin.DoesNotExist):
         messages.error(request, 'There are no matching sessions')
         return redirect(request.POST.get('next'))
     else:
@@ -12,7 +12,7 @@ in
     runtimeScript = ''
       admin migrate
       admin init_admin
-      daphne -b 0.0.0.0 door_tracker.asgi:application
+      admin serve --bind 0.0.0.0 --workers "''${DJANGO_WORKERS:-1}"
     '';
     runtimeEnv = {
       DJANGO_STATIC_ROOT = cell.packages.static;